@@ -0,0 +1,228 @@
+"""
+Parser backend benchmark
+
+Parses the same pages with every utils.html_parser backend, checks that
+the extracted data is identical to the original BeautifulSoup parser and
+reports the time per page for each page type.
+
+Usage:
+    python -m benchmarks.parser_benchmark                  # synthetic pages
+    python -m benchmarks.parser_benchmark --html-dir DIR   # + saved pages
+
+Saved pages are picked up by file name prefix: product*.html,
+lamthao_listing*.html, skin_listing*.html.
+"""
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+from utils.html_parser import parse_document  # noqa: E402
+from utils.helpers import extract_last_page  # noqa: E402
+from crawlers.listing_crawler import (  # noqa: E402
+    parse_listing_cards_lamthaocosmetics,
+    parse_listing_cards_thegioiskinfood,
+)
+from crawlers.product_crawler import parse_thegioiskinfood_html  # noqa: E402
+import config  # noqa: E402
+
+
+# ========================================
+# Synthetic pages
+# ========================================
+
+def _noise(rng: random.Random, blocks: int) -> str:
+    """Header / menu / footer markup that the parsers must skip"""
+    parts = []
+    for i in range(blocks):
+        items = "".join(
+            f'<li class="menu-item"><a href="/collections/c{i}-{j}">Danh mục {i}-{j}</a></li>'
+            for j in range(rng.randint(5, 15))
+        )
+        parts.append(
+            f'<div class="block-{i}"><ul class="menu">{items}</ul>'
+            f'<script>var block{i} = {{"a": [{", ".join(str(rng.randint(0, 999)) for _ in range(20))}]}};</script>'
+            f'<!-- block {i} --><p>&nbsp;Miễn phí vận chuyển &amp; đổi trả</p></div>'
+        )
+    return "".join(parts)
+
+
+def _page(body: str, rng: random.Random) -> str:
+    head = "".join(f'<link rel="stylesheet" href="/s{i}.css">' for i in range(20))
+    return (
+        f'<!DOCTYPE html><html><head><meta charset="utf-8">{head}'
+        f'<style>.x{{color:red}}</style></head><body>'
+        f'{_noise(rng, 15)}{body}{_noise(rng, 10)}</body></html>'
+    )
+
+
+def _pagination(page: int, last: int) -> str:
+    links = "".join(f'<a href="?page={i}">{i}</a>' for i in range(1, min(last, 5) + 1))
+    return (
+        f'<div class="pagination"><span class="current">{page}</span>{links}'
+        f'<span>…</span><a href="?page={last}">Cuối</a></div>'
+    )
+
+
+def skin_product_page(rng: random.Random, i: int) -> str:
+    variants = rng.choice([0, 1, 3])
+    options = "".join(
+        f'<option value="{1000 + v}" data-title="Size {v}" data-sku="SKU{i}-{v}" '
+        f'data-price="{rng.randint(100, 900)}00000" data-max-order="{rng.randint(0, 5)}" '
+        f'data-max="{rng.randint(0, 50)}">Size {v}</option>'
+        for v in range(variants)
+    )
+    old_price = f'<div class="page-product-info-oldprice"><span>{rng.randint(300, 900)}.000₫</span></div>' if i % 3 else ""
+    body = (
+        f'<div class="product-detail"><h1 class="page-product-info-title"> Sản phẩm &amp; {i} <!-- x --></h1>'
+        f'<div class="vendor">Thương hiệu: <a class="fill-vendor" href="/collections/b"><span> Brand {i % 7}</span></a></div>'
+        f'{old_price}<div class="page-product-info-newprice"><span>{rng.randint(100, 299)}.000₫</span></div>'
+        f'<div class="sold-qtt">Đã bán <strong>{rng.randint(0, 5000)}</strong></div>'
+        f'<select id="product-select" name="id">{options}</select>'
+        f'<select class="single-option-selector"><option>Size</option></select></div>'
+        f'<div class="related">' + "".join(
+            f'<div class="proLoop"><p class="productName"><a href="/products/r{k}">R{k}</a></p>'
+            f'<div class="page-product-info-newprice"><span>1.000₫</span></div></div>'
+            for k in range(8)
+        ) + '</div>'
+    )
+    return _page(body, rng)
+
+
+def lamthao_listing_page(rng: random.Random, i: int) -> str:
+    cards = "".join(
+        f'<div class="product-inner" data-proid="{"" if k == 5 else 10_000 + i * 100 + k}">'
+        f'<div class="image"><img src="/i{k}.jpg"></div>'
+        f'<h3 class="titleproduct"><a href="/products/p{i}-{k}"> Sản phẩm {i}-{k} <span>mới</span></a></h3>'
+        f'<div class="price">{rng.randint(100, 900)}.000₫</div></div>'
+        for k in range(rng.randint(12, 24))
+    )
+    return _page(f'<div class="collection">{cards}</div>{_pagination(1, rng.randint(1, 12))}', rng)
+
+
+def skin_listing_page(rng: random.Random, i: int) -> str:
+    cards = []
+    for k in range(rng.randint(12, 24)):
+        product_id = 20_000 + i * 100 + k
+        if k % 4 == 0:
+            id_markup = f'<button class="js-favorites btn" data-id="{product_id}">♥</button>'
+        else:
+            id_markup = f'<div class="hrv-crv-container" data-product-id="{product_id}"></div>'
+        vendor = f'<div class="loopvendor"><a class="fill-vendor">Brand {k % 3}</a></div>' if k % 5 else ""
+        cards.append(
+            f'<div class="proLoop"><p class="productName"><a href="/products/s{i}-{k}">Skin {i}-{k}</a></p>'
+            f'{vendor}{id_markup}</div>'
+        )
+    return _page(f'<div class="collection">{"".join(cards)}</div>{_pagination(1, rng.randint(1, 12))}', rng)
+
+
+# ========================================
+# Extraction per page type
+# ========================================
+
+def _extract_product(doc, index: int):
+    return parse_thegioiskinfood_html(doc, f"thegioiskinfood-{index}", f"/products/p{index}")
+
+
+def _extract_lamthao_listing(doc, index: int):
+    return parse_listing_cards_lamthaocosmetics(doc, "Brand"), extract_last_page(doc)
+
+
+def _extract_skin_listing(doc, index: int):
+    return parse_listing_cards_thegioiskinfood(doc, "Brand"), extract_last_page(doc)
+
+
+PAGE_TYPES: Dict[str, tuple] = {
+    # name: (generator, extractor, parse_document page_type)
+    "product": (skin_product_page, _extract_product, "product"),
+    "lamthao_listing": (lamthao_listing_page, _extract_lamthao_listing, "listing"),
+    "skin_listing": (skin_listing_page, _extract_skin_listing, "listing"),
+}
+
+
+def _variants() -> Dict[str, Callable]:
+    """Parser variants: name -> parse(html, page_type)"""
+    def baseline(html: str, page_type: str):
+        return BeautifulSoup(html, "lxml")
+
+    def bs4_regions(html: str, page_type: str):
+        config.HTML_PARSE_ONLY_REGIONS = True
+        return parse_document(html, page_type, backend="bs4")
+
+    def lxml_xpath(html: str, page_type: str):
+        return parse_document(html, page_type, backend="lxml")
+
+    return {"bs4 (baseline)": baseline, "bs4 + regions": bs4_regions, "lxml + xpath": lxml_xpath}
+
+
+def run(pages: Dict[str, List[str]], repeat: int) -> bool:
+    variants = _variants()
+    identical = True
+
+    print(f"{'page type':<16} {'pages':>5}  " + "  ".join(f"{name:>16}" for name in variants) + "   speedup")
+    for page_type, htmls in pages.items():
+        if not htmls:
+            continue
+        _, extract, doc_type = PAGE_TYPES[page_type]
+
+        expected = [extract(variants["bs4 (baseline)"](html, doc_type), i) for i, html in enumerate(htmls)]
+        timings = {}
+        for name, parse in variants.items():
+            outputs = [extract(parse(html, doc_type), i) for i, html in enumerate(htmls)]
+            if outputs != expected:
+                identical = False
+                for i, (got, want) in enumerate(zip(outputs, expected)):
+                    if got != want:
+                        print(f"  MISMATCH {name} {page_type}[{i}]:\n    got  {got}\n    want {want}")
+                        break
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for i, html in enumerate(htmls):
+                    extract(parse(html, doc_type), i)
+            timings[name] = (time.perf_counter() - start) / (repeat * len(htmls)) * 1000
+
+        baseline_ms = timings["bs4 (baseline)"]
+        best = min(timings.values())
+        print(
+            f"{page_type:<16} {len(htmls):>5}  "
+            + "  ".join(f"{timings[name]:>13.2f} ms" for name in variants)
+            + f"   {baseline_ms / best:>6.1f}x"
+        )
+
+    print("Output identical to baseline:", "YES" if identical else "NO")
+    return identical
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HTML parser backends")
+    parser.add_argument("--pages", type=int, default=30, help="Synthetic pages per page type")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed passes over the pages")
+    parser.add_argument("--html-dir", help="Directory with saved pages (product*.html, lamthao_listing*.html, skin_listing*.html)")
+    parser.add_argument("--seed", type=int, default=2024)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    pages = {
+        page_type: [generator(rng, i) for i in range(args.pages)]
+        for page_type, (generator, _, _) in PAGE_TYPES.items()
+    }
+
+    if args.html_dir:
+        for page_type in PAGE_TYPES:
+            for path in sorted(glob.glob(os.path.join(args.html_dir, f"{page_type}*.html"))):
+                with open(path, encoding="utf-8", errors="replace") as handle:
+                    pages[page_type].append(handle.read())
+
+    sys.exit(0 if run(pages, args.repeat) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,491 @@
+"""
+End-to-end pipeline benchmark
+
+Starts a local aiohttp server that plays both websites and the review API
+from fixtures, runs listing_crawler_only and then main_pipeline against it
+(DB_BACKEND = "files" in a temporary directory) and reports per stage:
+pages/s, p50 / p95 request latency, CPU time and peak RSS.
+
+    lamthaocosmetics   127.0.0.1  collection pages + product pages (F1GENZ_vars)
+    thegioiskinfood    127.0.0.2  collection pages (.proLoop) + product pages
+    review API         127.0.0.3  Haravan product_rating JSON
+
+Every response can be delayed (--latency + random --jitter) or replaced by
+an injected 429 / 500 / 503 (--error-rate). Config values are overridden
+with --set, so one config change is judged by running the benchmark twice.
+
+Usage:
+    python -m benchmarks.pipeline_benchmark
+    python -m benchmarks.pipeline_benchmark --brands 10 --products 80 --latency 0.2 --jitter 0.1
+    python -m benchmarks.pipeline_benchmark --error-rate 0.02 --set AIMD_INITIAL_LIMIT=8
+    python -m benchmarks.pipeline_benchmark --no-rate-limit --json result.json
+
+Pages/s and latency come from the run's request scheduler (time on the wire
+of successful requests, pages/s over the stage's active time). CPU time and
+peak RSS are measured per run: each entry point runs in its own process, so
+the product and review stages of main_pipeline share one figure.
+
+Recorded pages are picked up from --fixtures-dir by file name prefix:
+lamthao_listing*.html, skin_listing*.html, lamthao_product*.html,
+skin_product*.html, review*.json. They replace the synthetic page of that
+type (served round robin); product ids then come from the recorded pages.
+"""
+import argparse
+import ast
+import asyncio
+import functools
+import glob
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import urllib.request
+import zlib
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web  # noqa: E402
+
+from benchmarks.parser_benchmark import _page, _pagination, skin_product_page  # noqa: E402
+import config  # noqa: E402
+
+W1_HOST = "127.0.0.1"
+W2_HOST = "127.0.0.2"
+REVIEW_HOST = "127.0.0.3"
+
+# (run, entry point) in execution order: the pipeline reads the listings of the first run
+RUNS = [
+    ("listing", "listing_crawler_only"),
+    ("pipeline", "main_pipeline"),
+]
+STAGES = {
+    "listing": ["listing"],
+    "pipeline": ["product", "review"],
+}
+
+
+# ========================================
+# Fixtures
+# ========================================
+
+def _brand_index(brand: str) -> int:
+    digits = "".join(ch for ch in brand if ch.isdigit())
+    return int(digits) if digits else zlib.crc32(brand.encode()) % 1000
+
+
+def _load_recorded(fixtures_dir: Optional[str]) -> Dict[str, List[str]]:
+    recorded = {}
+    if not fixtures_dir:
+        return recorded
+    for kind, pattern in (
+        ("lamthao_listing", "lamthao_listing*.html"),
+        ("skin_listing", "skin_listing*.html"),
+        ("lamthao_product", "lamthao_product*.html"),
+        ("skin_product", "skin_product*.html"),
+        ("review", "review*.json"),
+    ):
+        files = sorted(glob.glob(os.path.join(fixtures_dir, pattern)))
+        if files:
+            recorded[kind] = [open(path, encoding="utf-8").read() for path in files]
+    return recorded
+
+
+class Fixtures:
+    """Deterministic pages of every brand; recorded pages replace their type"""
+
+    def __init__(self, products: int, page_size: int, reviews: int, seed: int, recorded: Dict[str, List[str]]):
+        self.products = products
+        self.page_size = page_size
+        self.reviews = reviews
+        self.seed = seed
+        self.recorded = recorded
+
+    def _rng(self, *key) -> random.Random:
+        return random.Random(f"{self.seed}-" + "-".join(map(str, key)))
+
+    def _recorded(self, kind: str, key: int) -> Optional[str]:
+        pages = self.recorded.get(kind)
+        return pages[key % len(pages)] if pages else None
+
+    def brand_size(self, source: str, brand: str) -> int:
+        return self._rng(source, brand).randint(max(1, self.products // 2), max(1, self.products * 3 // 2))
+
+    def product_id(self, source: str, brand: str, k: int) -> int:
+        offset = 1_000_000 if source == "lamthao" else 2_000_000
+        return offset + _brand_index(brand) * 10_000 + k
+
+    @functools.lru_cache(maxsize=4096)
+    def listing_page(self, source: str, brand: str, page: int) -> str:
+        recorded = self._recorded(f"{source}_listing", page - 1)
+        if recorded is not None:
+            return recorded
+
+        rng = self._rng(source, brand, page)
+        size = self.brand_size(source, brand)
+        last = max(1, -(-size // self.page_size))
+        first = (page - 1) * self.page_size
+        cards = []
+        for k in range(first, min(size, first + self.page_size)):
+            product_id = self.product_id(source, brand, k)
+            if source == "lamthao":
+                cards.append(
+                    f'<div class="product-inner" data-proid="{product_id}">'
+                    f'<div class="image"><img src="/i{k}.jpg"></div>'
+                    f'<h3 class="titleproduct"><a href="/products/lt-{product_id}"> {brand} {k} </a></h3>'
+                    f'<div class="price">{rng.randint(100, 900)}.000₫</div></div>'
+                )
+            else:
+                cards.append(
+                    f'<div class="proLoop"><p class="productName"><a href="/products/sk-{product_id}">{brand} {k}</a></p>'
+                    f'<div class="loopvendor"><a class="fill-vendor">{brand}</a></div>'
+                    f'<div class="hrv-crv-container" data-product-id="{product_id}"></div></div>'
+                )
+        pagination = _pagination(page, last) if cards else ""
+        return _page(f'<div class="collection">{"".join(cards)}</div>{pagination}', rng)
+
+    @functools.lru_cache(maxsize=4096)
+    def product_page(self, source: str, handle: str) -> str:
+        _, _, tail = handle.rpartition("-")
+        product_id = int(tail) if tail.isdigit() else zlib.crc32(handle.encode())
+        recorded = self._recorded(f"{source}_product", product_id)
+        if recorded is not None:
+            return recorded
+
+        rng = self._rng(source, product_id)
+        if source == "skin":
+            return skin_product_page(rng, product_id)
+
+        price = rng.randint(100, 900) * 1000
+        data = {
+            "id": product_id,
+            "title": f"Sản phẩm {product_id}",
+            "handle": handle,
+            "vendor": f"Brand {product_id // 10_000 % 100}",
+            "type": "Chăm sóc da",
+            "price_min": price * 100,
+            "compare_at_price_min": (price + rng.randint(0, 200) * 1000) * 100,
+            "available": rng.random() > 0.1,
+            "variants": [
+                {"sku": f"SKU{product_id}-{v}", "inventory_quantity": rng.randint(0, 50)}
+                for v in range(rng.randint(1, 3))
+            ],
+        }
+        body = (
+            f'<script>window.F1GENZ_vars = {{ shop: {{ name: "lamthao" }}, '
+            f'product: {{ data: {json.dumps(data, ensure_ascii=False)}, other: {{}} }} }};</script>'
+            f'<div class="product-detail"><h1>{data["title"]}</h1>'
+            f'<div class="bottomloopend21">Đã bán {rng.randint(0, 5000)}</div></div>'
+        )
+        return _page(body, rng)
+
+    def review_page(self, product_id: int, page: int, limit: int) -> Dict[str, Any]:
+        recorded = self._recorded("review", product_id)
+        if recorded is not None:
+            data = json.loads(recorded)
+            per_page = max(1, len(data.get("list_ratings") or []))
+            pages = -(-(data.get("total") or 0) // per_page)
+            if page > pages:
+                data["list_ratings"] = []
+            return data
+
+        rng = self._rng("review", product_id)
+        total = rng.randint(0, self.reviews)
+        first = (page - 1) * limit
+        ratings = []
+        # Newest first: review number total is on page 1
+        for number in range(total - first, max(0, total - first - limit), -1):
+            ratings.append({
+                "id": f"{product_id}-{number}",
+                "product_id": product_id,
+                "rating": 1 + (number * 7) % 5,
+                "content": f"Đánh giá {number} của sản phẩm {product_id}",
+                "source_cr_at": f"2024-01-{1 + number % 28:02d}T10:00:00Z",
+            })
+        return {"list_ratings": ratings, "total": total, "page": page, "limit": limit}
+
+
+# ========================================
+# Mock server
+# ========================================
+
+def _kind(request: web.Request) -> str:
+    if request.host.split(":")[0] == REVIEW_HOST:
+        return "review"
+    return "product" if request.path.startswith("/products/") else "listing"
+
+
+def build_app(fixtures: Fixtures, latency: float, jitter: float, error_rate: float, seed: int) -> web.Application:
+    rng = random.Random(seed)
+    counters: Dict[str, Dict[str, int]] = {}
+
+    @web.middleware
+    async def inject(request: web.Request, handler):
+        if request.path == "/__stats":
+            return await handler(request)
+        counter = counters.setdefault(_kind(request), {"requests": 0, "errors": 0})
+        counter["requests"] += 1
+        delay = latency + rng.uniform(0, jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if rng.random() < error_rate:
+            counter["errors"] += 1
+            return web.Response(status=rng.choice((429, 500, 503)))
+        return await handler(request)
+
+    def site(request: web.Request) -> str:
+        return "lamthao" if request.host.split(":")[0] == W1_HOST else "skin"
+
+    async def listing(request: web.Request):
+        source = site(request)
+        brand = request.query.get("q") if source == "lamthao" else request.match_info["brand"]
+        page = int(request.query.get("page", 1))
+        return web.Response(text=fixtures.listing_page(source, brand, page), content_type="text/html")
+
+    async def product(request: web.Request):
+        return web.Response(text=fixtures.product_page(site(request), request.match_info["handle"]), content_type="text/html")
+
+    async def review(request: web.Request):
+        product_id = int(request.query["product_id"])
+        page = int(request.query.get("page", 1))
+        limit = int(request.query.get("limit", config.REVIEW_API_LIMIT))
+        return web.json_response(fixtures.review_page(product_id, page, limit))
+
+    async def stats(request: web.Request):
+        snapshot = {kind: dict(counter) for kind, counter in counters.items()}
+        if "reset" in request.query:
+            counters.clear()
+        return web.json_response(snapshot)
+
+    app = web.Application(middlewares=[inject])
+    app.router.add_get("/collections/{brand}", listing)
+    app.router.add_get("/products/{handle}", product)
+    app.router.add_get("/product_rating", review)
+    app.router.add_get("/__stats", stats)
+    return app
+
+
+def _serve(options: Dict[str, Any], ready):
+    fixtures = Fixtures(
+        options["products"], options["page_size"], options["reviews"],
+        options["seed"], _load_recorded(options["fixtures_dir"])
+    )
+    app = build_app(fixtures, options["latency"], options["jitter"], options["error_rate"], options["seed"])
+
+    async def serve():
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        for host in (W1_HOST, W2_HOST, REVIEW_HOST):
+            await web.TCPSite(runner, host, options["port"]).start()
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+def server_stats(port: int) -> Dict[str, Dict[str, int]]:
+    with urllib.request.urlopen(f"http://{W1_HOST}:{port}/__stats?reset=1") as response:
+        return json.loads(response.read())
+
+
+# ========================================
+# Crawl runs
+# ========================================
+
+def _configure(options: Dict[str, Any]):
+    """Point config at the mock server (plus --set overrides) before the entry point runs"""
+    port = options["port"]
+    production_limits = {
+        W1_HOST: urlparse(config.WEBSITE_1_BASE).hostname,
+        W2_HOST: urlparse(config.WEBSITE_2_BASE).hostname,
+        REVIEW_HOST: urlparse(config.REVIEW_API_BASE).hostname,
+    }
+    config.HOST_RATE_LIMITS = {
+        host: (1e6, 1_000_000) if options["no_rate_limit"]
+        else config.HOST_RATE_LIMITS.get(name, config.DEFAULT_HOST_RATE_LIMIT)
+        for host, name in production_limits.items()
+    }
+
+    config.WEBSITE_1_BASE = f"http://{W1_HOST}:{port}"
+    config.WEBSITE_1_PRODUCTS = f"{config.WEBSITE_1_BASE}/collections/vendors?q={{brand}}&page={{page}}"
+    config.WEBSITE_2_BASE = f"http://{W2_HOST}:{port}"
+    config.WEBSITE_2_PRODUCTS = f"{config.WEBSITE_2_BASE}/collections/{{brand}}"
+    config.WEBSITE_2_PRODUCTS_PAGE = f"{config.WEBSITE_2_BASE}/collections/{{brand}}?page={{page}}"
+    config.REVIEW_API_BASE = f"http://{REVIEW_HOST}:{port}/product_rating"
+
+    config.DB_BACKEND = "files"
+    config.FILE_SINK_DIR = options["sink_dir"]
+    config.RESPONSE_CACHE_MODE = "off"
+
+    for name, value in options["overrides"].items():
+        setattr(config, name, value)
+
+
+def _usage() -> Dict[str, float]:
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "cpu": own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+        # ru_maxrss is in KiB on Linux
+        "rss_mb": own.ru_maxrss / 1024,
+        "worker_rss_mb": children.ru_maxrss / 1024,
+    }
+
+
+def _crawl(run: str, entry: str, options: Dict[str, Any], results):
+    """Run one entry point (own process, so CPU / RSS belong to this run only)"""
+    from utils.logger import get_logger
+    logger = get_logger()
+    logger.remove()
+    logger.add(sys.stderr, level=options["log_level"])
+
+    # read_brands_from_file() reads config.BRANDS_FILE relative to the working directory
+    os.chdir(options["work_dir"])
+    _configure(options)
+
+    import importlib
+    from utils.async_helpers import get_scheduler
+    module = importlib.import_module(entry)
+    main = module.run_listing_crawler_async if run == "listing" else module.run_pipeline_async
+
+    before = _usage()
+    start = time.perf_counter()
+    asyncio.run(main())
+    wall = time.perf_counter() - start
+    after = _usage()
+
+    scheduler = get_scheduler()
+    results.put({
+        "run": run,
+        "wall": wall,
+        "cpu": after["cpu"] - before["cpu"],
+        "rss_mb": after["rss_mb"],
+        "worker_rss_mb": after["worker_rss_mb"],
+        "stages": {stage: scheduler.latency_stats(stage) for stage in STAGES[run]},
+    })
+
+
+def run_benchmark(options: Dict[str, Any]) -> List[Dict[str, Any]]:
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    server = context.Process(target=_serve, args=(options, ready), daemon=True)
+    server.start()
+    try:
+        if not ready.wait(30):
+            raise RuntimeError("Mock server did not start")
+
+        reports = []
+        for run, entry in RUNS:
+            results = context.Queue()
+            process = context.Process(target=_crawl, args=(run, entry, options, results))
+            process.start()
+            report = results.get()
+            process.join()
+            report["server"] = server_stats(options["port"])
+            reports.append(report)
+        return reports
+    finally:
+        server.terminate()
+        server.join()
+
+
+# ========================================
+# Report
+# ========================================
+
+def _ms(value: Optional[float]) -> str:
+    return f"{value * 1000:8.1f}" if value is not None else f"{'n/a':>8}"
+
+
+def print_report(reports: List[Dict[str, Any]]):
+    print(f"\n{'run':<9} {'stage':<8} {'pages':>7} {'errors':>7} {'pages/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'injected':>9}")
+    print("-" * 72)
+    for report in reports:
+        for stage, stats in report["stages"].items():
+            rate = stats["requests"] / stats["seconds"] if stats["seconds"] else 0.0
+            injected = report["server"].get(stage, {}).get("errors", 0)
+            print(
+                f"{report['run']:<9} {stage:<8} {stats['requests']:>7} {stats['errors']:>7} {rate:>8.1f} "
+                f"{_ms(stats['p50'])} {_ms(stats['p95'])} {injected:>9}"
+            )
+
+    print(f"\n{'run':<9} {'wall s':>8} {'CPU s':>8} {'CPU %':>7} {'RSS MiB':>8} {'workers MiB':>12}")
+    print("-" * 57)
+    for report in reports:
+        print(
+            f"{report['run']:<9} {report['wall']:>8.2f} {report['cpu']:>8.2f} "
+            f"{report['cpu'] / report['wall']:>7.0%} {report['rss_mb']:>8.1f} {report['worker_rss_mb']:>12.1f}"
+        )
+
+
+def _override(text: str):
+    name, sep, value = text.partition("=")
+    if not sep or not hasattr(config, name):
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE with an existing config name: {text}")
+    try:
+        return name, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return name, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark listing_crawler_only + main_pipeline against a local mock server")
+    parser.add_argument("--brands", type=int, default=5, help="Brands in the run")
+    parser.add_argument("--products", type=int, default=40, help="Average products per brand and website")
+    parser.add_argument("--page-size", type=int, default=24, help="Products per collection page")
+    parser.add_argument("--reviews", type=int, default=30, help="Max reviews per thegioiskinfood product")
+    parser.add_argument("--latency", type=float, default=0.05, help="Base response latency (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Random extra latency, uniform 0..jitter (seconds)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of responses replaced by 429 / 500 / 503")
+    parser.add_argument("--no-rate-limit", action="store_true", help="Lift HOST_RATE_LIMITS (measure the crawler, not the politeness limits)")
+    parser.add_argument("--set", dest="overrides", type=_override, action="append", default=[], metavar="NAME=VALUE", help="Override a config value, e.g. MAX_GLOBAL_REQUESTS=300")
+    parser.add_argument("--fixtures-dir", help="Directory with recorded pages (see module docstring)")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--seed", type=int, default=2024)
+    parser.add_argument("--log-level", default="WARNING", help="Crawler log level during the runs")
+    parser.add_argument("--json", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="pipeline-benchmark-") as work_dir:
+        with open(os.path.join(work_dir, config.BRANDS_FILE), "w", encoding="utf-8") as f:
+            f.write("\n".join(f"brand{i:03d}" for i in range(1, args.brands + 1)) + "\n")
+
+        options = {
+            "products": args.products,
+            "page_size": args.page_size,
+            "reviews": args.reviews,
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "error_rate": args.error_rate,
+            "no_rate_limit": args.no_rate_limit,
+            "overrides": dict(args.overrides),
+            "fixtures_dir": os.path.abspath(args.fixtures_dir) if args.fixtures_dir else None,
+            "port": args.port,
+            "seed": args.seed,
+            "log_level": args.log_level,
+            "work_dir": work_dir,
+            "sink_dir": os.path.join(work_dir, "sink"),
+        }
+        print(
+            f"{args.brands} brands x ~{args.products} products x 2 websites, latency {args.latency}s "
+            f"+ 0..{args.jitter}s, error rate {args.error_rate:.1%}, "
+            f"rate limits {'off' if args.no_rate_limit else 'config.HOST_RATE_LIMITS'}, overrides {options['overrides'] or '-'}"
+        )
+        reports = run_benchmark(options)
+
+    print_report(reports)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"options": dict(vars(args), overrides=options["overrides"]), "runs": reports}, f, indent=2)
+
+    failed = any(stats["requests"] == 0 for report in reports for stats in report["stages"].values())
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Async listing crawler for concurrent processing
+Shares the pooled aiohttp session from utils.async_helpers
+"""
+import asyncio
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable
+from uuid import UUID
+
+from utils.logger import get_logger
+from utils.async_helpers import fetch_pages_async
+from utils.helpers import normalize_brand_name
+from utils.parse_pool import run_parse
+from utils.scheduler import STAGE_LISTING
+from crawlers.listing_crawler import parse_listing_page
+import config
+
+logger = get_logger()
+
+
+async def _save_listings(page_listings: List[Dict[str, Any]], session_id: UUID, db, source_name: str) -> List[Dict[str, Any]]:
+    """
+    Save parsed listing cards in one bulk call
+    
+    Returns:
+        Stored listings, each flagged with is_new (False for duplicates)
+    """
+    new_ids = await db.insert_listings_bulk(session_id, source_name, page_listings)
+    if new_ids is None:
+        return []
+    
+    return [
+        {
+            "product_id": str(listing_data["id"]),
+            "product_url": listing_data["url"],
+            "is_new": str(listing_data["id"]) in new_ids,
+        }
+        for listing_data in page_listings
+        if listing_data.get("id") is not None
+    ]
+
+
+def _listing_page_parser(source_name: str, brand: str) -> Callable[[str], Awaitable[Tuple[List[Dict[str, Any]], Optional[int]]]]:
+    """
+    Build the parse_page callback used by fetch_pages_async
+    Pages are parsed in the parse pool (utils.parse_pool)
+    """
+    def parse_page(html_content: str):
+        return run_parse(parse_listing_page, html_content, source_name, brand)
+    
+    return parse_page
+
+
+async def crawl_listing_lamthaocosmetics_async(
+    brand: str,
+    session_id: UUID,
+    db
+) -> List[Dict[str, Any]]:
+    """
+    Async version of crawl_listing_lamthaocosmetics
+    Pages are fanned out concurrently by fetch_pages_async
+
+    Args:
+        brand: Brand name
+        session_id: Session UUID
+        db: AsyncDatabaseHandler
+
+    Returns:
+        List of listing dicts (product_id, product_url, is_new)
+    """
+    brand_normalized = normalize_brand_name(brand)
+
+    logger.info(f"[ASYNC LISTING] Start {brand} from {config.WEBSITE_1_NAME}")
+
+    try:
+        page_listings = await fetch_pages_async(
+            lambda page: config.WEBSITE_1_PRODUCTS.format(brand=brand_normalized, page=page),
+            _listing_page_parser(config.WEBSITE_1_NAME, brand),
+            STAGE_LISTING,
+            key=lambda listing_data: listing_data["id"]
+        )
+        listings = await _save_listings(page_listings, session_id, db, config.WEBSITE_1_NAME)
+
+    except Exception as exc:
+        logger.error(f"[ASYNC LISTING] Error {brand}: {exc}")
+        return []
+
+    logger.success(f"[ASYNC LISTING] {config.WEBSITE_1_NAME}: {brand} - {sum(1 for listing in listings if listing['is_new'])} NEW/{len(page_listings)} listings")
+    return listings
+
+
+async def crawl_listing_thegioiskinfood_async(
+    brand: str,
+    session_id: UUID,
+    db
+) -> List[Dict[str, Any]]:
+    """
+    Async version of crawl_listing_thegioiskinfood
+    Unlike the sync version every page of the collection is crawled
+
+    Args:
+        brand: Brand name
+        session_id: Session UUID
+        db: AsyncDatabaseHandler
+
+    Returns:
+        List of listing dicts (product_id, product_url, is_new)
+    """
+    brand_normalized = normalize_brand_name(brand)
+
+    logger.info(f"[ASYNC LISTING] Start {brand} from {config.WEBSITE_2_NAME}")
+
+    try:
+        page_listings = await fetch_pages_async(
+            lambda page: config.WEBSITE_2_PRODUCTS_PAGE.format(brand=brand_normalized, page=page),
+            _listing_page_parser(config.WEBSITE_2_NAME, brand),
+            STAGE_LISTING,
+            key=lambda listing_data: listing_data["id"]
+        )
+        listings = await _save_listings(page_listings, session_id, db, config.WEBSITE_2_NAME)
+
+    except Exception as exc:
+        logger.error(f"[ASYNC LISTING] Error {brand}: {exc}")
+        return []
+
+    logger.success(f"[ASYNC LISTING] {config.WEBSITE_2_NAME}: {brand} - {sum(1 for listing in listings if listing['is_new'])} NEW/{len(page_listings)} listings")
+    return listings
+
+
+async def crawl_brand_listings_concurrent(
+    brand: str,
+    sessions: Dict[str, UUID],
+    db
+) -> Dict[str, int]:
+    """
+    Crawl listings of one brand on both websites concurrently
+
+    Args:
+        brand: Brand name
+        sessions: Session IDs dict keyed by source name
+        db: AsyncDatabaseHandler
+
+    Returns:
+        Stats dict with NEW listing counts per website
+    """
+    results = await asyncio.gather(
+        crawl_listing_lamthaocosmetics_async(brand, sessions[config.WEBSITE_1_NAME], db),
+        crawl_listing_thegioiskinfood_async(brand, sessions[config.WEBSITE_2_NAME], db),
+        return_exceptions=True
+    )
+
+    stats = {"listings_1": 0, "listings_2": 0}
+    for key, result in zip(("listings_1", "listings_2"), results):
+        if isinstance(result, Exception):
+            logger.error(f"[ASYNC LISTING] {brand} {key} error: {result}")
+        else:
+            stats[key] = sum(1 for listing in result if listing["is_new"])
+
+    return stats
@@ -1,250 +1,135 @@
 """
 Async product crawler for concurrent processing
 """
-import asyncio
 from typing import Dict, Any, Optional
-from uuid import UUID
 from urllib.parse import urljoin
-from bs4 import BeautifulSoup
 
 from utils.logger import get_logger
-from utils.async_helpers import make_request_with_semaphore
-from utils.helpers import parse_html
+from utils.async_helpers import make_request_async
+from utils.scheduler import STAGE_PRODUCT
+from utils.validator_store import ValidatorStore
+from utils.parse_pool import run_parse
 from crawlers.product_crawler import (
-    parse_thegioiskinfood_html,
-    transform_lamthao_json
+    parse_thegioiskinfood_page,
+    parse_lamthaocosmetics_page
 )
 import config
-import json
-import re
 
 logger = get_logger()
 
 
-async def crawl_product_detail_thegioiskinfood_async(
-    listing: Dict[str, Any], 
-    session_id: UUID, 
-    db,
-    semaphore: asyncio.Semaphore
-) -> Optional[Dict[str, Any]]:
+def _source_base(source_name: str) -> str:
+    return config.WEBSITE_1_BASE if source_name == config.WEBSITE_1_NAME else config.WEBSITE_2_BASE
+
+
+async def fetch_product_page(
+    source_name: str,
+    listing: Dict[str, Any],
+    validators: ValidatorStore = None
+):
     """
-    Async version of crawl_product_detail_thegioiskinfood
+    Fetch one product page (no parsing, no database write)
     
     Args:
+        source_name: lamthaocosmetics / thegioiskinfood
         listing: Listing data
-        session_id: Session UUID
-        db: Database handler (thread-safe)
-        semaphore: Semaphore for concurrency control
+        validators: Optional validator store for conditional GET
         
     Returns:
-        Product data dict or None
+        HTML, NOT_MODIFIED or None
     """
-    product_url = listing['product_url']
-    product_id = listing['product_id']
-    
-    full_url = urljoin(config.WEBSITE_2_BASE, product_url)
+    full_url = urljoin(_source_base(source_name), listing['product_url'])
     logger.info(f"[ASYNC PRODUCT] Crawl detail: {full_url}")
     
     try:
-        # Async request with site-specific delay
-        html_content = await make_request_with_semaphore(
-            full_url, 
-            semaphore, 
-            delay=config.WEBSITE_2_DELAY
+        # Async request (per-host rate limit)
+        return await make_request_async(
+            full_url,
+            validators=validators,
+            stage=STAGE_PRODUCT
         )
-        
-        if not html_content:
-            return None
-        
-        # Parse HTML (sync operation, but fast)
-        soup = parse_html(html_content)
-        if not soup:
-            return None
-        
-        # Parse data
-        transformed_json = parse_thegioiskinfood_html(soup, product_id, product_url)
-        
-        # Save to database (sync operation - database is thread-safe)
-        product_data = {
-            "product_id": product_id,
-            "source_name": config.WEBSITE_2_NAME,
-            "data": transformed_json
-        }
-        
-        
-        if db.insert_product(session_id, product_data):
-            logger.success(f"[ASYNC PRODUCT] Saved: {transformed_json.get('name', '')[:50]}")
-        else:
-            logger.info(f"[ASYNC PRODUCT] Duplicate (already in DB): {product_id}")
-        
-        # Return product info regardless of duplicate status for review crawling
-        return {
-            "id": transformed_json.get('id'),
-            "product_id": product_id,
-            "name": transformed_json.get('name', '')
-        }
-            
     except Exception as exc:
-        logger.error(f"[ASYNC PRODUCT] Error {product_id}: {exc}")
+        logger.error(f"[ASYNC PRODUCT] Error {listing['product_id']}: {exc}")
         return None
 
 
-async def crawl_product_detail_lamthaocosmetics_async(
-    listing: Dict[str, Any],
-    session_id: UUID,
-    db,
-    semaphore: asyncio.Semaphore
-) -> Optional[Dict[str, Any]]:
+async def parse_product_page(source_name: str, listing: Dict[str, Any], html_content: str) -> Optional[Dict[str, Any]]:
     """
-    Async version of crawl_product_detail_lamthaocosmetics
+    Parse one product page in the parse pool so the event loop keeps downloading
     
-    Args:
-        listing: Listing data
-        session_id: Session UUID
-        db: Database handler (thread-safe)
-        semaphore: Semaphore for concurrency control
-        
     Returns:
-        Product data dict or None
+        product_data dict (product_id, source_name, data) or None
     """
-    product_url = listing['product_url']
     product_id = listing['product_id']
-    
-    full_url = urljoin(config.WEBSITE_1_BASE, product_url)
-    logger.info(f"[ASYNC PRODUCT] Crawl detail: {full_url}")
-    
     try:
-        # Async request with site-specific delay
-        html_content = await make_request_with_semaphore(
-            full_url,
-            semaphore,
-            delay=config.WEBSITE_1_DELAY
-        )
-        
-        if not html_content:
-            return None
-        
-        soup = parse_html(html_content)
-        if not soup:
-            return None
-        
-        # Extract JSON from window.F1GENZ_vars.product.data
-        raw_json = None
-        for script in soup.find_all('script'):
-            if not script.string or 'window.F1GENZ_vars' not in script.string:
-                continue
-            
-            text = script.string
-            data_start = text.find('product:')
-            if data_start == -1:
-                continue
-            
-            data_key_pos = text.find('data:', data_start)
-            if data_key_pos == -1:
-                continue
-            
-            brace_start = text.find('{', data_key_pos)
-            if brace_start == -1:
-                continue
-            
-            # Count braces
-            depth = 0
-            i = brace_start
-            while i < len(text):
-                if text[i] == '{':
-                    depth += 1
-                elif text[i] == '}':
-                    depth -= 1
-                    if depth == 0:
-                        json_str = text[brace_start:i+1]
-                        try:
-                            raw_json = json.loads(json_str)
-                            break
-                        except json.JSONDecodeError:
-                            break
-                i += 1
-            
-            if raw_json:
-                break
-        
-        if not raw_json:
-            logger.warning(f"[ASYNC PRODUCT] No JSON found: {product_id}")
-            return None
-        
-        # Parse bought count
-        bought_count = 0
-        bought_elem = soup.select_one(".bottomloopend21")
-        if bought_elem:
-            bought_text = bought_elem.get_text(strip=True)
-            match = re.search(r'(\d+)', bought_text)
-            if match:
-                bought_count = int(match.group(1))
-        
-        # Transform
-        transformed_json = transform_lamthao_json(raw_json, bought_count)
-        
-        # Save
-        product_data = {
-            "product_id": product_id,
-            "source_name": config.WEBSITE_1_NAME,
-            "data": transformed_json
-        }
-        
-        if db.insert_product(session_id, product_data):
-            logger.success(f"[ASYNC PRODUCT] Saved: {transformed_json.get('name', '')[:50]}")
-            return transformed_json
+        if source_name == config.WEBSITE_1_NAME:
+            # Extract JSON + bought straight from the raw HTML
+            transformed_json = await run_parse(parse_lamthaocosmetics_page, html_content)
+            if not transformed_json:
+                logger.warning(f"[ASYNC PRODUCT] No JSON found: {product_id}")
         else:
-            logger.info(f"[ASYNC PRODUCT] Duplicate: {product_id}")
-            return None
-            
+            transformed_json = await run_parse(parse_thegioiskinfood_page, html_content, product_id, listing['product_url'])
     except Exception as exc:
-        logger.error(f"[ASYNC PRODUCT] Error {product_id}: {exc}")
+        logger.error(f"[ASYNC PRODUCT] Parse error {product_id}: {exc}")
         return None
+    
+    if not transformed_json:
+        return None
+    
+    return {
+        "product_id": product_id,
+        "source_name": source_name,
+        "data": transformed_json
+    }
 
 
-async def crawl_products_concurrent(
-    listings: list,
-    session_id: UUID,
-    db,
-    source_name: str
-) -> Dict[str, int]:
+def unchanged_product_info(listing: Dict[str, Any], full_url: str, validators: ValidatorStore) -> Optional[Dict[str, Any]]:
+    """Product info of an unchanged page, from the validator meta of its last write"""
+    meta = validators.meta(full_url) or {}
+    if not meta.get("snapshot_id"):
+        return None
+    return {
+        "id": meta.get("id"),
+        "product_id": listing["product_id"],
+        "name": meta.get("name", ''),
+        "snapshot_id": meta["snapshot_id"],
+        "is_new": False,
+    }
+
+
+def saved_product_info(
+    product_data: Dict[str, Any],
+    snapshot: Optional[Dict[str, Any]],
+    full_url: str,
+    validators: ValidatorStore = None
+) -> Optional[Dict[str, Any]]:
     """
-    Crawl multiple products concurrently
+    Product info of a persisted product; commits its validators
     
     Args:
-        listings: List of listing dicts
-        session_id: Session UUID
-        db: Database handler
-        source_name: Source name (lamthaocosmetics/thegioiskinfood)
-        
-    Returns:
-        Stats dict with counts
+        product_data: Parsed product (product_id, source_name, data)
+        snapshot: {"snapshot_id", "is_new"} returned by the insert, or None
+        full_url: Product page URL
+        validators: Optional validator store
     """
-    if not listings:
-        return {"products": 0, "reviews": 0}
-    
-    semaphore = asyncio.Semaphore(config.MAX_CONCURRENT_REQUESTS)
-    
-    # Choose crawler based on source
-    if source_name == config.WEBSITE_1_NAME:
-        crawler = crawl_product_detail_lamthaocosmetics_async
-    else:
-        crawler = crawl_product_detail_thegioiskinfood_async
-    
-    # Create tasks
-    tasks = [
-        crawler(listing, session_id, db, semaphore)
-        for listing in listings
-    ]
-    
-    # Execute concurrently
-    logger.info(f"[CONCURRENT] Processing {len(tasks)} products for {source_name}")
-    results = await asyncio.gather(*tasks, return_exceptions=True)
+    if not snapshot or not snapshot["snapshot_id"]:
+        logger.warning(f"[ASYNC PRODUCT] Not saved: {product_data['product_id']}")
+        return None
     
-    # Count successful products
-    products_count = sum(1 for r in results if r and not isinstance(r, Exception))
-    errors_count = sum(1 for r in results if isinstance(r, Exception))
+    transformed_json = product_data["data"]
+    product_info = {
+        "id": transformed_json.get('id'),
+        "product_id": product_data["product_id"],
+        "name": transformed_json.get('name', ''),
+        "snapshot_id": snapshot["snapshot_id"],
+        "is_new": snapshot["is_new"],
+    }
     
-    logger.success(f"[CONCURRENT] {source_name}: {products_count} products, {errors_count} errors")
+    if validators is not None:
+        validators.commit(full_url, {
+            "id": product_info["id"],
+            "name": product_info["name"],
+            "snapshot_id": product_info["snapshot_id"],
+        })
     
-    return {"products": products_count, "results": [r for r in results if r and not isinstance(r, Exception)]}
+    return product_info
@@ -1,13 +1,27 @@
 """
 OPTIMIZED Async review crawler for BIG DATA
 Fetches multiple review pages concurrently for maximum speed
+
+Products with a review watermark are synced incrementally: a one-review
+probe of page 1 skips unchanged products, otherwise pages are read from
+page 1 only until the known newest review shows up.
 """
 import asyncio
-from typing import Optional, List, Dict, Any
+from typing import Optional, Dict, Any, List
 from uuid import UUID
 
 from utils.logger import get_logger
-from utils.async_helpers import make_request_with_semaphore
+from utils.async_helpers import make_request_async
+from utils.parse_pool import run_parse
+from utils.scheduler import STAGE_REVIEW
+from crawlers.review_crawler import (
+    newest_review_key,
+    review_api_url,
+    review_delta_page,
+    review_gap_pages,
+    review_gap_result,
+    sync_new_reviews,
+)
 import config
 import json
 
@@ -17,7 +31,7 @@ logger = get_logger()
 async def fetch_review_page(
     product_numeric_id: int,
     page: int,
-    semaphore: asyncio.Semaphore
+    limit: int = None
 ) -> Optional[Dict[str, Any]]:
     """
     Fetch a single review page
@@ -25,32 +39,22 @@ async def fetch_review_page(
     Args:
         product_numeric_id: Numeric product ID
         page: Page number
-        semaphore: Semaphore for rate limiting
+        limit: Reviews per page (default config.REVIEW_API_LIMIT)
         
     Returns:
         Review data dict or None
     """
-    api_url = (
-        f"{config.REVIEW_API_BASE}"
-        f"?org_id={config.REVIEW_API_ORG_ID}"
-        f"&product_id={product_numeric_id}"
-        f"&page={page}"
-        f"&limit={config.REVIEW_API_LIMIT}"
-        f"&source_cr_at=desc"
-    )
+    api_url = review_api_url(product_numeric_id, page, limit)
     
     try:
-        response_text = await make_request_with_semaphore(
-            api_url,
-            semaphore,
-            delay=config.REVIEW_DELAY  # Faster delay for reviews
-        )
+        response_text = await make_request_async(api_url, stage=STAGE_REVIEW)
         
         if not response_text:
             return None
         
         try:
-            data = json.loads(response_text)
+            # Big review pages are decoded in the parse pool
+            data = await run_parse(json.loads, response_text)
             return {"page": page, "data": data}
         except json.JSONDecodeError as e:
             logger.error(f"[REVIEW] JSON error page {page}: {e}")
@@ -61,12 +65,133 @@ async def fetch_review_page(
         return None
 
 
+async def _save_review_delta(
+    db,
+    product_id: str,
+    product_snapshot_id: int,
+    session_id: UUID,
+    reviews: List[Dict[str, Any]],
+    total: int
+) -> Optional[int]:
+    """
+    Store reviews as one delta row
+    
+    Returns:
+        Number of rows inserted, None if they could not be stored
+    """
+    delta_page = await db.get_next_review_delta_page(product_id)
+    if delta_page is None:
+        return None
+    statuses = await db.insert_reviews_bulk(session_id, [
+        review_delta_page(product_id, product_snapshot_id, session_id, delta_page, reviews, total)
+    ])
+    # duplicate: already stored by an earlier run that stopped before its watermark
+    if not any(status["status"] in ("inserted", "duplicate") for status in statuses):
+        return None
+    return sum(1 for status in statuses if status["status"] == "inserted")
+
+
+async def _bootstrap_watermark_async(
+    product_numeric_id: int,
+    product_id: str,
+    session_id: UUID,
+    db,
+    product_snapshot_id: int,
+    start_page: int,
+    total_pages: int
+) -> int:
+    """
+    First watermark of a product crawled by page from start_page > 1
+    
+    Re-reads pages 1..start_page-1 concurrently (review_gap_pages), stores
+    their reviews as one delta row, then writes the watermark taken from
+    page 1, so reviews added between runs are never marked as synced.
+    
+    Returns:
+        Number of delta rows saved
+    """
+    pages = review_gap_pages(start_page, total_pages)
+    results = await asyncio.gather(*(fetch_review_page(product_numeric_id, page) for page in pages))
+    gap = review_gap_result([result["data"] if result else None for result in results])
+    if gap is None:
+        logger.warning(f"[REVIEW] {product_id}: pages 1-{pages[-1]} not read, no watermark yet")
+        return 0
+    
+    total_saved = 0
+    if gap["reviews"]:
+        total_saved = await _save_review_delta(db, product_id, product_snapshot_id, session_id, gap["reviews"], gap["total"])
+        if total_saved is None:
+            logger.warning(f"[REVIEW] Could not save pages 1-{pages[-1]} of {product_id}, no watermark yet")
+            return 0
+    
+    await db.upsert_review_watermarks([{
+        "product_id": product_id,
+        "last_total": gap["total"],
+        "newest_review_id": gap["newest_review_id"],
+    }])
+    return total_saved
+
+
+async def crawl_new_reviews_async(
+    product_numeric_id: int,
+    product_id: str,
+    session_id: UUID,
+    db,
+    product_snapshot_id: int,
+    watermark: Dict[str, Any]
+) -> int:
+    """
+    Incremental sync: store only the reviews newer than the watermark
+    (algorithm in review_crawler.sync_new_reviews)
+    
+    Args:
+        watermark: {"last_total", "newest_review_id"} of the previous sync
+        
+    Returns:
+        Number of pages (delta rows) saved
+    """
+    sync = sync_new_reviews(watermark)
+    try:
+        requests = next(sync)
+        while True:
+            results = await asyncio.gather(*(
+                fetch_review_page(product_numeric_id, page, limit) for page, limit in requests
+            ))
+            requests = sync.send([result["data"] if result else None for result in results])
+    except StopIteration as stop:
+        result = stop.value
+    
+    if result is None:
+        logger.warning(f"[REVIEW] Review sync failed for {product_id}, keeping the old watermark")
+        return 0
+    
+    total = result["total"]
+    new_watermark = {"product_id": product_id, "last_total": total, "newest_review_id": result["newest_review_id"]}
+    if result["unchanged"]:
+        if watermark.get("newest_review_id") is None and result["newest_review_id"] is not None:
+            await db.upsert_review_watermarks([new_watermark])
+        logger.debug(f"[REVIEW] {product_id}: {total} reviews, unchanged")
+        return 0
+    
+    new_reviews = result["new_reviews"]
+    total_saved = 0
+    if new_reviews:
+        total_saved = await _save_review_delta(db, product_id, product_snapshot_id, session_id, new_reviews, total)
+        if total_saved is None:
+            logger.warning(f"[REVIEW] Could not save {len(new_reviews)} new reviews for {product_id}")
+            return 0
+    
+    await db.upsert_review_watermarks([new_watermark])
+    logger.success(f"[REVIEW] {product_id}: +{len(new_reviews)} new reviews ({total} total)")
+    return total_saved
+
+
 async def crawl_reviews_thegioiskinfood_async(
     product_numeric_id: int,
     product_id: str,
     session_id: UUID,
     db,
-    semaphore: asyncio.Semaphore
+    product_snapshot_id: Optional[int] = None
 ) -> int:
     """
     OPTIMIZED: Fetch all review pages concurrently
@@ -75,8 +200,8 @@ async def crawl_reviews_thegioiskinfood_async(
         product_numeric_id: Numeric product ID
         product_id: String product ID
         session_id: Session UUID
-        db: Database handler
-        semaphore: Semaphore for concurrency control
+        db: AsyncDatabaseHandler
+        product_snapshot_id: Snapshot id returned by insert_product (skips the lookup)
         
     Returns:
         Number of pages saved
@@ -85,20 +210,28 @@ async def crawl_reviews_thegioiskinfood_async(
         logger.warning(f"[REVIEW] No product_numeric_id for {product_id}")
         return 0
     
-    # Get product snapshot ID
-    product_snapshot_id = db.get_latest_product_snapshot_id(product_id)
+    # Get product snapshot ID (already known when the product was just ingested)
+    if not product_snapshot_id:
+        product_snapshot_id = await db.get_latest_product_snapshot_id(product_id)
     if not product_snapshot_id:
         logger.warning(f"[REVIEW] No product snapshot for {product_id}")
         return 0
     
+    if config.REVIEW_INCREMENTAL:
+        watermark = await db.get_review_watermark(product_id)
+        if watermark is not None:
+            return await crawl_new_reviews_async(
+                product_numeric_id, product_id, session_id, db, product_snapshot_id, watermark
+            )
+    
     # Resume capability
-    latest_page = db.get_latest_review_page(product_id)
+    latest_page = await db.get_latest_review_page(product_id)
     start_page = latest_page + 1 if latest_page > 0 else 1
     
     logger.info(f"[REVIEW] Start concurrent crawl for product_id={product_numeric_id}, from page {start_page}")
     
     # STEP 1: Fetch first page to get total count
-    first_page_result = await fetch_review_page(product_numeric_id, start_page, semaphore)
+    first_page_result = await fetch_review_page(product_numeric_id, start_page)
     
     if not first_page_result:
         logger.warning(f"[REVIEW] No data on first page {start_page}")
@@ -107,76 +240,90 @@ async def crawl_reviews_thegioiskinfood_async(
     first_data = first_page_result["data"]
     reviews = first_data.get("list_ratings", [])
     
+    # Calculate total pages
+    total_reviews = first_data.get("total", 0)
+    total_pages = (total_reviews + config.REVIEW_API_LIMIT - 1) // config.REVIEW_API_LIMIT
+    
+    async def store_watermark() -> int:
+        """Watermark for the next incremental sync; a resumed crawl takes it from page 1"""
+        if not config.REVIEW_INCREMENTAL:
+            return 0
+        if start_page > 1:
+            return await _bootstrap_watermark_async(
+                product_numeric_id, product_id, session_id, db, product_snapshot_id, start_page, total_pages
+            )
+        await db.upsert_review_watermarks([{
+            "product_id": product_id,
+            "last_total": total_reviews,
+            "newest_review_id": newest_review_key(first_data),
+        }])
+        return 0
+    
     if not reviews or len(reviews) == 0:
         logger.info(f"[REVIEW] No reviews found")
-        return 0
+        return await store_watermark()
     
-    # Save first page
-    review_data = {
+    # Pages are persisted together in one bulk call at the end
+    review_pages = [{
         "product_id": product_id,
         "product_snapshot_id": product_snapshot_id,
         "session_id": session_id,
         "pages": start_page,
         "data": first_data
-    }
-    
-    total_saved = 1 if db.insert_review(review_data) else 0
-    
-    # Calculate total pages
-    total_reviews = first_data.get("total", 0)
-    total_pages = (total_reviews + config.REVIEW_API_LIMIT - 1) // config.REVIEW_API_LIMIT
+    }]
     
     logger.info(f"[REVIEW] Product {product_id} has {total_reviews} reviews ({total_pages} pages)")
     
     # Smart early stopping: Check if already crawled all pages
     if latest_page >= total_pages:
         logger.info(f"[REVIEW] Product {product_id}: Already crawled all {total_pages} pages (latest={latest_page})")
-        return 0
-    
-    if total_pages <= start_page:
-        logger.success(f"[REVIEW] Only 1 page for {product_id}")
-        return total_saved
+        return await store_watermark()
     
     # STEP 2: Fetch remaining pages CONCURRENTLY
     remaining_pages = list(range(start_page + 1, total_pages + 1))
     
-    if not remaining_pages:
-        return total_saved
-    
-    logger.info(f"[REVIEW] Fetching {len(remaining_pages)} pages concurrently for {product_id}")
-    
-    # Create semaphore for review pages
-    review_semaphore = asyncio.Semaphore(config.MAX_REVIEW_CONCURRENT_PAGES)
+    if remaining_pages:
+        logger.info(f"[REVIEW] Fetching {len(remaining_pages)} pages concurrently for {product_id}")
+        
+        # Fetch all pages concurrently (bounded by the scheduler's review stage budget)
+        tasks = [
+            fetch_review_page(product_numeric_id, page)
+            for page in remaining_pages
+        ]
+        
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        for result in results:
+            if result and not isinstance(result, Exception) and result.get("data"):
+                page_num = result["page"]
+                page_data = result["data"]
+                
+                # Check if has reviews
+                page_reviews = page_data.get("list_ratings", [])
+                if not page_reviews:
+                    continue
+                
+                review_pages.append({
+                    "product_id": product_id,
+                    "product_snapshot_id": product_snapshot_id,
+                    "session_id": session_id,
+                    "pages": page_num,
+                    "data": page_data
+                })
     
-    # Fetch all pages concurrently
-    tasks = [
-        fetch_review_page(product_numeric_id, page, review_semaphore)
-        for page in remaining_pages
-    ]
+    # STEP 3: Save all pages in one bulk call
+    statuses = await db.insert_reviews_bulk(session_id, review_pages)
+    total_saved = sum(1 for status in statuses if status["status"] == "inserted")
+    duplicates = sum(1 for status in statuses if status["status"] == "duplicate")
+    failed = len(statuses) - total_saved - duplicates
     
-    results = await asyncio.gather(*tasks, return_exceptions=True)
+    # Every page fetched and stored: later runs only sync what is newer
+    complete = len(review_pages) == total_pages - start_page + 1
+    if complete and not failed:
+        total_saved += await store_watermark()
     
-    # STEP 3: Save all successful pages
-    for result in results:
-        if result and not isinstance(result, Exception) and result.get("data"):
-            page_num = result["page"]
-            page_data = result["data"]
-            
-            # Check if has reviews
-            page_reviews = page_data.get("list_ratings", [])
-            if not page_reviews:
-                continue
-            
-            review_data = {
-                "product_id": product_id,
-                "product_snapshot_id": product_snapshot_id,
-                "session_id": session_id,
-                "pages": page_num,
-                "data": page_data
-            }
-            
-            if db.insert_review(review_data):
-                total_saved += 1
-    
-    logger.success(f"[REVIEW] Saved {total_saved}/{total_pages} pages for {product_id}")
+    logger.success(
+        f"[REVIEW] Saved {total_saved}/{total_pages} pages for {product_id} "
+        f"({duplicates} duplicate, {failed} failed)"
+    )
     return total_saved
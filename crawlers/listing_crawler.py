@@ -5,20 +5,131 @@ Thu thập product_id và brand_id từ collection pages và lưu vào listing_a
 IMPORTANT: listing_api chỉ có product_id và brand_id, KHÔNG có data column
 Product_id phải là số thuần như "1067440535"
 """
-import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from uuid import UUID
 from urllib.parse import urljoin
 
-from bs4 import BeautifulSoup
-
 from utils.logger import get_logger
-from utils.helpers import make_request, parse_html, normalize_brand_name, delay_request
+from utils.helpers import make_request, normalize_brand_name, delay_request, extract_last_page
+from utils.html_parser import parse_document, as_document
 import config
 
 logger = get_logger()
 
 
+def parse_listing_cards_lamthaocosmetics(soup, brand: str) -> List[Dict[str, Any]]:
+    """
+    Parse product cards của một trang collection lamthaocosmetics
+    Trả về listing_data theo format json.txt (không ghi database)
+    
+    soup: BeautifulSoup hoặc document của utils.html_parser
+    """
+    doc = as_document(soup)
+    results = []
+    for card in doc.select("lamthao_card"):
+        title_link = doc.select_one("lamthao_card_title", card)
+        if title_link is None:
+            continue
+        
+        relative_url = doc.attr(title_link, "href", "").strip()
+        name = doc.text(title_link)
+        
+        if not relative_url or not name:
+            continue
+        
+        # Extract product numeric ID từ data-proid attribute
+        product_id = doc.attr(card, "data-proid")
+        
+        # Fallback: extract từ URL
+        if not product_id:
+            logger.warning(f"[LISTING] No data-proid for {name}, skipping")
+            continue
+        
+        # Extract data theo format json.txt
+        # LamThaoCosmetics - Collection Page
+        results.append({
+            "id": int(product_id) if product_id.isdigit() else None,
+            "sku": None,
+            "name": name,
+            "url": relative_url,
+            "brand": {
+                "name": brand
+            }
+        })
+    
+    return results
+
+
+def parse_listing_cards_thegioiskinfood(soup, brand: str) -> List[Dict[str, Any]]:
+    """
+    Parse product cards của một trang collection thegioiskinfood
+    Trả về listing_data theo format json.txt (không ghi database)
+    
+    soup: BeautifulSoup hoặc document của utils.html_parser
+    """
+    doc = as_document(soup)
+    results = []
+    for card in doc.select("skin_card"):
+        title_link = doc.select_one("skin_card_title", card)
+        if title_link is None:
+            continue
+        
+        relative_url = doc.attr(title_link, "href", "").strip()
+        name = doc.text(title_link)
+        
+        brand_text_elem = doc.select_one("skin_card_vendor", card)
+        brand_text = doc.text(brand_text_elem) if brand_text_elem is not None else brand
+        
+        if not relative_url or not name:
+            continue
+        
+        # Extract product numeric ID từ data-product-id hoặc data-id
+        product_id = None
+        
+        # Method 1: hrv-crv-container (review widget)
+        review_container = doc.select_one("skin_card_review", card)
+        if review_container is not None:
+            product_id = doc.attr(review_container, "data-product-id")
+        
+        # Method 2: button favorites
+        if not product_id:
+            fav_button = doc.select_one("skin_card_favorite", card)
+            if fav_button is not None:
+                product_id = doc.attr(fav_button, "data-id")
+        
+        if not product_id:
+            logger.warning(f"[LISTING] No product ID for {name}, skipping")
+            continue
+        
+        # Construct JSON data
+        results.append({
+            "id": int(product_id) if product_id and product_id.isdigit() else None,
+            "name": name,
+            "url": relative_url,
+            "brand": {
+                "name": brand_text,
+                "url": f"/collections/all?vendors={brand_text}"
+            }
+        })
+    
+    return results
+
+
+def parse_listing_page(html_content: str, source_name: str, brand: str) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """
+    HTML trang collection -> (listing cards, số trang cuối hoặc None)
+    Hàm thuần (input/output là dữ liệu thường) nên chạy được trong parse pool
+    """
+    doc = parse_document(html_content, "listing")
+    if not doc:
+        return [], None
+    if source_name == config.WEBSITE_1_NAME:
+        cards = parse_listing_cards_lamthaocosmetics(doc, brand)
+    else:
+        cards = parse_listing_cards_thegioiskinfood(doc, brand)
+    return cards, extract_last_page(doc)
+
+
 def crawl_listing_lamthaocosmetics(brand: str, session_id: UUID, db) -> List[Dict[str, Any]]:
     """
     Crawl collection page từ lamthaocosmetics với pagination
@@ -44,60 +155,31 @@ def crawl_listing_lamthaocosmetics(brand: str, session_id: UUID, db) -> List[Dic
                 logger.warning(f"[LISTING] Không nhận được response (page {page})")
                 break
             
-            soup = parse_html(response.text)
-            if not soup:
+            doc = parse_document(response.text, "listing")
+            if not doc:
                 logger.warning(f"[LISTING] Không parse được HTML (page {page})")
                 break
             
-            product_cards = soup.select("div.product-inner")
+            page_listings = parse_listing_cards_lamthaocosmetics(doc, brand)
             
-            if not product_cards or len(product_cards) == 0:
+            if not page_listings:
                 logger.info(f"[LISTING] Hết sản phẩm ở trang {page}")
                 break
             
-            logger.info(f"[LISTING] {config.WEBSITE_1_NAME} trang {page}: tìm thấy {len(product_cards)} sản phẩm")
+            logger.info(f"[LISTING] {config.WEBSITE_1_NAME} trang {page}: tìm thấy {len(page_listings)} sản phẩm")
             
-            page_count = 0
-            for card in product_cards:
-                title_link = card.select_one("h3.titleproduct a")
-                if not title_link:
-                    continue
-                
-                relative_url = title_link.get("href", "").strip()
-                name = title_link.get_text(strip=True)
-                
-                if not relative_url or not name:
-                    continue
-                
-                # Extract product numeric ID từ data-proid attribute
-                product_id = card.get("data-proid")
-                
-                # Fallback: extract từ URL
-                if not product_id:
-                    logger.warning(f"[LISTING] No data-proid for {name}, skipping")
-                    continue
-                
-                # Extract data theo format json.txt
-                # LamThaoCosmetics - Collection Page
-                listing_data = {
-                    "id": int(product_id) if product_id.isdigit() else None,
-                    "sku": None,
-                    "name": name,
-                    "url": relative_url,
-                    "brand": {
-                        "name": brand
-                    }
-                }
-                
-                # Insert vào database - Full JSON data
-                if db.insert_listing(session_id, config.WEBSITE_1_NAME, listing_data):
+            # Insert cả trang vào database trong 1 RPC - Full JSON data
+            new_ids = db.insert_listings_bulk(session_id, config.WEBSITE_1_NAME, page_listings)
+            if new_ids is not None:
+                for listing_data in page_listings:
+                    if listing_data.get("id") is None:
+                        continue
                     listings.append({
-                        "product_id": product_id,
-                        "product_url": relative_url,
+                        "product_id": str(listing_data["id"]),
+                        "product_url": listing_data["url"],
                     })
-                    page_count += 1
             
-            logger.success(f"[LISTING] {config.WEBSITE_1_NAME} trang {page}: Lưu {page_count}/{len(product_cards)} listings")
+            logger.success(f"[LISTING] {config.WEBSITE_1_NAME} trang {page}: {len(new_ids or [])} NEW/{len(page_listings)} listings")
             
             # Next page
             page += 1
@@ -127,82 +209,27 @@ def crawl_listing_thegioiskinfood(brand: str, session_id: UUID, db) -> List[Dict
         if not response:
             return []
         
-        soup = parse_html(response.text)
-        if not soup:
+        doc = parse_document(response.text, "listing")
+        if not doc:
             return []
         
         listings = []
-        product_cards = soup.select("div.proLoop")
+        page_listings = parse_listing_cards_thegioiskinfood(doc, brand)
         
-        logger.info(f"[LISTING] {config.WEBSITE_2_NAME}: tìm thấy {len(product_cards)} sản phẩm")
+        logger.info(f"[LISTING] {config.WEBSITE_2_NAME}: tìm thấy {len(page_listings)} sản phẩm")
         
-        for card in product_cards:
-            title_link = card.select_one("p.productName a")
-            if not title_link:
-                continue
-            
-            relative_url = title_link.get("href", "").strip()
-            name = title_link.get_text(strip=True)
-            
-            brand_text_elem = card.select_one(".loopvendor .fill-vendor")
-            brand_text = brand_text_elem.get_text(strip=True) if brand_text_elem else brand
-            
-            if not relative_url or not name:
-                continue
-            
-            # Extract product numeric ID từ data-product-id hoặc data-id
-            product_id = None
-            
-            # Method 1: hrv-crv-container (review widget)
-            review_container = card.select_one("[data-product-id]")
-            if review_container:
-                product_id = review_container.get("data-product-id")
-            
-            # Method 2: button favorites
-            if not product_id:
-                fav_button = card.select_one("button.js-favorites[data-id]")
-                if fav_button:
-                    product_id = fav_button.get("data-id")
-            
-            if not product_id:
-                logger.warning(f"[LISTING] No product ID for {name}, skipping")
-                continue
-            
-            # Extract price info
-            price_elem = card.select_one(".proPrice .pro-price")
-            market_price_elem = card.select_one(".proPrice .pro-price-del .compare-price")
-            
-            final_price_str = price_elem.get_text(strip=True) if price_elem else "0₫"
-            market_price_str = market_price_elem.get_text(strip=True) if market_price_elem else final_price_str
-            
-            # Parse numeric price (simple version)
-            try:
-                price_val = int(re.sub(r"[^\d]", "", final_price_str))
-            except:
-                price_val = 0
-                
-            # Availability
-            sold_out = card.select_one(".sold-out") is not None
-            
-            # Construct JSON data
-            listing_data = {
-                "id": int(product_id) if product_id and product_id.isdigit() else None,
-                "name": name,
-                "url": relative_url,
-                "brand": {
-                    "name": brand_text,
-                    "url": f"/collections/all?vendors={brand_text}"
-                }
-            }
-            
-            # Insert vào database - Full JSON data
-            if db.insert_listing(session_id, config.WEBSITE_2_NAME, listing_data):
+        # Insert cả trang vào database trong 1 RPC - Full JSON data
+        new_ids = db.insert_listings_bulk(session_id, config.WEBSITE_2_NAME, page_listings)
+        if new_ids is not None:
+            for listing_data in page_listings:
+                if listing_data.get("id") is None:
+                    continue
                 listings.append({
-                    "product_id": product_id,
-                    "product_url": relative_url,
+                    "product_id": str(listing_data["id"]),
+                    "product_url": listing_data["url"],
                 })
         
-        logger.success(f"[LISTING] {config.WEBSITE_2_NAME}: Lưu {len(listings)}/{len(product_cards)} listings")
+        logger.success(f"[LISTING] {config.WEBSITE_2_NAME}: {len(new_ids or [])} NEW/{len(page_listings)} listings")
         return listings
         
     except Exception as exc:
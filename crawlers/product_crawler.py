@@ -5,14 +5,14 @@ CHỈ thêm fields NẾU HTML có data - không tạo field giả
 """
 import re
 import json
-from typing import Dict, Any, Optional
+import html
+from typing import Dict, Any, Optional, Tuple
 from uuid import UUID
 from urllib.parse import urljoin
 
-from bs4 import BeautifulSoup
-
 from utils.logger import get_logger
 from utils.helpers import make_request, parse_html
+from utils.html_parser import parse_document, as_document
 import config
 
 logger = get_logger()
@@ -96,11 +96,130 @@ def transform_lamthao_json(raw_json: Dict, bought_count: int = 0) -> Dict:
     return result
 
 
-def parse_thegioiskinfood_html(soup: BeautifulSoup, product_id: str, product_url: str) -> Dict:
+_JSON_DECODER = json.JSONDecoder()
+# Thẻ mở có class bottomloopend21 (nháy đơn hoặc kép; không khớp data-class=...)
+_BOUGHT_OPEN_RE = re.compile(
+    r'<([a-zA-Z0-9]+)[^>]*(?<![\w-])class\s*=\s*'
+    r'(?:"[^"]*\bbottomloopend21\b[^"]*"|\'[^\']*\bbottomloopend21\b[^\']*\')[^>]*>'
+)
+_TAG_RE = re.compile(r'<[^>]+>')
+_NUMBER_RE = re.compile(r'(\d+)')
+
+
+def _find_lamthao_json_start(text: str, start: int = 0) -> int:
+    """
+    Vị trí '{' của window.F1GENZ_vars ... product: ... data: {...}, -1 nếu không có
+    """
+    vars_pos = text.find('window.F1GENZ_vars', start)
+    if vars_pos == -1:
+        return -1
+    data_start = text.find('product:', vars_pos)
+    if data_start == -1:
+        return -1
+    data_key_pos = text.find('data:', data_start)
+    if data_key_pos == -1:
+        return -1
+    return text.find('{', data_key_pos)
+
+
+def _extract_lamthao_fast(html_content: str) -> Tuple[Optional[Dict], Optional[int]]:
+    """
+    Fast path: tìm payload trực tiếp trong HTML thô, không dựng DOM
+    JSON được decode bằng 1 lần raw_decode (C scanner) thay vì đếm ngoặc
+    
+    Returns:
+        (raw_json hoặc None, bought_count hoặc None nếu không chắc chắn)
+    """
+    raw_json = None
+    brace_start = _find_lamthao_json_start(html_content)
+    if brace_start != -1:
+        try:
+            raw_json, _ = _JSON_DECODER.raw_decode(html_content, brace_start)
+        except json.JSONDecodeError:
+            raw_json = None
+    
+    bought_count = 0
+    match = _BOUGHT_OPEN_RE.search(html_content)
+    if match:
+        tag = match.group(1).lower()
+        close_pos = html_content.find(f'</{tag}>', match.end())
+        segment = html_content[match.end():close_pos] if close_pos != -1 else ''
+        if close_pos == -1 or f'<{tag}' in segment.lower():
+            # Nested element cùng tag - để DOM xử lý
+            return raw_json, None
+        # Giống get_text(strip=True): strip từng đoạn text rồi nối lại
+        text = ''.join(part.strip() for part in _TAG_RE.split(segment))
+        number = _NUMBER_RE.search(html.unescape(text))
+        if number:
+            bought_count = int(number.group(1))
+    elif 'bottomloopend21' in html_content:
+        # Có class nhưng markup lạ (không nhận ra thẻ mở) - để DOM xử lý thay vì trả 0
+        return raw_json, None
+    
+    return raw_json, bought_count
+
+
+def _extract_lamthao_dom(html_content: str) -> Tuple[Optional[Dict], int]:
+    """
+    Fallback: dựng DOM và quét các thẻ <script> như trước
+    """
+    soup = parse_html(html_content)
+    if not soup:
+        return None, 0
+    
+    raw_json = None
+    for script in soup.find_all('script'):
+        if not script.string or 'window.F1GENZ_vars' not in script.string:
+            continue
+        brace_start = _find_lamthao_json_start(script.string)
+        if brace_start == -1:
+            continue
+        try:
+            raw_json, _ = _JSON_DECODER.raw_decode(script.string, brace_start)
+            break
+        except json.JSONDecodeError as e:
+            logger.warning(f"JSON parse error: {e}")
+    
+    bought_count = 0
+    bought_elem = soup.select_one(".bottomloopend21")
+    if bought_elem:
+        match = _NUMBER_RE.search(bought_elem.get_text(strip=True))
+        if match:
+            bought_count = int(match.group(1))
+    
+    return raw_json, bought_count
+
+
+def extract_lamthao_product(html_content: str) -> Tuple[Optional[Dict], int]:
+    """
+    Lấy window.F1GENZ_vars.product.data và số lượng đã bán từ trang lamthaocosmetics
+    Fast path trên HTML thô, chỉ dựng DOM khi fast path thất bại
+    
+    Args:
+        html_content: HTML trang sản phẩm
+        
+    Returns:
+        (raw_json hoặc None, bought_count)
+    """
+    raw_json, bought_count = _extract_lamthao_fast(html_content)
+    if raw_json is not None and bought_count is not None:
+        return raw_json, bought_count
+    
+    logger.debug("[PRODUCT] Fast path thất bại, fallback DOM")
+    dom_json, dom_bought = _extract_lamthao_dom(html_content)
+    return (raw_json if raw_json is not None else dom_json), (
+        bought_count if bought_count is not None else dom_bought
+    )
+
+
+def parse_thegioiskinfood_html(soup, product_id: str, product_url: str) -> Dict:
     """
     Parse HTML thực tế từ thegioiskinfood
     CHỈ thêm field NẾU HTML có data
+    
+    soup: BeautifulSoup hoặc document của utils.html_parser
     """
+    doc = as_document(soup)
     result = {}
     
     # Product ID - extract numeric part from formatted string "thegioiskinfood-1234567890"
@@ -112,22 +231,22 @@ def parse_thegioiskinfood_html(soup: BeautifulSoup, product_id: str, product_url
     result["sku"] = None
     
     # Name
-    name_elem = soup.select_one("h1.page-product-info-title")
-    result["name"] = name_elem.get_text(strip=True) if name_elem else ""
+    name_elem = doc.select_one("product_name")
+    result["name"] = doc.text(name_elem) if name_elem is not None else ""
     
     # URL
     result["url"] = product_url.lstrip("/products/") if product_url.startswith("/products/") else product_url
     
     # Brand
-    brand_elem = soup.select_one("a.fill-vendor span")
-    result["brand"] = {"name": brand_elem.get_text(strip=True) if brand_elem else ""}
+    brand_elem = doc.select_one("product_brand")
+    result["brand"] = {"name": doc.text(brand_elem) if brand_elem is not None else ""}
     
     # Price - parse từ HTML
-    old_price_elem = soup.select_one(".page-product-info-oldprice span")
-    new_price_elem = soup.select_one(".page-product-info-newprice span")
+    old_price_elem = doc.select_one("product_old_price")
+    new_price_elem = doc.select_one("product_new_price")
     
-    old_price_text = old_price_elem.get_text(strip=True) if old_price_elem else ""
-    new_price_text = new_price_elem.get_text(strip=True) if new_price_elem else ""
+    old_price_text = doc.text(old_price_elem) if old_price_elem is not None else ""
+    new_price_text = doc.text(new_price_elem) if new_price_elem is not None else ""
     
     # Remove non-digits to get price
     market_price = int(re.sub(r'[^\d]', '', old_price_text)) if old_price_text else 0
@@ -139,28 +258,28 @@ def parse_thegioiskinfood_html(soup: BeautifulSoup, product_id: str, product_url
     result["discount_market_percent"] = calculate_discount_percent(price, market_price)
     
     # Bought - parse số
-    bought_elem = soup.select_one(".sold-qtt strong")
-    result["bought"] = int(bought_elem.get_text(strip=True)) if bought_elem and bought_elem.get_text(strip=True).isdigit() else 0
+    bought_elem = doc.select_one("product_bought")
+    bought_text = doc.text(bought_elem) if bought_elem is not None else ""
+    result["bought"] = int(bought_text) if bought_text.isdigit() else 0
     
     # Can buy & is saleable - assume true nếu có giá
     result["can_buy"] = True
     result["is_saleable"] = True
     
     # Variants - parse từ select options
-    variant_select = soup.select("#product-select option")
+    variant_select = doc.select("product_variants")
     if variant_select and len(variant_select) > 1:
         # Sản phẩm có nhiều variants
-        options_raw = soup.select(".single-option-selector option")
         option_name = "Tiêu đề"  # Default
         
         variants_list = []
         for option in variant_select:
-            variant_id = option.get("value")
-            variant_title = option.get("data-title", "")
-            variant_sku = option.get("data-sku", "")
-            variant_price_str = option.get("data-price", "0")
-            variant_max_order = option.get("data-max-order", "0")
-            variant_max = option.get("data-max", "0")
+            variant_id = doc.attr(option, "value")
+            variant_title = doc.attr(option, "data-title", "")
+            variant_sku = doc.attr(option, "data-sku", "")
+            variant_price_str = doc.attr(option, "data-price", "0")
+            variant_max_order = doc.attr(option, "data-max-order", "0")
+            variant_max = doc.attr(option, "data-max", "0")
             
             # Price format: "36900000" = 369000.00 VND (price * 100)
             variant_price = int(variant_price_str) // 100 if variant_price_str.isdigit() else price
@@ -189,13 +308,41 @@ def parse_thegioiskinfood_html(soup: BeautifulSoup, product_id: str, product_url
     elif variant_select and len(variant_select) == 1:
         # Sản phẩm đơn (chỉ 1 option): hoist variant fields lên product-level
         single_option = variant_select[0]
-        result["sku"] = single_option.get("data-sku", "")
-        result["qty"] = int(single_option.get("data-max", 0)) if single_option.get("data-max", "0").isdigit() else 0
-        result["max_order"] = int(single_option.get("data-max-order", 0)) if single_option.get("data-max-order", "0").isdigit() else 0
+        result["sku"] = doc.attr(single_option, "data-sku", "")
+        result["qty"] = int(doc.attr(single_option, "data-max", 0)) if doc.attr(single_option, "data-max", "0").isdigit() else 0
+        result["max_order"] = int(doc.attr(single_option, "data-max-order", 0)) if doc.attr(single_option, "data-max-order", "0").isdigit() else 0
     
     return result
 
 
+def parse_lamthaocosmetics_page(html_content: str) -> Optional[Dict]:
+    """
+    HTML trang sản phẩm lamthaocosmetics -> JSON đã transform
+    Hàm thuần (input/output là dữ liệu thường) nên chạy được trong parse pool
+    
+    Returns:
+        transformed_json hoặc None nếu không tìm thấy product JSON
+    """
+    raw_json, bought_count = extract_lamthao_product(html_content)
+    if not raw_json:
+        return None
+    return transform_lamthao_json(raw_json, bought_count)
+
+
+def parse_thegioiskinfood_page(html_content: str, product_id: str, product_url: str) -> Optional[Dict]:
+    """
+    HTML trang sản phẩm thegioiskinfood -> JSON
+    Hàm thuần (input/output là dữ liệu thường) nên chạy được trong parse pool
+    
+    Returns:
+        transformed_json hoặc None nếu parse lỗi
+    """
+    doc = parse_document(html_content, "product")
+    if not doc:
+        return None
+    return parse_thegioiskinfood_html(doc, product_id, product_url)
+
+
 def crawl_product_detail_lamthaocosmetics(listing: Dict[str, Any], session_id: UUID, db) -> Optional[Dict[str, Any]]:
     """
     Crawl và transform product detail từ lamthaocosmetics
@@ -211,63 +358,12 @@ def crawl_product_detail_lamthaocosmetics(listing: Dict[str, Any], session_id: U
         if not response:
             return None
         
-        soup = parse_html(response.text)
-        if not soup:
-            return None
-        
-        # Extract JSON từ window.F1GENZ_vars.product.data
-        raw_json = None
-        for script in soup.find_all('script'):
-            if not script.string or 'window.F1GENZ_vars' not in script.string:
-                continue
-            
-            text = script.string
-            data_start = text.find('product:')
-            if data_start == -1:
-                continue
-            
-            data_key_pos = text.find('data:', data_start)
-            if data_key_pos == -1:
-                continue
-            
-            brace_start = text.find('{', data_key_pos)
-            if brace_start == -1:
-                continue
-            
-            # Count braces
-            depth = 0
-            i = brace_start
-            while i < len(text):
-                if text[i] == '{':
-                    depth += 1
-                elif text[i] == '}':
-                    depth -= 1
-                    if depth == 0:
-                        json_str = text[brace_start:i+1]
-                        try:
-                            raw_json = json.loads(json_str)
-                            break
-                        except json.JSONDecodeError as e:
-                            logger.warning(f"JSON parse error: {e}")
-                            break
-                i += 1
-            
-            if raw_json:
-                break
-        
+        # Extract JSON + bought (fast path, fallback DOM)
+        raw_json, bought_count = extract_lamthao_product(response.text)
         if not raw_json:
             logger.warning(f"[PRODUCT] Không tìm thấy product JSON")
             return None
         
-        # Parse bought count
-        bought_count = 0
-        bought_elem = soup.select_one(".bottomloopend21")
-        if bought_elem:
-            bought_text = bought_elem.get_text(strip=True)
-            match = re.search(r'(\d+)', bought_text)
-            if match:
-                bought_count = int(match.group(1))
-        
         # Transform
         transformed_json = transform_lamthao_json(raw_json, bought_count)
         
@@ -278,7 +374,8 @@ def crawl_product_detail_lamthaocosmetics(listing: Dict[str, Any], session_id: U
             "data": transformed_json
         }
         
-        if db.insert_product(session_id, product_data):
+        snapshot = db.insert_product(session_id, product_data)
+        if snapshot and snapshot["is_new"]:
             logger.success(f"[PRODUCT] Lưu thành công: {transformed_json.get('name', '')[:50]}")
             return transformed_json
         else:
@@ -305,12 +402,12 @@ def crawl_product_detail_thegioiskinfood(listing: Dict[str, Any], session_id: UU
         if not response:
             return None
         
-        soup = parse_html(response.text)
-        if not soup:
+        doc = parse_document(response.text, "product")
+        if not doc:
             return None
         
         # Parse HTML
-        transformed_json = parse_thegioiskinfood_html(soup, product_id, product_url)
+        transformed_json = parse_thegioiskinfood_html(doc, product_id, product_url)
         
         # Save
         product_data = {
@@ -319,12 +416,14 @@ def crawl_product_detail_thegioiskinfood(listing: Dict[str, Any], session_id: UU
             "data": transformed_json
         }
         
-        if db.insert_product(session_id, product_data):
+        snapshot = db.insert_product(session_id, product_data)
+        if snapshot and snapshot["is_new"]:
             logger.success(f"[PRODUCT] Lưu thành công: {transformed_json.get('name', '')[:50]}")
             return {
                 "id": transformed_json.get('id'),
                 "product_id": product_id,
-                "name": transformed_json.get('name', '')
+                "name": transformed_json.get('name', ''),
+                "snapshot_id": snapshot["snapshot_id"]
             }
         else:
             logger.info(f"[PRODUCT] Duplicate")
@@ -1,8 +1,17 @@
 """
 Crawler cho reviews - BƯỚC 4
 Thu thập reviews từ API (chỉ thegioiskinfood) và lưu vào review_api
+
+Incremental (config.REVIEW_INCREMENTAL): khi product đã có watermark
+(total + id review mới nhất của lần sync trước), chỉ probe page 1; nếu
+thay đổi thì đọc từ page 1 (source_cr_at desc) tới khi gặp review đã biết
+và lưu phần review mới thành 1 dòng delta (số trang âm, không lẫn với
+các trang API đầy đủ mà resume theo trang đọc).
+
+Watermark đầu tiên chỉ lấy từ page 1: crawl resume từ page > 1 đọc lại
+page 1..start_page-1 (review thêm vào giữa các lần chạy nằm ở đó) trước khi ghi.
 """
-from typing import Optional
+from typing import Any, Dict, Generator, List, Optional, Tuple
 from uuid import UUID
 import time
 
@@ -13,7 +22,296 @@ import config
 logger = get_logger()
 
 
-def crawl_reviews_thegioiskinfood(product_numeric_id: int, product_id: str, session_id: UUID, db) -> int:
+def review_api_url(product_numeric_id: int, page: int, limit: int = None) -> str:
+    """URL review API (mới nhất trước)"""
+    return (
+        f"{config.REVIEW_API_BASE}"
+        f"?org_id={config.REVIEW_API_ORG_ID}"
+        f"&product_id={product_numeric_id}"
+        f"&page={page}"
+        f"&limit={limit or config.REVIEW_API_LIMIT}"
+        f"&source_cr_at=desc"
+    )
+
+
+def review_key(review: Dict[str, Any]) -> Optional[str]:
+    """Id của 1 review (config.REVIEW_ID_FIELD), None nếu thiếu"""
+    value = review.get(config.REVIEW_ID_FIELD) if isinstance(review, dict) else None
+    return str(value) if value is not None else None
+
+
+def newest_review_key(data: Dict[str, Any]) -> Optional[str]:
+    """Id review đầu tiên (mới nhất) của 1 trang API"""
+    reviews = data.get("list_ratings") or []
+    return review_key(reviews[0]) if reviews else None
+
+
+def take_new_reviews(reviews: List[Dict[str, Any]], newest_review_id: Optional[str]) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Lấy các review đứng trước review watermark trong 1 trang (desc)
+    
+    Returns:
+        (reviews mới, True nếu đã gặp review watermark)
+    """
+    if newest_review_id is None:
+        return list(reviews), False
+    for index, review in enumerate(reviews):
+        if review_key(review) == newest_review_id:
+            return list(reviews[:index]), True
+    return list(reviews), False
+
+
+def review_delta_page(
+    product_id: str,
+    product_snapshot_id: int,
+    session_id: UUID,
+    page: int,
+    new_reviews: List[Dict[str, Any]],
+    total: int
+) -> Dict[str, Any]:
+    """
+    review_data của 1 dòng delta (chỉ review mới)
+    
+    page là số âm (get_next_review_delta_page) để resume theo trang
+    (get_latest_review_page, chỉ đếm trang > 0) không đọc nhầm delta
+    thành 1 trang API đầy đủ.
+    """
+    return {
+        "product_id": product_id,
+        "product_snapshot_id": product_snapshot_id,
+        "session_id": session_id,
+        "pages": page,
+        "data": {"list_ratings": new_reviews, "total": total, "incremental": True},
+    }
+
+
+def review_unchanged(watermark: Dict[str, Any], total: int, newest_id: Optional[str]) -> bool:
+    """Total không đổi và review mới nhất vẫn là review watermark"""
+    if total != watermark.get("last_total"):
+        return False
+    known_id = watermark.get("newest_review_id")
+    return known_id is None or known_id == newest_id
+
+
+def sync_new_reviews(watermark: Dict[str, Any]) -> Generator[List[Tuple[int, int]], List[Optional[Dict[str, Any]]], Optional[Dict[str, Any]]]:
+    """
+    Thuật toán incremental của 1 product, dùng chung cho crawler sync và async
+    
+    Generator: yield list (page, limit) cần fetch, nhận lại list data API
+    cùng thứ tự (None nếu request lỗi). Probe page 1 với REVIEW_PROBE_LIMIT
+    review; nếu đổi thì đọc từ page 1 theo cửa sổ nhiều trang (ước lượng
+    từ số review tăng thêm), dừng ở trang đầu tiên chứa review watermark.
+    
+    Args:
+        watermark: {"last_total", "newest_review_id"} của lần sync trước
+        
+    Returns:
+        None nếu có request lỗi (giữ watermark cũ), ngược lại
+        {"total", "newest_review_id", "unchanged", "new_reviews"}
+    """
+    (probe,) = yield [(1, config.REVIEW_PROBE_LIMIT)]
+    if probe is None:
+        return None
+    total = probe.get("total", 0)
+    newest_id = newest_review_key(probe)
+    result = {"total": total, "newest_review_id": newest_id, "unchanged": False, "new_reviews": []}
+    
+    if review_unchanged(watermark, total, newest_id):
+        result["unchanged"] = True
+        return result
+    
+    # Mới nhất trước: đọc tới review watermark (hoặc, khi không có id, tới khi đủ số review tăng thêm)
+    known_id = watermark.get("newest_review_id")
+    expected = total - (watermark.get("last_total") or 0)
+    total_pages = (total + config.REVIEW_API_LIMIT - 1) // config.REVIEW_API_LIMIT
+    new_reviews: List[Dict[str, Any]] = []
+    
+    page = 1
+    while page <= total_pages:
+        # Cửa sổ ước lượng từ số review còn thiếu, các trang trong cửa sổ được fetch đồng thời
+        missing = max(expected - len(new_reviews), 0)
+        window = min(total_pages - page + 1, missing // config.REVIEW_API_LIMIT + 1)
+        pages = yield [(number, config.REVIEW_API_LIMIT) for number in range(page, page + window)]
+        done = False
+        for data in pages:
+            if data is None:
+                return None
+            reviews = data.get("list_ratings", [])
+            fresh, reached = take_new_reviews(reviews, known_id)
+            new_reviews.extend(fresh)
+            if reached or not reviews or len(new_reviews) >= expected:
+                # Dừng ở trang đầu tiên chứa review watermark, bỏ các trang sau trong cửa sổ
+                done = True
+                break
+        if done:
+            break
+        page += window
+    
+    # Không có id watermark: chỉ biết số review tăng thêm
+    if known_id is None:
+        new_reviews = new_reviews[:max(expected, 0)]
+    
+    result["new_reviews"] = new_reviews
+    return result
+
+
+def review_gap_pages(start_page: int, total_pages: int) -> List[int]:
+    """
+    Các trang cần đọc lại trước khi ghi watermark đầu tiên của 1 crawl resume (start_page > 1)
+    
+    Review mới từ các lần chạy trước đẩy review cũ xuống, nên chúng nằm ở
+    page 1..start_page-1 mà crawl resume bỏ qua. Page 1 luôn được đọc để
+    lấy id review mới nhất cho watermark.
+    """
+    return list(range(1, max(2, min(start_page, total_pages + 1))))
+
+
+def review_gap_result(pages: List[Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """
+    Gộp data API của review_gap_pages (cùng thứ tự)
+    
+    Returns:
+        None nếu có request lỗi (chưa ghi watermark, lần sau đọc lại), ngược lại
+        {"total", "newest_review_id", "reviews"} với total / id lấy từ page 1
+    """
+    if not pages or any(data is None for data in pages):
+        return None
+    return {
+        "total": pages[0].get("total", 0),
+        "newest_review_id": newest_review_key(pages[0]),
+        "reviews": [review for data in pages for review in data.get("list_ratings") or []],
+    }
+
+
+def _fetch_review_data(product_numeric_id: int, page: int, limit: int) -> Optional[Dict[str, Any]]:
+    response = make_request(review_api_url(product_numeric_id, page, limit))
+    return response.json() if response else None
+
+
+def _save_review_delta(
+    db,
+    product_id: str,
+    product_snapshot_id: int,
+    session_id: UUID,
+    reviews: List[Dict[str, Any]],
+    total: int
+) -> Optional[int]:
+    """
+    Lưu reviews thành 1 dòng delta
+    
+    Returns:
+        Số dòng đã insert, None nếu không lưu được
+    """
+    delta_page = db.get_next_review_delta_page(product_id)
+    if delta_page is None:
+        return None
+    statuses = db.insert_reviews_bulk(session_id, [
+        review_delta_page(product_id, product_snapshot_id, session_id, delta_page, reviews, total)
+    ])
+    # duplicate: đã lưu ở lần chạy trước nhưng chưa kịp ghi watermark
+    if not any(status["status"] in ("inserted", "duplicate") for status in statuses):
+        return None
+    return sum(1 for status in statuses if status["status"] == "inserted")
+
+
+def _bootstrap_watermark(
+    product_numeric_id: int,
+    product_id: str,
+    session_id: UUID,
+    db,
+    product_snapshot_id: int,
+    start_page: int,
+    total_pages: int
+) -> int:
+    """
+    Watermark đầu tiên của product crawl resume từ start_page > 1
+    
+    Đọc lại page 1..start_page-1 (review_gap_pages), lưu review của chúng
+    thành 1 dòng delta rồi ghi watermark lấy từ page 1, để review thêm vào
+    giữa các lần chạy không bị đánh dấu là đã sync.
+    
+    Returns:
+        Số dòng delta đã lưu
+    """
+    pages = review_gap_pages(start_page, total_pages)
+    try:
+        gap = review_gap_result([_fetch_review_data(product_numeric_id, page, config.REVIEW_API_LIMIT) for page in pages])
+    except Exception as exc:
+        logger.error(f"[REVIEW] Lỗi đọc lại page 1-{pages[-1]} của {product_id}: {exc}")
+        gap = None
+    if gap is None:
+        logger.warning(f"[REVIEW] {product_id}: chưa đọc được page 1-{pages[-1]}, chưa ghi watermark")
+        return 0
+    
+    total_saved = 0
+    if gap["reviews"]:
+        total_saved = _save_review_delta(db, product_id, product_snapshot_id, session_id, gap["reviews"], gap["total"])
+        if total_saved is None:
+            logger.warning(f"[REVIEW] Không lưu được review page 1-{pages[-1]} của {product_id}, chưa ghi watermark")
+            return 0
+    
+    db.upsert_review_watermarks([{
+        "product_id": product_id,
+        "last_total": gap["total"],
+        "newest_review_id": gap["newest_review_id"],
+    }])
+    return total_saved
+
+
+def _crawl_new_reviews(
+    product_numeric_id: int,
+    product_id: str,
+    session_id: UUID,
+    db,
+    product_snapshot_id: int,
+    watermark: Dict[str, Any]
+) -> int:
+    """
+    Incremental: chạy sync_new_reviews, fetch lần lượt các trang của mỗi cửa sổ
+    
+    Returns:
+        Số pages (dòng delta) đã lưu
+    """
+    sync = sync_new_reviews(watermark)
+    try:
+        requests = next(sync)
+        while True:
+            requests = sync.send([_fetch_review_data(product_numeric_id, page, limit) for page, limit in requests])
+    except StopIteration as stop:
+        result = stop.value
+    
+    if result is None:
+        logger.warning(f"[REVIEW] Không đọc được reviews của {product_id}, giữ watermark cũ")
+        return 0
+    
+    total = result["total"]
+    new_watermark = {"product_id": product_id, "last_total": total, "newest_review_id": result["newest_review_id"]}
+    if result["unchanged"]:
+        if watermark.get("newest_review_id") is None and result["newest_review_id"] is not None:
+            db.upsert_review_watermarks([new_watermark])
+        logger.info(f"[REVIEW] {product_id}: {total} reviews, không đổi - skip")
+        return 0
+    
+    new_reviews = result["new_reviews"]
+    total_saved = 0
+    if new_reviews:
+        total_saved = _save_review_delta(db, product_id, product_snapshot_id, session_id, new_reviews, total)
+        if total_saved is None:
+            logger.warning(f"[REVIEW] Không lưu được {len(new_reviews)} review mới của {product_id}")
+            return 0
+    
+    db.upsert_review_watermarks([new_watermark])
+    logger.success(f"[REVIEW] {product_id}: +{len(new_reviews)} review mới (total {total})")
+    return total_saved
+
+
+def crawl_reviews_thegioiskinfood(
+    product_numeric_id: int,
+    product_id: str,
+    session_id: UUID,
+    db,
+    product_snapshot_id: Optional[int] = None
+) -> int:
     """
     Crawl reviews từ review API (thegioiskinfood)
     Loop qua các trang cho đến khi hết data
@@ -23,6 +321,7 @@ def crawl_reviews_thegioiskinfood(product_numeric_id: int, product_id: str, sess
         product_id: Product ID string (e.g. "thegioiskinfood-1043504950")
         session_id: UUID của crawl session
         db: DatabaseHandler instance
+        product_snapshot_id: Snapshot id trả về từ insert_product (bỏ qua bước query)
         
     Returns:
         Số reviews (pages) đã lưu thành công
@@ -31,32 +330,37 @@ def crawl_reviews_thegioiskinfood(product_numeric_id: int, product_id: str, sess
         logger.warning(f"[REVIEW] Không có product_numeric_id cho {product_id}, skip reviews")
         return 0
     
-    # Get product snapshot ID từ database
-    product_snapshot_id = db.get_latest_product_snapshot_id(product_id)
+    # Get product snapshot ID từ database nếu chưa có từ insert_product
+    if not product_snapshot_id:
+        product_snapshot_id = db.get_latest_product_snapshot_id(product_id)
     if not product_snapshot_id:
         logger.warning(f"[REVIEW] Không tìm thấy product snapshot cho {product_id}, skip reviews")
         return 0
     
+    if config.REVIEW_INCREMENTAL:
+        watermark = db.get_review_watermark(product_id)
+        if watermark is not None:
+            try:
+                return _crawl_new_reviews(product_numeric_id, product_id, session_id, db, product_snapshot_id, watermark)
+            except Exception as exc:
+                logger.error(f"[REVIEW] Lỗi sync reviews incremental cho {product_id}: {exc}")
+                return 0
+    
     # Resume capability: Get latest page from DB
     latest_page = db.get_latest_review_page(product_id)
     start_page = latest_page + 1 if latest_page > 0 else 1
     
     total_saved = 0
     max_pages = 100  # Safety limit
+    watermark = None
+    complete = False
     
     logger.info(f"[REVIEW] Bắt đầu crawl reviews cho product_id={product_numeric_id}. Resume from page {start_page} (Latest: {latest_page})")
     
     page = start_page
     while page <= max_pages:
         # Build API URL
-        api_url = (
-            f"{config.REVIEW_API_BASE}"
-            f"?org_id={config.REVIEW_API_ORG_ID}"
-            f"&product_id={product_numeric_id}"
-            f"&page={page}"
-            f"&limit={config.REVIEW_API_LIMIT}"
-            f"&source_cr_at=desc"
-        )
+        api_url = review_api_url(product_numeric_id, page)
         
         logger.info(f"[REVIEW] Crawl page {page}: product_id={product_numeric_id}")
         
@@ -72,10 +376,19 @@ def crawl_reviews_thegioiskinfood(product_numeric_id: int, product_id: str, sess
                 logger.error(f"[REVIEW] Không parse được JSON response (page {page}): {json_err}")
                 break
             
+            # Watermark cho lần sync incremental sau (resume từ page > 1 thì lấy lại từ page 1)
+            if watermark is None:
+                watermark = {
+                    "product_id": product_id,
+                    "last_total": data.get("total", 0),
+                    "newest_review_id": newest_review_key(data),
+                }
+            
             # Check xem có data không - API trả về "list_ratings"
             reviews = data.get("list_ratings", [])
             if not reviews or len(reviews) == 0:
                 logger.info(f"[REVIEW] Hết reviews ở page {page}")
+                complete = True
                 break
             
             # Insert review page vào database
@@ -101,6 +414,7 @@ def crawl_reviews_thegioiskinfood(product_numeric_id: int, product_id: str, sess
             
             if current_count >= total_reviews:
                 logger.info(f"[REVIEW] Đã crawl hết {total_reviews} reviews")
+                complete = True
                 break
             
             page += 1
@@ -110,5 +424,16 @@ def crawl_reviews_thegioiskinfood(product_numeric_id: int, product_id: str, sess
             logger.error(f"[REVIEW] Lỗi crawl review page {page}: {exc}")
             break
     
+    # Chỉ ghi watermark khi đã đọc hết các trang (tránh bỏ sót trang còn thiếu)
+    if config.REVIEW_INCREMENTAL and complete and watermark is not None:
+        if start_page == 1:
+            db.upsert_review_watermarks([watermark])
+        else:
+            # Resume: review mới đã dồn vào page 1..start_page-1, đọc lại trước khi ghi watermark
+            total_pages = (watermark["last_total"] + config.REVIEW_API_LIMIT - 1) // config.REVIEW_API_LIMIT
+            total_saved += _bootstrap_watermark(
+                product_numeric_id, product_id, session_id, db, product_snapshot_id, start_page, total_pages
+            )
+    
     logger.success(f"[REVIEW] Hoàn thành: Lưu {total_saved} pages cho product {product_id}")
     return total_saved
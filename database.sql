@@ -614,8 +614,8 @@ SELECT tablename FROM pg_tables WHERE schemaname = 'raw' ORDER BY tablename;
 
 -- Bổ sung listing_api
 ALTER TABLE raw.listing_api
-ADD COLUMN product_url TEXT;
-ADD COLUMN data JSONB;
+ADD COLUMN IF NOT EXISTS product_url TEXT,
+ADD COLUMN IF NOT EXISTS data JSONB;
 
 -- 1. Xóa trigger/function cũ nếu tồn tại
 DROP TRIGGER IF EXISTS trg_sync_product_url ON raw.listing_api;
@@ -654,3 +654,552 @@ WHERE data IS NOT NULL
 -- 5. (Tùy) Tạo index để tìm kiếm nhanh product_url
 CREATE INDEX IF NOT EXISTS idx_raw_listing_api_product_url
 ON raw.listing_api (product_url);
+
+
+
+-- =====================================================
+-- BULK INSERT LISTING_API (1 RPC cho cả trang/brand)
+-- Set-based insert, trả về product_id mới được insert
+-- =====================================================
+
+DROP FUNCTION IF EXISTS raw.batch_insert_listing_api(UUID, VARCHAR, JSONB);
+
+CREATE OR REPLACE FUNCTION raw.batch_insert_listing_api(
+    p_session_id UUID,
+    p_source_name VARCHAR,
+    p_products JSONB
+)
+RETURNS TABLE (product_id VARCHAR) AS $$
+    INSERT INTO raw.listing_api AS l (session_id, source_name, product_id, brand_id, data)
+    SELECT DISTINCT ON (p->>'product_id')
+        p_session_id,
+        p_source_name,
+        p->>'product_id',
+        p->>'brand_id',
+        p->'data'
+    FROM jsonb_array_elements(p_products) AS p
+    WHERE p->>'product_id' IS NOT NULL
+    ON CONFLICT (product_id) DO NOTHING
+    RETURNING l.product_id;
+$$ LANGUAGE sql;
+
+
+-- =====================================================
+-- BULK INSERT PRODUCT_API (1 RPC cho N sản phẩm)
+-- Dedup set-based theo (product_id, price, bought)
+-- Trả về snapshot id cho cả dòng mới và dòng đã tồn tại
+-- =====================================================
+
+-- Trigger bỏ qua EXISTS khi batch function đã dedup trước đó
+CREATE OR REPLACE FUNCTION raw.auto_extract_price_bought()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_price NUMERIC;
+    v_bought INTEGER;
+BEGIN
+    -- Extract price và bought từ JSONB
+    v_price := (NEW.data->>'price')::NUMERIC;
+    v_bought := (NEW.data->>'bought')::INTEGER;
+    
+    NEW.price := v_price;
+    NEW.bought := v_bought;
+    
+    IF current_setting('raw.bulk_dedup_done', true) = 'on' THEN
+        RETURN NEW;
+    END IF;
+    
+    -- Check duplicate (product_id, price, bought)
+    IF EXISTS (
+        SELECT 1 FROM raw.product_api
+        WHERE product_id = NEW.product_id
+        AND price = NEW.price
+        AND bought = NEW.bought
+        LIMIT 1
+    ) THEN
+        RETURN NULL;
+    END IF;
+    
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION raw.batch_insert_product_api(
+    p_session_id UUID,
+    p_products JSONB
+)
+RETURNS TABLE (product_id VARCHAR, snapshot_id BIGINT, is_new BOOLEAN) AS $$
+#variable_conflict use_column
+BEGIN
+    PERFORM set_config('raw.bulk_dedup_done', 'on', true);
+    
+    RETURN QUERY
+    WITH input AS (
+        SELECT DISTINCT ON (p->>'product_id', (p->'data'->>'price')::NUMERIC, (p->'data'->>'bought')::INTEGER)
+            (p->>'product_id')::VARCHAR AS product_id,
+            (p->>'source_name')::VARCHAR AS source_name,
+            p->'data' AS data,
+            (p->'data'->>'price')::NUMERIC AS price,
+            (p->'data'->>'bought')::INTEGER AS bought
+        FROM jsonb_array_elements(p_products) AS p
+        WHERE p->>'product_id' IS NOT NULL
+    ),
+    existing AS (
+        SELECT DISTINCT ON (i.product_id, i.price, i.bought)
+            i.product_id, i.price, i.bought, pa.id
+        FROM input i
+        JOIN raw.product_api pa
+            ON pa.product_id = i.product_id
+            AND pa.price = i.price
+            AND pa.bought = i.bought
+        ORDER BY i.product_id, i.price, i.bought, pa.id
+    ),
+    inserted AS (
+        INSERT INTO raw.product_api (product_id, session_id, source_name, data, price, bought)
+        SELECT i.product_id, p_session_id, i.source_name, i.data, i.price, i.bought
+        FROM input i
+        WHERE NOT EXISTS (
+            SELECT 1 FROM existing e
+            WHERE e.product_id = i.product_id
+            AND e.price = i.price
+            AND e.bought = i.bought
+        )
+        ON CONFLICT (product_id, price, bought) DO NOTHING
+        RETURNING id, product_id, price, bought
+    )
+    SELECT
+        i.product_id,
+        COALESCE(ins.id, e.id),
+        ins.id IS NOT NULL
+    FROM input i
+    LEFT JOIN inserted ins
+        ON ins.product_id = i.product_id
+        AND ins.price IS NOT DISTINCT FROM i.price
+        AND ins.bought IS NOT DISTINCT FROM i.bought
+    LEFT JOIN existing e
+        ON e.product_id = i.product_id
+        AND e.price = i.price
+        AND e.bought = i.bought;
+    
+    PERFORM set_config('raw.bulk_dedup_done', 'off', true);
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- =====================================================
+-- BULK INSERT REVIEW_API (1 RPC cho tất cả trang review)
+-- Kiểm tra snapshot + dedup (product_id, pages) set-based trong 1 transaction
+-- Trả về trạng thái từng trang: inserted / duplicate / invalid
+-- =====================================================
+
+-- Trigger bỏ qua kiểm tra khi batch function đã kiểm tra trước đó
+CREATE OR REPLACE FUNCTION raw.check_review_duplicate()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF current_setting('raw.bulk_review_checked', true) = 'on' THEN
+        RETURN NEW;
+    END IF;
+    
+    -- Check duplicate chỉ dựa trên (product_id, pages)
+    IF EXISTS (
+        SELECT 1 FROM raw.review_api 
+        WHERE product_id = NEW.product_id
+        AND pages = NEW.pages
+    ) THEN
+        RETURN NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION raw.validate_review_product()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF current_setting('raw.bulk_review_checked', true) = 'on' THEN
+        RETURN NEW;
+    END IF;
+    
+    -- Kiểm tra product_snapshot_id phải tồn tại và match với product_id
+    IF NOT EXISTS (
+        SELECT 1 FROM raw.product_api
+        WHERE id = NEW.product_snapshot_id
+        AND product_id = NEW.product_id
+    ) THEN
+        RAISE EXCEPTION 'Invalid review: product_snapshot_id=% does not exist or does not match product_id=%', 
+                        NEW.product_snapshot_id, NEW.product_id;
+    END IF;
+    
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION raw.batch_insert_review_api(
+    p_session_id UUID,
+    p_pages JSONB
+)
+RETURNS TABLE (product_id VARCHAR, pages INTEGER, review_id BIGINT, status TEXT) AS $$
+#variable_conflict use_column
+BEGIN
+    PERFORM set_config('raw.bulk_review_checked', 'on', true);
+    
+    RETURN QUERY
+    WITH input AS (
+        SELECT DISTINCT ON (p->>'product_id', (p->>'pages')::INTEGER)
+            (p->>'product_id')::VARCHAR AS product_id,
+            (p->>'product_snapshot_id')::BIGINT AS product_snapshot_id,
+            (p->>'pages')::INTEGER AS pages,
+            p->'data' AS data
+        FROM jsonb_array_elements(p_pages) AS p
+        WHERE p->>'product_id' IS NOT NULL
+        AND p->>'pages' IS NOT NULL
+    ),
+    valid AS (
+        SELECT i.*
+        FROM input i
+        WHERE EXISTS (
+            SELECT 1 FROM raw.product_api pa
+            WHERE pa.id = i.product_snapshot_id
+            AND pa.product_id = i.product_id
+        )
+    ),
+    inserted AS (
+        INSERT INTO raw.review_api (data, product_id, product_snapshot_id, session_id, pages)
+        SELECT v.data, v.product_id, v.product_snapshot_id, p_session_id, v.pages
+        FROM valid v
+        ON CONFLICT (product_id, pages) DO NOTHING
+        RETURNING id, product_id, pages
+    )
+    SELECT
+        i.product_id,
+        i.pages,
+        ins.id,
+        CASE
+            WHEN ins.id IS NOT NULL THEN 'inserted'
+            WHEN v.product_id IS NULL THEN 'invalid'
+            ELSE 'duplicate'
+        END
+    FROM input i
+    LEFT JOIN valid v
+        ON v.product_id = i.product_id
+        AND v.pages = i.pages
+    LEFT JOIN inserted ins
+        ON ins.product_id = i.product_id
+        AND ins.pages = i.pages;
+    
+    PERFORM set_config('raw.bulk_review_checked', 'off', true);
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- =====================================================
+-- BRAND_ID CHO LISTING_API (lọc brand phía server)
+-- brand_id = khóa brand chuẩn hóa, giống utils.helpers.normalize_brand_name
+-- =====================================================
+
+CREATE OR REPLACE FUNCTION raw.normalize_brand_key(p_brand TEXT)
+RETURNS VARCHAR AS $$
+    SELECT NULLIF(LEFT(REPLACE(REPLACE(LOWER(BTRIM(p_brand)), ' ', '-'), '''', ''), 100), '');
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Trigger điền brand_id từ data->'brand'->>'name' nếu client không gửi
+CREATE OR REPLACE FUNCTION raw.sync_listing_brand_id()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.brand_id IS NULL AND NEW.data IS NOT NULL THEN
+        NEW.brand_id := raw.normalize_brand_key(NEW.data->'brand'->>'name');
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_sync_listing_brand_id ON raw.listing_api;
+CREATE TRIGGER trg_sync_listing_brand_id
+BEFORE INSERT OR UPDATE
+ON raw.listing_api
+FOR EACH ROW
+EXECUTE FUNCTION raw.sync_listing_brand_id();
+
+-- Backfill dữ liệu cũ
+UPDATE raw.listing_api
+SET brand_id = raw.normalize_brand_key(data->'brand'->>'name')
+WHERE brand_id IS NULL
+  AND data->'brand'->>'name' IS NOT NULL;
+
+-- Index phục vụ truy vấn (source_name, brand_id), trả product_url không cần đọc heap JSONB
+CREATE INDEX IF NOT EXISTS idx_listing_source_brand
+ON raw.listing_api (source_name, brand_id)
+INCLUDE (product_id, product_url)
+WHERE brand_id IS NOT NULL;
+
+
+-- =====================================================
+-- BULK RESUME POINTS CHO REVIEW (1 query cho cả brand)
+-- Trả về snapshot mới nhất và trang review lớn nhất đã crawl
+-- Dùng idx_product_id_created và idx_review_product_pages
+-- =====================================================
+
+CREATE OR REPLACE FUNCTION raw.get_review_resume_points(p_product_ids TEXT[])
+RETURNS TABLE (product_id VARCHAR, snapshot_id BIGINT, latest_page INTEGER) AS $$
+    SELECT
+        ids.product_id::VARCHAR,
+        (
+            SELECT pa.id
+            FROM raw.product_api pa
+            WHERE pa.product_id = ids.product_id
+            ORDER BY pa.created_at DESC
+            LIMIT 1
+        ),
+        COALESCE((
+            SELECT MAX(ra.pages)
+            FROM raw.review_api ra
+            WHERE ra.product_id = ids.product_id
+        ), 0)
+    FROM (SELECT DISTINCT unnest(p_product_ids) AS product_id) ids;
+$$ LANGUAGE sql STABLE;
+
+
+-- =====================================================
+-- HTTP VALIDATOR STORE (conditional GET)
+-- URL -> ETag, Last-Modified, hash body, meta của lần ghi gần nhất
+-- =====================================================
+
+CREATE TABLE IF NOT EXISTS raw.http_validator (
+    url TEXT PRIMARY KEY,
+    etag TEXT NULL,
+    last_modified TEXT NULL,
+    body_hash VARCHAR(64) NULL,
+    meta JSONB NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+
+-- =====================================================
+-- REVIEW WATERMARK (incremental review sync)
+-- Mỗi product: total lần check gần nhất + id review mới nhất (source_cr_at desc)
+-- Lần crawl sau chỉ lấy các review mới hơn watermark
+-- =====================================================
+
+CREATE TABLE IF NOT EXISTS raw.review_watermark (
+    product_id VARCHAR(100) PRIMARY KEY,
+    last_total INTEGER NOT NULL DEFAULT 0,
+    newest_review_id TEXT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Dòng delta (chỉ chứa review mới, không phải 1 trang API đầy đủ) lưu ở
+-- pages = -1, -2, ...: resume theo trang chỉ đọc pages > 0, delta_page = MIN(pages < 0)
+-- Resume points kèm watermark (đổi kiểu trả về nên phải DROP trước)
+DROP FUNCTION IF EXISTS raw.get_review_resume_points(TEXT[]);
+
+CREATE FUNCTION raw.get_review_resume_points(p_product_ids TEXT[])
+RETURNS TABLE (
+    product_id VARCHAR,
+    snapshot_id BIGINT,
+    latest_page INTEGER,
+    delta_page INTEGER,
+    last_total INTEGER,
+    newest_review_id TEXT
+) AS $$
+    SELECT
+        ids.product_id::VARCHAR,
+        (
+            SELECT pa.id
+            FROM raw.product_api pa
+            WHERE pa.product_id = ids.product_id
+            ORDER BY pa.created_at DESC
+            LIMIT 1
+        ),
+        COALESCE((
+            SELECT MAX(ra.pages)
+            FROM raw.review_api ra
+            WHERE ra.product_id = ids.product_id
+            AND ra.pages > 0
+        ), 0),
+        COALESCE((
+            SELECT MIN(ra.pages)
+            FROM raw.review_api ra
+            WHERE ra.product_id = ids.product_id
+            AND ra.pages < 0
+        ), 0),
+        rw.last_total,
+        rw.newest_review_id
+    FROM (SELECT DISTINCT unnest(p_product_ids) AS product_id) ids
+    LEFT JOIN raw.review_watermark rw ON rw.product_id = ids.product_id;
+$$ LANGUAGE sql STABLE;
+
+
+-- =====================================================
+-- REVIEW ITEM (1 dòng / review, dedup theo review id của API)
+-- Thay cho lưu cả trang JSON: trang bị dịch khi có review mới nên cùng 1
+-- review bị lưu lặp nhiều lần trong review_api (và trong idx_review_data_gin)
+-- =====================================================
+
+CREATE TABLE IF NOT EXISTS raw.review_item (
+    product_id VARCHAR(100) NOT NULL,
+    review_id TEXT NOT NULL,
+    data JSONB NOT NULL,
+    product_snapshot_id BIGINT NOT NULL REFERENCES raw.product_api(id) ON DELETE CASCADE,
+    session_id UUID NOT NULL REFERENCES raw.crawl_sessions(session_id) ON DELETE CASCADE,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (product_id, review_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_review_item_snapshot ON raw.review_item(product_snapshot_id);
+CREATE INDEX IF NOT EXISTS idx_review_item_created_at ON raw.review_item(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_review_item_data_gin ON raw.review_item USING gin(data);
+
+-- Bulk upsert: nhận các trang API (cùng format batch_insert_review_api),
+-- tách list_ratings thành từng review, key = item->>p_id_field (md5 nếu thiếu id)
+-- Review đã có chỉ được ghi lại khi nội dung thay đổi
+-- status mỗi trang: inserted (có review mới/đổi) / duplicate / invalid
+CREATE OR REPLACE FUNCTION raw.batch_upsert_review_items(
+    p_session_id UUID,
+    p_pages JSONB,
+    p_id_field TEXT DEFAULT 'id'
+)
+RETURNS TABLE (product_id VARCHAR, pages INTEGER, reviews INTEGER, changed INTEGER, status TEXT) AS $$
+#variable_conflict use_column
+BEGIN
+    RETURN QUERY
+    WITH input AS (
+        SELECT DISTINCT ON (p->>'product_id', (p->>'pages')::INTEGER)
+            (p->>'product_id')::VARCHAR AS product_id,
+            (p->>'product_snapshot_id')::BIGINT AS product_snapshot_id,
+            (p->>'pages')::INTEGER AS pages,
+            p->'data' AS data
+        FROM jsonb_array_elements(p_pages) AS p
+        WHERE p->>'product_id' IS NOT NULL
+        AND p->>'pages' IS NOT NULL
+    ),
+    valid AS (
+        SELECT i.*
+        FROM input i
+        WHERE EXISTS (
+            SELECT 1 FROM raw.product_api pa
+            WHERE pa.id = i.product_snapshot_id
+            AND pa.product_id = i.product_id
+        )
+    ),
+    items AS (
+        -- 1 review có thể nằm ở 2 trang trong cùng batch (trang bị dịch): giữ trang nhỏ nhất
+        SELECT DISTINCT ON (v.product_id, COALESCE(r->>p_id_field, md5(r::TEXT)))
+            v.product_id,
+            v.pages,
+            v.product_snapshot_id,
+            COALESCE(r->>p_id_field, md5(r::TEXT)) AS review_id,
+            r AS data
+        FROM valid v
+        CROSS JOIN LATERAL jsonb_array_elements(
+            CASE WHEN jsonb_typeof(v.data->'list_ratings') = 'array'
+                THEN v.data->'list_ratings' ELSE '[]'::JSONB END
+        ) AS r
+        ORDER BY v.product_id, COALESCE(r->>p_id_field, md5(r::TEXT)), v.pages
+    ),
+    upserted AS (
+        INSERT INTO raw.review_item AS ri (product_id, review_id, data, product_snapshot_id, session_id)
+        SELECT it.product_id, it.review_id, it.data, it.product_snapshot_id, p_session_id
+        FROM items it
+        ON CONFLICT (product_id, review_id) DO UPDATE
+        SET data = EXCLUDED.data,
+            product_snapshot_id = EXCLUDED.product_snapshot_id,
+            session_id = EXCLUDED.session_id,
+            updated_at = NOW()
+        WHERE ri.data IS DISTINCT FROM EXCLUDED.data
+        RETURNING ri.product_id, ri.review_id
+    ),
+    per_page AS (
+        SELECT
+            it.product_id,
+            it.pages,
+            COUNT(*)::INTEGER AS reviews,
+            COUNT(u.review_id)::INTEGER AS changed
+        FROM items it
+        LEFT JOIN upserted u
+            ON u.product_id = it.product_id
+            AND u.review_id = it.review_id
+        GROUP BY it.product_id, it.pages
+    )
+    SELECT
+        i.product_id,
+        i.pages,
+        COALESCE(pp.reviews, 0),
+        COALESCE(pp.changed, 0),
+        CASE
+            WHEN v.product_id IS NULL THEN 'invalid'
+            WHEN COALESCE(pp.changed, 0) > 0 THEN 'inserted'
+            ELSE 'duplicate'
+        END
+    FROM input i
+    LEFT JOIN valid v
+        ON v.product_id = i.product_id
+        AND v.pages = i.pages
+    LEFT JOIN per_page pp
+        ON pp.product_id = i.product_id
+        AND pp.pages = i.pages;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Backfill 1 lần từ review_api (bản mới nhất của mỗi review):
+-- SELECT raw.backfill_review_items();
+CREATE OR REPLACE FUNCTION raw.backfill_review_items(p_id_field TEXT DEFAULT 'id')
+RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    INSERT INTO raw.review_item (product_id, review_id, data, product_snapshot_id, session_id, created_at)
+    SELECT DISTINCT ON (ra.product_id, COALESCE(r->>p_id_field, md5(r::TEXT)))
+        ra.product_id,
+        COALESCE(r->>p_id_field, md5(r::TEXT)),
+        r,
+        ra.product_snapshot_id,
+        ra.session_id,
+        ra.created_at
+    FROM raw.review_api ra
+    CROSS JOIN LATERAL jsonb_array_elements(
+        CASE WHEN jsonb_typeof(ra.data->'list_ratings') = 'array'
+            THEN ra.data->'list_ratings' ELSE '[]'::JSONB END
+    ) AS r
+    ORDER BY ra.product_id, COALESCE(r->>p_id_field, md5(r::TEXT)), ra.created_at DESC
+    ON CONFLICT (product_id, review_id) DO NOTHING;
+    
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- =====================================================
+-- ĐẾM TOTAL_PRODUCTS THEO STATEMENT (bulk insert / COPY)
+-- Trigger FOR EACH ROW update cùng 1 dòng crawl_sessions N lần mỗi batch;
+-- bản statement-level cộng 1 lần cho mỗi session từ transition table
+-- =====================================================
+
+CREATE OR REPLACE FUNCTION raw.update_session_total_products_bulk()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE raw.crawl_sessions cs
+    SET total_products = cs.total_products + n.inserted
+    FROM (
+        SELECT session_id, COUNT(*) AS inserted
+        FROM new_rows
+        GROUP BY session_id
+    ) n
+    WHERE cs.session_id = n.session_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_count_listings ON raw.listing_api;
+CREATE TRIGGER trigger_count_listings
+AFTER INSERT ON raw.listing_api
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION raw.update_session_total_products_bulk();
+
+DROP TRIGGER IF EXISTS trigger_count_products ON raw.product_api;
+CREATE TRIGGER trigger_count_products
+AFTER INSERT ON raw.product_api
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION raw.update_session_total_products_bulk();
+
@@ -2,5 +2,31 @@
 Database package - Database handlers
 """
 from .database_handler import DatabaseHandler
+from .async_database_handler import AsyncDatabaseHandler
+from .listing_index import ListingIndex
+import config
 
-__all__ = ['DatabaseHandler']
+
+def create_backend():
+    """
+    Storage backend theo config.DB_BACKEND
+
+    Returns:
+        DatabaseHandler (Supabase / PostgREST), PostgresHandler (asyncpg)
+        hoặc FileSinkHandler (JSONL / Parquet local)
+
+    Raises:
+        ImportError: Backend cần extra chưa cài (asyncpg cho "postgres")
+    """
+    if config.DB_BACKEND == "postgres":
+        from .postgres_handler import POSTGRES_EXTRA_HINT, PostgresHandler, asyncpg
+        if asyncpg is None:
+            raise ImportError(POSTGRES_EXTRA_HINT)
+        return PostgresHandler()
+    if config.DB_BACKEND == "files":
+        from .file_sink_handler import FileSinkHandler
+        return FileSinkHandler()
+    return DatabaseHandler()
+
+
+__all__ = ['DatabaseHandler', 'AsyncDatabaseHandler', 'ListingIndex', 'create_backend']
@@ -0,0 +1,302 @@
+"""
+Async persistence layer in front of DatabaseHandler
+
+Reads run in a thread pool so the event loop keeps serving HTTP fetches
+(backends with coroutine methods, e.g. PostgresHandler, are awaited directly).
+Writes are enqueued into a bounded queue and drained by background
+workers that merge concurrent requests into bulk RPCs.
+"""
+import asyncio
+import functools
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Set, Tuple
+
+from utils.logger import get_logger
+import config
+
+logger = get_logger()
+
+LISTINGS = "listings"
+PRODUCTS = "products"
+REVIEWS = "reviews"
+WATERMARKS = "watermarks"
+
+
+class _WriteRequest:
+    """One enqueued write waiting for its batch to be flushed"""
+
+    __slots__ = ("kind", "session_id", "source_name", "items", "future")
+
+    def __init__(self, kind: str, session_id: uuid.UUID, source_name: Optional[str], items: List[Dict[str, Any]]):
+        self.kind = kind
+        self.session_id = session_id
+        self.source_name = source_name
+        self.items = items
+        self.future = asyncio.get_running_loop().create_future()
+
+    def resolve(self, result: Any):
+        """Hand the result back unless the caller already gave up (cancelled)"""
+        if not self.future.done():
+            self.future.set_result(result)
+
+    def fail(self, exc: BaseException):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+
+class AsyncDatabaseHandler:
+    """Non-blocking write-behind wrapper around a DatabaseHandler"""
+
+    def __init__(self, db, workers: int = None, queue_size: int = None, flush_interval: float = None):
+        """
+        Args:
+            db: Sync DatabaseHandler doing the actual round trips
+            workers: Number of background write workers
+            queue_size: Max pending write requests before put() waits (backpressure)
+            flush_interval: Max seconds a write waits for its batch to fill
+        """
+        self.db = db
+        self.workers = workers or config.DB_WRITE_WORKERS
+        self.queue_size = queue_size or config.DB_WRITE_QUEUE_SIZE
+        self.flush_interval = flush_interval if flush_interval is not None else config.DB_FLUSH_INTERVAL
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers + config.DB_READ_THREADS,
+            thread_name_prefix="db"
+        )
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+        # Run-scoped cache: product_id -> {"snapshot_id", "latest_page", "watermark"}
+        self._resume_points: Dict[str, Dict[str, Any]] = {}
+
+    async def start(self):
+        """Start background write workers (idempotent)"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"db-writer-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info(f"[DB ASYNC] Started {self.workers} write workers (queue={self.queue_size})")
+
+    async def flush(self):
+        """Wait until every enqueued write has been flushed"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self):
+        """Flush pending writes and stop workers"""
+        await self.flush()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._executor.shutdown(wait=True)
+        if asyncio.iscoroutinefunction(getattr(self.db, "close", None)):
+            await self.db.close()
+        logger.info("[DB ASYNC] Closed write workers")
+
+    async def _run(self, fn, *args):
+        """Run a blocking DatabaseHandler call in the thread pool (async backends are awaited)"""
+        if asyncio.iscoroutinefunction(fn):
+            return await fn(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args))
+
+    # ========================================
+    # Reads / session management (awaited, non-blocking)
+    # ========================================
+
+    async def create_session(self, source_name: str) -> uuid.UUID:
+        return await self._run(self.db.create_session, source_name)
+
+    async def complete_session(self, session_id: uuid.UUID, status: str = 'completed'):
+        return await self._run(self.db.complete_session, session_id, status)
+
+    async def prefetch_review_resume_points(self, product_ids: List[str]):
+        """
+        Load snapshot ids and review resume pages of many products in one query
+        Results are cached for the run; already cached products are skipped
+        """
+        missing = [str(product_id) for product_id in product_ids if str(product_id) not in self._resume_points]
+        if not missing:
+            return
+        points = await self._run(self.db.get_review_resume_points, missing)
+        self._resume_points.update(points)
+        logger.debug(f"[DB ASYNC] Prefetched resume points for {len(points)}/{len(missing)} products")
+
+    async def get_latest_product_snapshot_id(self, product_id: str) -> Optional[int]:
+        point = self._resume_points.get(str(product_id))
+        if point is not None and point["snapshot_id"] is not None:
+            return point["snapshot_id"]
+        return await self._run(self.db.get_latest_product_snapshot_id, product_id)
+
+    async def get_latest_review_page(self, product_id: str) -> int:
+        point = self._resume_points.get(str(product_id))
+        if point is not None:
+            return point["latest_page"]
+        return await self._run(self.db.get_latest_review_page, product_id)
+
+    async def get_next_review_delta_page(self, product_id: str) -> Optional[int]:
+        point = self._resume_points.get(str(product_id))
+        if point is not None:
+            return point.get("delta_page", 0) - 1
+        return await self._run(self.db.get_next_review_delta_page, product_id)
+
+    async def get_review_watermark(self, product_id: str) -> Optional[Dict[str, Any]]:
+        point = self._resume_points.get(str(product_id))
+        if point is not None:
+            return point.get("watermark")
+        return await self._run(self.db.get_review_watermark, product_id)
+
+    async def get_listings_by_brand(self, source_name: str, brand_name: str) -> list:
+        return await self._run(self.db.get_listings_by_brand, source_name, brand_name)
+
+    async def get_all_listings(self, source_name: str) -> List[Dict[str, Any]]:
+        return await self._run(self.db.get_all_listings, source_name)
+
+    async def get_http_validators(self) -> List[Dict[str, Any]]:
+        return await self._run(self.db.get_http_validators)
+
+    async def upsert_http_validators(self, validators: List[Dict[str, Any]]) -> int:
+        return await self._run(self.db.upsert_http_validators, validators)
+
+    # ========================================
+    # Writes (enqueued, batched by workers)
+    # ========================================
+
+    async def _enqueue(self, kind: str, session_id: uuid.UUID, source_name: Optional[str], items: List[Dict[str, Any]]):
+        if not self._tasks:
+            await self.start()
+        request = _WriteRequest(kind, session_id, source_name, items)
+        await self._queue.put(request)  # Waits when the queue is full
+        return await request.future
+
+    async def insert_listings_bulk(self, session_id: uuid.UUID, source_name: str, listings: List[Dict[str, Any]]) -> Optional[Set[str]]:
+        """Same contract as DatabaseHandler.insert_listings_bulk"""
+        return await self._enqueue(LISTINGS, session_id, source_name, listings)
+
+    async def insert_products_bulk(self, session_id: uuid.UUID, products: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Same contract as DatabaseHandler.insert_products_bulk"""
+        return await self._enqueue(PRODUCTS, session_id, None, products)
+
+    async def insert_product(self, session_id: uuid.UUID, product_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Enqueue one product; it is written together with concurrent products
+
+        Returns:
+            {"snapshot_id", "is_new"} or None if not saved
+        """
+        snapshots = await self._enqueue(PRODUCTS, session_id, None, [product_data])
+        return snapshots.get(str(product_data["product_id"]))
+
+    async def insert_reviews_bulk(self, session_id: uuid.UUID, review_pages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Same contract as DatabaseHandler.insert_reviews_bulk"""
+        return await self._enqueue(REVIEWS, session_id, None, review_pages)
+
+    async def upsert_review_watermarks(self, watermarks: List[Dict[str, Any]]) -> int:
+        """Same contract as DatabaseHandler.upsert_review_watermarks"""
+        return await self._enqueue(WATERMARKS, None, None, watermarks)
+
+    def _advance_resume_pages(self, statuses: List[Dict[str, Any]]):
+        """Keep cached resume pages in step with review pages written this run"""
+        for status in statuses:
+            point = self._resume_points.get(str(status["product_id"]))
+            if point is None or status["status"] not in ("inserted", "duplicate"):
+                continue
+            if status["pages"] < 0:
+                point["delta_page"] = min(point.get("delta_page", 0), status["pages"])
+            else:
+                point["latest_page"] = max(point["latest_page"], status["pages"])
+
+    # ========================================
+    # Background workers
+    # ========================================
+
+    async def _worker(self, worker_id: int):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            item_count = len(batch[0].items)
+
+            # Linger briefly so concurrent writes share one round trip
+            deadline = loop.time() + self.flush_interval
+            while item_count < config.DB_WRITE_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(request)
+                item_count += len(request.items)
+
+            try:
+                await self._flush_batch(batch)
+            except Exception as exc:
+                logger.error(f"[DB ASYNC] Writer {worker_id} error: {exc}")
+                for request in batch:
+                    request.fail(exc)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush_batch(self, batch: List[_WriteRequest]):
+        groups: Dict[Tuple[str, uuid.UUID, Optional[str]], List[_WriteRequest]] = {}
+        for request in batch:
+            groups.setdefault((request.kind, request.session_id, request.source_name), []).append(request)
+
+        for (kind, session_id, source_name), requests in groups.items():
+            items = [item for request in requests for item in request.items]
+
+            if kind == LISTINGS:
+                new_ids = await self._run(self.db.insert_listings_bulk, session_id, source_name, items)
+                for request in requests:
+                    request.resolve(
+                        None if new_ids is None
+                        else {str(item["id"]) for item in request.items if str(item.get("id")) in new_ids}
+                    )
+
+            elif kind == PRODUCTS:
+                snapshots: Dict[str, Dict[str, Any]] = {}
+                for start in range(0, len(items), config.PRODUCT_BATCH_SIZE):
+                    snapshots.update(await self._run(
+                        self.db.insert_products_bulk, session_id, items[start:start + config.PRODUCT_BATCH_SIZE]
+                    ))
+                for request in requests:
+                    request.resolve({
+                        str(item["product_id"]): snapshots[str(item["product_id"])]
+                        for item in request.items
+                        if str(item["product_id"]) in snapshots
+                    })
+
+            elif kind == REVIEWS:
+                statuses = await self._run(self.db.insert_reviews_bulk, session_id, items)
+                by_page = {(str(status["product_id"]), status["pages"]): status for status in statuses}
+                self._advance_resume_pages(statuses)
+                for request in requests:
+                    request.resolve([
+                        by_page[(str(item["product_id"]), item["pages"])]
+                        for item in request.items
+                        if (str(item["product_id"]), item["pages"]) in by_page
+                    ])
+
+            elif kind == WATERMARKS:
+                # One upsert cannot touch the same product twice: keep the last watermark
+                latest = {str(item["product_id"]): item for item in items}
+                saved = await self._run(self.db.upsert_review_watermarks, list(latest.values()))
+                for product_id, watermark in latest.items():
+                    point = self._resume_points.get(product_id)
+                    if point is not None and saved:
+                        point["watermark"] = {
+                            "last_total": watermark["last_total"],
+                            "newest_review_id": watermark.get("newest_review_id"),
+                        }
+                for request in requests:
+                    request.resolve(len(request.items) if saved else 0)
+
+            logger.debug(f"[DB ASYNC] Flushed {len(items)} {kind} from {len(requests)} requests")
@@ -3,10 +3,12 @@ Database handler để lưu dữ liệu vào Supabase
 
 IMPORTANT: listing_api lưu full JSON data
 """
-from typing import Dict, Any, Optional
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, List, Set
 import uuid
 from supabase import create_client, Client
 from utils.logger import get_logger
+from utils.helpers import brand_key
 import config
 
 logger = get_logger()
@@ -85,6 +87,7 @@ class DatabaseHandler:
                 "session_id": str(session_id),
                 "source_name": source_name,
                 "product_id": product_id,
+                "brand_id": brand_key((listing_data.get("brand") or {}).get("name")),
                 "data": listing_data
             }
             
@@ -100,38 +103,121 @@ class DatabaseHandler:
             logger.error(f"Lỗi insert listing {listing_data.get('id')}: {exc}")
             return False
     
-    def insert_product(self, session_id: uuid.UUID, product_data: Dict[str, Any]) -> Optional[int]:
+    def insert_listings_bulk(self, session_id: uuid.UUID, source_name: str, listings: List[Dict[str, Any]]) -> Optional[Set[str]]:
+        """
+        Insert nhiều listings (cả trang hoặc cả brand) qua raw.batch_insert_listing_api
+        Mỗi RPC ghi tối đa config.LISTING_BATCH_SIZE listings bằng set-based insert
+        
+        Args:
+            session_id: UUID của crawl session
+            source_name: Source name (lamthaocosmetics/thegioiskinfood)
+            listings: List listing_data (mỗi item có 'id')
+        
+        Returns:
+            Set product_id mới được insert (không gồm duplicate), None nếu lỗi
+        """
+        payload = [
+            {
+                "product_id": str(listing_data["id"]),
+                "brand_id": brand_key((listing_data.get("brand") or {}).get("name")),
+                "data": listing_data
+            }
+            for listing_data in listings
+            if listing_data.get("id") is not None
+        ]
+        
+        new_ids: Set[str] = set()
+        try:
+            for start in range(0, len(payload), config.LISTING_BATCH_SIZE):
+                result = self.client.schema('raw').rpc(
+                    'batch_insert_listing_api',
+                    {
+                        'p_session_id': str(session_id),
+                        'p_source_name': source_name,
+                        'p_products': payload[start:start + config.LISTING_BATCH_SIZE]
+                    }
+                ).execute()
+                
+                for row in result.data or []:
+                    new_ids.add(str(row['product_id']))
+            
+            logger.debug(f"Bulk insert {len(payload)} listings {source_name}: {len(new_ids)} mới")
+            return new_ids
+        except Exception as exc:
+            logger.error(f"Lỗi bulk insert {len(payload)} listings {source_name}: {exc}")
+            return None
+    
+    def insert_product(self, session_id: uuid.UUID, product_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """
         Insert sản phẩm vào bảng product_api
         Lưu full JSON trong data column
+        
+        Dùng raw.batch_insert_product_api nên snapshot id được trả về
+        cả khi sản phẩm không đổi (duplicate), không cần gọi
+        get_latest_product_snapshot_id thêm một lần
+        
+        Returns:
+            {"snapshot_id", "is_new"} hoặc None nếu lỗi
+        """
+        snapshot = self.insert_products_bulk(session_id, [product_data]).get(str(product_data['product_id']))
+        if snapshot and not snapshot["is_new"]:
+            logger.debug(f"Sản phẩm {product_data['product_id']} đã tồn tại (duplicate), snapshot {snapshot['snapshot_id']}")
+        return snapshot
+
+    def insert_products_bulk(self, session_id: uuid.UUID, products: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """
+        Insert nhiều sản phẩm trong 1 RPC qua raw.batch_insert_product_api
+        Dedup set-based theo (product_id, price, bought)
+        
+        Args:
+            session_id: UUID của crawl session
+            products: List product_data (product_id, source_name, data)
+        
+        Returns:
+            Dict product_id -> {"snapshot_id", "is_new"} cho cả dòng mới và dòng đã tồn tại
         """
+        if not products:
+            return {}
+        
         try:
-            # Gọi function từ schema raw
             result = self.client.schema('raw').rpc(
-                'safe_insert_product_api',
+                'batch_insert_product_api',
                 {
                     'p_session_id': str(session_id),
-                    'p_source_name': product_data['source_name'],
-                    'p_product_id': product_data['product_id'],
-                    'p_data': product_data['data']
+                    'p_products': [
+                        {
+                            'product_id': product_data['product_id'],
+                            'source_name': product_data['source_name'],
+                            'data': product_data['data'],
+                        }
+                        for product_data in products
+                    ]
                 }
             ).execute()
             
-            if result.data:
-                logger.debug(f"Đã lưu sản phẩm {product_data['product_id']}")
-                return result.data
-            else:
-                logger.debug(f"Sản phẩm {product_data['product_id']} đã tồn tại (duplicate)")
-                return None
-                
+            snapshots = {}
+            for row in result.data or []:
+                snapshots[str(row['product_id'])] = {
+                    "snapshot_id": row['snapshot_id'],
+                    "is_new": bool(row['is_new']),
+                }
+            
+            new_count = sum(1 for snapshot in snapshots.values() if snapshot["is_new"])
+            logger.debug(f"Bulk insert {len(products)} sản phẩm: {new_count} mới")
+            return snapshots
         except Exception as exc:
-            logger.error(f"Lỗi insert product {product_data.get('product_id', 'unknown')}: {exc}")
-            return None
+            logger.error(f"Lỗi bulk insert {len(products)} sản phẩm: {exc}")
+            return {}
 
     def insert_review(self, review_data: Dict[str, Any]) -> bool:
         """
         Insert review vào raw.review_api
+        (config.REVIEW_STORAGE = "items": tách thành từng review trong raw.review_item)
         """
+        if config.REVIEW_STORAGE == "items":
+            statuses = self.insert_reviews_bulk(review_data["session_id"], [review_data])
+            return any(status["status"] == "inserted" for status in statuses)
+        
         try:
             result = self.client.schema('raw').rpc(
                 "safe_insert_review_api",
@@ -151,6 +237,65 @@ class DatabaseHandler:
             logger.error(f"Lỗi insert review page {review_data.get('pages', 'unknown')}: {exc}")
             return False
 
+    def insert_reviews_bulk(self, session_id: uuid.UUID, review_pages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Insert nhiều trang review (1 hoặc nhiều product) trong 1 transaction mỗi RPC
+        Mỗi RPC ghi tối đa config.REVIEW_BATCH_SIZE trang
+        
+        config.REVIEW_STORAGE:
+            "items": raw.batch_upsert_review_items, tách list_ratings thành
+                     1 dòng / review (key = config.REVIEW_ID_FIELD), upsert
+            "pages": raw.batch_insert_review_api, lưu cả trang JSON như cũ
+        
+        Args:
+            session_id: UUID của crawl session
+            review_pages: List review_data (product_id, product_snapshot_id, pages, data)
+        
+        Returns:
+            List {"product_id", "pages", "status", ...} với status là
+            inserted / duplicate / invalid / error
+            (items: "inserted" = trang có review mới hoặc đã sửa, kèm "reviews", "changed";
+             pages: kèm "review_id" của dòng review_api)
+        """
+        items = config.REVIEW_STORAGE == "items"
+        statuses = []
+        for start in range(0, len(review_pages), config.REVIEW_BATCH_SIZE):
+            chunk = review_pages[start:start + config.REVIEW_BATCH_SIZE]
+            params = {
+                'p_session_id': str(session_id),
+                'p_pages': [
+                    {
+                        'product_id': review_data['product_id'],
+                        'product_snapshot_id': review_data['product_snapshot_id'],
+                        'pages': review_data['pages'],
+                        'data': review_data['data'],
+                    }
+                    for review_data in chunk
+                ]
+            }
+            if items:
+                params['p_id_field'] = config.REVIEW_ID_FIELD
+            try:
+                result = self.client.schema('raw').rpc(
+                    'batch_upsert_review_items' if items else 'batch_insert_review_api',
+                    params
+                ).execute()
+                
+                statuses.extend(result.data or [])
+            except Exception as exc:
+                logger.error(f"Lỗi bulk insert {len(chunk)} trang review: {exc}")
+                statuses.extend(
+                    {
+                        "product_id": review_data['product_id'],
+                        "pages": review_data['pages'],
+                        "review_id": None,
+                        "status": "error",
+                    }
+                    for review_data in chunk
+                )
+        
+        return statuses
+
     def get_latest_product_snapshot_id(self, product_id: str) -> Optional[int]:
         """
         Lấy product snapshot ID mới nhất cho một product_id
@@ -171,12 +316,14 @@ class DatabaseHandler:
     def get_latest_review_page(self, product_id: str) -> int:
         """
         Lấy số trang review lớn nhất đã crawl cho product_id
+        (bỏ qua các dòng delta incremental ở trang âm)
         """
         try:
             # Query trực tiếp bảng review_api
             result = self.client.schema('raw').table('review_api') \
                 .select('pages') \
                 .eq('product_id', product_id) \
+                .gt('pages', 0) \
                 .order('pages', desc=True) \
                 .limit(1) \
                 .execute()
@@ -188,90 +335,233 @@ class DatabaseHandler:
             logger.error(f"Lỗi get latest review page cho {product_id}: {exc}")
             return 0
 
-    def get_listings_by_brand(self, source_name: str, brand_name: str) -> list:
+    def get_next_review_delta_page(self, product_id: str) -> Optional[int]:
         """
-        Lấy danh sách listings từ database theo brand
+        Số trang (âm) cho dòng review delta tiếp theo của product_id
+        Delta lưu ở trang -1, -2, ... để không lẫn với các trang API (> 0)
+        
+        Returns:
+            Trang delta tiếp theo, None nếu lỗi
         """
         try:
-            # Note: Filtering by JSON field in Supabase-py can be tricky
-            # We'll fetch by source_name and filter in Python for flexibility
-            # Or use text search if possible. 
-            # For now, let's try to fetch all for source and filter, 
-            # assuming the number of listings per source isn't massive yet.
-            # Optimization: If dataset grows, add a dedicated brand_id column or index.
-            
-            # Actually, let's try to use the 'contains' filter on the JSON column if possible,
-            # but standard Supabase-py might not support deep JSON filtering easily without RPC.
-            # Let's use a simple RPC or just fetch all for the source (if not too many) or 
-            # better, create a specific RPC for this.
-            
-            # Let's create a simple RPC for this to be efficient
-            # But I cannot modify database.sql easily right now without user permission/migration.
-            # So I will fetch listings for the source and filter in Python.
-            # To avoid fetching EVERYTHING, maybe we can rely on the fact that 
-            # we are processing specific brands.
-            
-            # Let's try to fetch with a limit, or just fetch all for the source.
-            # Given the user mentioned "Big Data", fetching all might be bad.
-            # But for now, let's assume we can filter by brand in the query if we can.
-            
-            # Using Supabase 'contains' for JSONB:
-            # .eq('data->brand->name', brand_name) might not work directly.
-            
-            # Let's try to use the text search on the data column if it's castable, 
-            # or just fetch all. 
-            # Wait, listing_api has `brand_id` column! 
-            # Let's check database.sql again.
-            # "brand_id VARCHAR(100) NULL"
-            # And "listing_api" table definition.
-            
-            # If brand_id is populated, we can use it.
-            # In listing_crawler.py, we didn't explicitly populate `brand_id` column in the insert.
-            # We passed `listing_data` which has `brand` dict.
-            # The `insert_listing` method:
-            # data_to_insert = { ..., "data": listing_data }
-            # It does NOT populate `brand_id` column explicitly in the `data_to_insert` dict 
-            # unless `listing_data` has it? No, `listing_api` table has `brand_id` column.
-            # The `insert_listing` method in `database_handler.py` (lines 84-89) 
-            # ONLY inserts `session_id`, `source_name`, `product_id`, `data`.
-            # It does NOT insert `brand_id`.
-            
-            # So `brand_id` column is likely NULL.
-            # So we must filter by `data`.
+            result = self.client.schema('raw').table('review_api') \
+                .select('pages') \
+                .eq('product_id', product_id) \
+                .lt('pages', 0) \
+                .order('pages') \
+                .limit(1) \
+                .execute()
             
-            # Let's use a raw SQL query via RPC if possible, or just fetch all for source.
-            # Since we want to be safe and not fetch millions of rows, 
-            # let's try to use a filter on the JSON column if the client supports it.
-            # client.table('listing_api').select('product_id, data').eq('source_name', source_name).execute()
+            if result.data:
+                return result.data[0]['pages'] - 1
+            return -1
+        except Exception as exc:
+            logger.error(f"Lỗi get review delta page cho {product_id}: {exc}")
+            return None
+
+    def get_review_resume_points(self, product_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Lấy snapshot mới nhất, trang review lớn nhất và watermark cho nhiều product_id
+        Thay cho N lần get_latest_product_snapshot_id + get_latest_review_page
+        
+        Args:
+            product_ids: List product_id (ví dụ cả brand)
+        
+        Returns:
+            Dict product_id -> {"snapshot_id", "latest_page", "delta_page", "watermark"}, {} nếu lỗi
+            (delta_page: trang âm nhỏ nhất đã lưu, 0 nếu chưa có delta;
+            watermark None nếu product chưa từng sync review)
+        """
+        ids = list(dict.fromkeys(str(product_id) for product_id in product_ids))
+        points: Dict[str, Dict[str, Any]] = {}
+        try:
+            for start in range(0, len(ids), config.RESUME_POINT_BATCH_SIZE):
+                result = self.client.schema('raw').rpc(
+                    'get_review_resume_points',
+                    {'p_product_ids': ids[start:start + config.RESUME_POINT_BATCH_SIZE]}
+                ).execute()
+                
+                for row in result.data or []:
+                    points[str(row['product_id'])] = {
+                        "snapshot_id": row['snapshot_id'],
+                        "latest_page": row['latest_page'] or 0,
+                        "delta_page": row.get('delta_page') or 0,
+                        "watermark": None if row.get('last_total') is None else {
+                            "last_total": row['last_total'],
+                            "newest_review_id": row.get('newest_review_id'),
+                        },
+                    }
+            return points
+        except Exception as exc:
+            logger.error(f"Lỗi get resume points cho {len(ids)} sản phẩm: {exc}")
+            return {}
+
+    def get_review_watermark(self, product_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Lấy watermark review (total + id review mới nhất) của lần sync trước
+        
+        Returns:
+            {"last_total", "newest_review_id"} hoặc None nếu chưa có / lỗi
+        """
+        try:
+            result = self.client.schema('raw').table('review_watermark') \
+                .select('last_total, newest_review_id') \
+                .eq('product_id', product_id) \
+                .limit(1) \
+                .execute()
             
-            # If we have to fetch all, it might be slow.
-            # But wait, the user wants "main_pipeline.py" to be fast.
-            # If we fetch all listings every time, it might be slow.
+            if result.data:
+                return result.data[0]
+            return None
+        except Exception as exc:
+            logger.error(f"Lỗi get review watermark cho {product_id}: {exc}")
+            return None
+
+    def upsert_review_watermarks(self, watermarks: List[Dict[str, Any]]) -> int:
+        """
+        Ghi (upsert theo product_id) watermark review sau khi đã lưu review mới
+        
+        Args:
+            watermarks: List {"product_id", "last_total", "newest_review_id"}
+        
+        Returns:
+            Số watermark đã ghi
+        """
+        saved = 0
+        updated_at = datetime.now(timezone.utc).isoformat()
+        try:
+            for start in range(0, len(watermarks), config.RESUME_POINT_BATCH_SIZE):
+                chunk = watermarks[start:start + config.RESUME_POINT_BATCH_SIZE]
+                self.client.schema('raw').table('review_watermark').upsert(
+                    [{**watermark, "updated_at": updated_at} for watermark in chunk],
+                    on_conflict='product_id'
+                ).execute()
+                saved += len(chunk)
+        except Exception as exc:
+            logger.error(f"Lỗi upsert {len(watermarks)} review watermarks: {exc}")
+        return saved
+
+    def get_all_listings(self, source_name: str, page_size: int = None) -> List[Dict[str, Any]]:
+        """
+        Stream toàn bộ listings của một nguồn bằng keyset pagination (listing_id)
+        Chỉ select các cột đã tách sẵn (product_url, brand_id), không tải JSONB data
+        
+        Returns:
+            List {"listing_id", "product_id", "product_url", "brand_id"}
+        """
+        page_size = page_size or config.LISTING_INDEX_PAGE_SIZE
+        rows = []
+        last_id = 0
+        
+        while True:
+            result = self.client.schema('raw').table('listing_api') \
+                .select('listing_id, product_id, product_url, brand_id') \
+                .eq('source_name', source_name) \
+                .gt('listing_id', last_id) \
+                .order('listing_id') \
+                .limit(page_size) \
+                .execute()
             
-            # Let's try to implement a smart filter.
-            # Since I cannot add RPC right now, I will fetch all for the source 
-            # BUT only select necessary columns to reduce bandwidth.
+            batch = result.data or []
+            if not batch:
+                break
             
-            result = self.client.schema('raw').table('listing_api') \
-                .select('product_id, data') \
+            rows.extend(batch)
+            last_id = batch[-1]['listing_id']
+        
+        logger.info(f"Nạp {len(rows)} listings của {source_name}")
+        return rows
+
+    def get_http_validators(self, page_size: int = None) -> List[Dict[str, Any]]:
+        """
+        Nạp toàn bộ validator của conditional GET (keyset pagination theo url)
+        
+        Returns:
+            List {"url", "etag", "last_modified", "body_hash", "meta"}, [] nếu lỗi
+        """
+        page_size = page_size or config.LISTING_INDEX_PAGE_SIZE
+        rows = []
+        last_url = ''
+        
+        try:
+            while True:
+                result = self.client.schema('raw').table('http_validator') \
+                    .select('url, etag, last_modified, body_hash, meta') \
+                    .gt('url', last_url) \
+                    .order('url') \
+                    .limit(page_size) \
+                    .execute()
+                
+                batch = result.data or []
+                if not batch:
+                    break
+                
+                rows.extend(batch)
+                last_url = batch[-1]['url']
+        except Exception as exc:
+            logger.error(f"Lỗi nạp http validators: {exc}")
+            return []
+        
+        logger.info(f"Nạp {len(rows)} http validators")
+        return rows
+
+    def upsert_http_validators(self, validators: List[Dict[str, Any]]) -> int:
+        """
+        Ghi (upsert theo url) các validator đã thay đổi trong run
+        
+        Returns:
+            Số validator đã ghi
+        """
+        saved = 0
+        try:
+            for start in range(0, len(validators), config.LISTING_BATCH_SIZE):
+                chunk = validators[start:start + config.LISTING_BATCH_SIZE]
+                self.client.schema('raw').table('http_validator').upsert(
+                    chunk,
+                    on_conflict='url'
+                ).execute()
+                saved += len(chunk)
+        except Exception as exc:
+            logger.error(f"Lỗi upsert {len(validators)} http validators: {exc}")
+        return saved
+
+    def get_listings_by_brand(self, source_name: str, brand_name: str) -> list:
+        """
+        Lấy danh sách listings từ database theo brand
+        Lọc phía server theo (source_name, brand_id) qua idx_listing_source_brand,
+        chỉ trả product_id và product_url
+        
+        Nếu không có brand_id khớp chính xác, fallback sang so khớp lỏng (ilike)
+        trên brand_id thay vì tải cả bảng
+        """
+        brand_id = brand_key(brand_name)
+        if not brand_id:
+            return []
+        
+        try:
+            table = self.client.schema('raw').table('listing_api')
+            result = table \
+                .select('product_id, product_url') \
                 .eq('source_name', source_name) \
+                .eq('brand_id', brand_id) \
                 .execute()
             
-            listings = []
-            if result.data:
-                normalized_target_brand = brand_name.lower()
-                for item in result.data:
-                    data = item.get('data', {})
-                    item_brand = data.get('brand', {}).get('name', '').lower()
-                    
-                    # Loose matching
-                    if normalized_target_brand in item_brand or item_brand in normalized_target_brand:
-                        listings.append({
-                            "product_id": item['product_id'],
-                            "product_url": data.get('url', ''),
-                        })
+            rows = result.data or []
+            if not rows:
+                result = table \
+                    .select('product_id, product_url') \
+                    .eq('source_name', source_name) \
+                    .ilike('brand_id', f'%{brand_id}%') \
+                    .execute()
+                rows = result.data or []
             
-            return listings
+            return [
+                {
+                    "product_id": row['product_id'],
+                    "product_url": row.get('product_url') or '',
+                }
+                for row in rows
+            ]
             
         except Exception as exc:
             logger.error(f"Lỗi get listings by brand {brand_name}: {exc}")
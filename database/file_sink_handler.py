@@ -0,0 +1,480 @@
+"""
+Local file sink backend (JSONL / Parquet) with the same interface as DatabaseHandler
+
+Runs the pipeline without Supabase, for offline runs and benchmarks.
+Rows are buffered in memory and appended to partitioned files:
+
+    {FILE_SINK_DIR}/{table}/source={source}/date={YYYY-MM-DD}/part-{run_id}.jsonl
+    {FILE_SINK_DIR}/{table}/source={source}/date={YYYY-MM-DD}/part-{run_id}-{seq}.parquet
+
+An in-memory index mirrors the database rules so reruns behave the same:
+    listing_api   one row per product_id
+    product_api   one snapshot per (product_id, price, bought)
+    review_api    one row per (product_id, pages)              (REVIEW_STORAGE = "pages")
+    review_item   one row per (product_id, review id), new version
+                  only when the review changed                 (REVIEW_STORAGE = "items")
+The index is rebuilt from the existing files when the sink starts.
+
+Selected with config.DB_BACKEND = "files"; Parquet needs the `parquet` extra
+(`uv sync --extra parquet`). Encoding and file writes run in a worker thread
+(asyncio.to_thread) so they never block the fetch stages on the event loop.
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Optional dependency, only needed for FILE_SINK_FORMAT = "parquet"
+    pyarrow = None
+
+from utils.logger import get_logger
+from utils.helpers import brand_key
+import config
+
+logger = get_logger()
+
+PARQUET_EXTRA_HINT = (
+    "FILE_SINK_FORMAT = 'parquet' cần pyarrow (extra 'parquet'): "
+    "uv sync --extra parquet hoặc pip install -e '.[parquet]'"
+)
+
+SESSIONS = "crawl_sessions"
+LISTINGS = "listing_api"
+PRODUCTS = "product_api"
+REVIEW_PAGES = "review_api"
+REVIEW_ITEMS = "review_item"
+WATERMARKS = "review_watermark"
+VALIDATORS = "http_validator"
+
+# Columns holding nested JSON: kept as JSON text in Parquet (schemas vary per row)
+_JSON_COLUMNS = ("data", "meta")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _number(value, cast):
+    """price / bought như Postgres cast (NULL nếu không parse được)"""
+    try:
+        return cast(value) if value is not None and value != "" else None
+    except (TypeError, ValueError):
+        return None
+
+
+class FileSinkHandler:
+    """Buffered, partitioned local files + in-memory dedup index"""
+
+    def __init__(self, root: str = None, file_format: str = None, buffer_rows: int = None):
+        """
+        Args:
+            root: Output directory (default config.FILE_SINK_DIR)
+            file_format: "jsonl" or "parquet" (default config.FILE_SINK_FORMAT)
+            buffer_rows: Rows buffered per partition before they are written
+        """
+        self.root = root or config.FILE_SINK_DIR
+        self.format = file_format or config.FILE_SINK_FORMAT
+        self.buffer_rows = buffer_rows or config.FILE_SINK_BUFFER_ROWS
+        if self.format not in ("jsonl", "parquet"):
+            raise ValueError(f"FILE_SINK_FORMAT không hợp lệ: {self.format}")
+        if self.format == "parquet" and pyarrow is None:
+            raise ImportError(PARQUET_EXTRA_HINT)
+
+        self.run_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self._buffers: Dict[str, List[Dict[str, Any]]] = {}
+        self._parts: Dict[str, int] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.rows_written = 0
+
+        # Dedup index
+        self._listings: Dict[str, Dict[str, Any]] = {}
+        self._snapshots: Dict[Tuple[str, Any, Any], int] = {}
+        self._latest_snapshot: Dict[str, int] = {}
+        self._snapshot_product: Dict[int, str] = {}
+        self._product_source: Dict[str, str] = {}
+        self._review_pages: Dict[str, Set[int]] = {}
+        self._review_items: Dict[Tuple[str, str], str] = {}
+        self._watermarks: Dict[str, Dict[str, Any]] = {}
+        self._validators: Dict[str, Dict[str, Any]] = {}
+        self._next_id = {LISTINGS: 1, PRODUCTS: 1, REVIEW_PAGES: 1}
+
+        os.makedirs(self.root, exist_ok=True)
+        self._load()
+        logger.info(
+            f"[FILE SINK] {self.root} ({self.format}): {len(self._listings)} listings, "
+            f"{len(self._snapshots)} product snapshots, {len(self._review_items)} reviews indexed"
+        )
+
+    # ========================================
+    # Files
+    # ========================================
+
+    def _partition(self, table: str, source: Optional[str]) -> str:
+        parts = [self.root, table]
+        if source:
+            parts.append(f"source={source}")
+        parts.append(f"date={datetime.now(timezone.utc).date().isoformat()}")
+        return os.path.join(*parts)
+
+    async def _append(self, table: str, source: Optional[str], row: Dict[str, Any]):
+        path = self._partition(table, source)
+        buffer = self._buffers.setdefault(path, [])
+        buffer.append(row)
+        if len(buffer) >= self.buffer_rows:
+            await self._write(path)
+
+    async def _write(self, path: str):
+        """Hand a full buffer to a worker thread; one writer per partition at a time"""
+        rows = self._buffers.pop(path, [])
+        if not rows:
+            return
+        if self.format == "jsonl":
+            name = f"part-{self.run_id}.jsonl"
+        else:
+            seq = self._parts[path] = self._parts.get(path, 0) + 1
+            name = f"part-{self.run_id}-{seq:05d}.parquet"
+
+        async with self._locks.setdefault(path, asyncio.Lock()):
+            await asyncio.to_thread(self._write_rows, path, name, rows)
+        self.rows_written += len(rows)
+
+    def _write_rows(self, path: str, name: str, rows: List[Dict[str, Any]]):
+        """Blocking encode + write (runs in a worker thread)"""
+        os.makedirs(path, exist_ok=True)
+
+        if self.format == "jsonl":
+            with open(os.path.join(path, name), "a", encoding="utf-8") as handle:
+                for row in rows:
+                    handle.write(json.dumps(row, ensure_ascii=False, default=str))
+                    handle.write("\n")
+        else:
+            columns = list(dict.fromkeys(key for row in rows for key in row))
+            table = pyarrow.Table.from_pylist([
+                {
+                    key: json.dumps(row.get(key), ensure_ascii=False, default=str) if key in _JSON_COLUMNS
+                    else (str(row.get(key)) if isinstance(row.get(key), uuid.UUID) else row.get(key))
+                    for key in columns
+                }
+                for row in rows
+            ])
+            pyarrow.parquet.write_table(table, os.path.join(path, name))
+
+    def _read(self, table: str):
+        """Rows already on disk for a table, in write order"""
+        table_dir = os.path.join(self.root, table)
+        if not os.path.isdir(table_dir):
+            return
+        files = []
+        for directory, _, names in os.walk(table_dir):
+            files.extend(os.path.join(directory, name) for name in names)
+
+        for path in sorted(files, key=os.path.basename):
+            if path.endswith(".jsonl"):
+                with open(path, encoding="utf-8") as handle:
+                    for line in handle:
+                        if line.strip():
+                            yield json.loads(line)
+            elif path.endswith(".parquet"):
+                if pyarrow is None:
+                    logger.warning(f"[FILE SINK] Bỏ qua {path}: cần pyarrow để đọc Parquet")
+                    continue
+                for row in pyarrow.parquet.read_table(path).to_pylist():
+                    for key in _JSON_COLUMNS:
+                        if isinstance(row.get(key), str):
+                            row[key] = json.loads(row[key])
+                    yield row
+
+    def _load(self):
+        """Rebuild the dedup index from files of earlier runs"""
+        for row in self._read(LISTINGS):
+            self._index_listing(row)
+        for row in self._read(PRODUCTS):
+            self._index_product(row)
+        for row in self._read(REVIEW_PAGES):
+            self._review_pages.setdefault(row["product_id"], set()).add(row["pages"])
+            self._next_id[REVIEW_PAGES] = max(self._next_id[REVIEW_PAGES], row["id"] + 1)
+        for row in self._read(REVIEW_ITEMS):
+            self._review_items[(row["product_id"], row["review_id"])] = self._review_hash(row["data"])
+        for row in self._read(WATERMARKS):
+            self._watermarks[row["product_id"]] = row
+        for row in self._read(VALIDATORS):
+            self._validators[row["url"]] = row
+
+    def _index_listing(self, row: Dict[str, Any]):
+        self._listings[row["product_id"]] = {
+            "listing_id": row["listing_id"],
+            "product_id": row["product_id"],
+            "product_url": row.get("product_url"),
+            "brand_id": row.get("brand_id"),
+            "source_name": row["source_name"],
+        }
+        self._next_id[LISTINGS] = max(self._next_id[LISTINGS], row["listing_id"] + 1)
+
+    def _index_product(self, row: Dict[str, Any]):
+        product_id = row["product_id"]
+        # NULL price / bought never match in SQL, so they are never deduplicated
+        if row.get("price") is not None and row.get("bought") is not None:
+            self._snapshots.setdefault((product_id, row["price"], row["bought"]), row["id"])
+        self._latest_snapshot[product_id] = row["id"]
+        self._snapshot_product[row["id"]] = product_id
+        self._product_source[product_id] = row["source_name"]
+        self._next_id[PRODUCTS] = max(self._next_id[PRODUCTS], row["id"] + 1)
+
+    @staticmethod
+    def _review_hash(review: Any) -> str:
+        return json.dumps(review, sort_keys=True, ensure_ascii=False, default=str)
+
+    async def flush(self):
+        """Write every buffered row"""
+        await asyncio.gather(*(self._write(path) for path in list(self._buffers)))
+
+    async def close(self):
+        """Flush buffers (called by AsyncDatabaseHandler.close)"""
+        await self.flush()
+        logger.info(f"[FILE SINK] Wrote {self.rows_written} rows to {self.root}")
+
+    # ========================================
+    # Sessions
+    # ========================================
+
+    async def create_session(self, source_name: str) -> uuid.UUID:
+        session_id = uuid.uuid4()
+        await self._append(SESSIONS, None, {
+            "session_id": session_id, "source_name": source_name, "status": "running", "started_at": _now(),
+        })
+        logger.success(f"Tạo session mới: {session_id} cho nguồn {source_name}")
+        return session_id
+
+    async def complete_session(self, session_id: uuid.UUID, status: str = 'completed'):
+        await self._append(SESSIONS, None, {"session_id": session_id, "status": status, "finished_at": _now()})
+        logger.success(f"Hoàn thành session {session_id} với trạng thái {status}")
+
+    # ========================================
+    # Listings
+    # ========================================
+
+    async def insert_listing(self, session_id: uuid.UUID, source_name: str, listing_data: Dict[str, Any]) -> bool:
+        return await self.insert_listings_bulk(session_id, source_name, [listing_data]) is not None
+
+    async def insert_listings_bulk(self, session_id: uuid.UUID, source_name: str, listings: List[Dict[str, Any]]) -> Optional[Set[str]]:
+        new_ids: Set[str] = set()
+        for listing_data in listings:
+            if listing_data.get("id") is None:
+                continue
+            product_id = str(listing_data["id"])
+            if product_id in self._listings:
+                continue
+
+            row = {
+                "listing_id": self._next_id[LISTINGS],
+                "session_id": session_id,
+                "source_name": source_name,
+                "product_id": product_id,
+                "brand_id": brand_key((listing_data.get("brand") or {}).get("name")),
+                "product_url": listing_data.get("url") or None,
+                "data": listing_data,
+                "created_at": _now(),
+            }
+            self._index_listing(row)
+            await self._append(LISTINGS, source_name, row)
+            new_ids.add(product_id)
+        return new_ids
+
+    async def get_listings_by_brand(self, source_name: str, brand_name: str) -> list:
+        brand_id = brand_key(brand_name)
+        if not brand_id:
+            return []
+
+        listings = [
+            listing for listing in self._listings.values()
+            if listing["source_name"] == source_name and listing["brand_id"] == brand_id
+        ]
+        if not listings:
+            listings = [
+                listing for listing in self._listings.values()
+                if listing["source_name"] == source_name and brand_id in (listing["brand_id"] or "")
+            ]
+        return [
+            {"product_id": listing["product_id"], "product_url": listing["product_url"] or ""}
+            for listing in listings
+        ]
+
+    async def get_all_listings(self, source_name: str, page_size: int = None) -> List[Dict[str, Any]]:
+        rows = [
+            {key: listing[key] for key in ("listing_id", "product_id", "product_url", "brand_id")}
+            for listing in self._listings.values()
+            if listing["source_name"] == source_name
+        ]
+        logger.info(f"Nạp {len(rows)} listings của {source_name}")
+        return rows
+
+    # ========================================
+    # Products
+    # ========================================
+
+    async def insert_product(self, session_id: uuid.UUID, product_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        snapshots = await self.insert_products_bulk(session_id, [product_data])
+        return snapshots.get(str(product_data['product_id']))
+
+    async def insert_products_bulk(self, session_id: uuid.UUID, products: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        snapshots: Dict[str, Dict[str, Any]] = {}
+        for product_data in products:
+            product_id = str(product_data['product_id'])
+            data = product_data['data']
+            price = _number(data.get('price'), float)
+            bought = _number(data.get('bought'), int)
+
+            snapshot_id = self._snapshots.get((product_id, price, bought))
+            if snapshot_id is not None:
+                snapshots[product_id] = {"snapshot_id": snapshot_id, "is_new": False}
+                continue
+
+            row = {
+                "id": self._next_id[PRODUCTS],
+                "product_id": product_id,
+                "session_id": session_id,
+                "source_name": product_data['source_name'],
+                "price": price,
+                "bought": bought,
+                "data": data,
+                "created_at": _now(),
+            }
+            self._index_product(row)
+            await self._append(PRODUCTS, row["source_name"], row)
+            snapshots[product_id] = {"snapshot_id": row["id"], "is_new": True}
+        return snapshots
+
+    async def get_latest_product_snapshot_id(self, product_id: str) -> Optional[int]:
+        return self._latest_snapshot.get(str(product_id))
+
+    # ========================================
+    # Reviews
+    # ========================================
+
+    async def insert_review(self, review_data: Dict[str, Any]) -> bool:
+        statuses = await self.insert_reviews_bulk(review_data["session_id"], [review_data])
+        return any(status["status"] == "inserted" for status in statuses)
+
+    async def insert_reviews_bulk(self, session_id: uuid.UUID, review_pages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Same contract as DatabaseHandler.insert_reviews_bulk (config.REVIEW_STORAGE)"""
+        statuses = []
+        for review_data in review_pages:
+            product_id = str(review_data['product_id'])
+            pages = review_data['pages']
+            snapshot_id = review_data['product_snapshot_id']
+            source = self._product_source.get(product_id)
+
+            if self._snapshot_product.get(snapshot_id) != product_id:
+                statuses.append({"product_id": product_id, "pages": pages, "status": "invalid"})
+                continue
+
+            if config.REVIEW_STORAGE == "items":
+                reviews = review_data['data'].get('list_ratings') or []
+                changed = 0
+                for review in reviews:
+                    review_id = review.get(config.REVIEW_ID_FIELD) if isinstance(review, dict) else None
+                    review_hash = self._review_hash(review)
+                    key = (product_id, str(review_id) if review_id is not None else review_hash)
+                    if self._review_items.get(key) == review_hash:
+                        continue
+                    self._review_items[key] = review_hash
+                    await self._append(REVIEW_ITEMS, source, {
+                        "product_id": product_id,
+                        "review_id": key[1],
+                        "data": review,
+                        "product_snapshot_id": snapshot_id,
+                        "session_id": session_id,
+                        "created_at": _now(),
+                    })
+                    changed += 1
+                statuses.append({
+                    "product_id": product_id,
+                    "pages": pages,
+                    "reviews": len(reviews),
+                    "changed": changed,
+                    "status": "inserted" if changed else "duplicate",
+                })
+                continue
+
+            stored_pages = self._review_pages.setdefault(product_id, set())
+            if pages in stored_pages:
+                statuses.append({"product_id": product_id, "pages": pages, "review_id": None, "status": "duplicate"})
+                continue
+            row = {
+                "id": self._next_id[REVIEW_PAGES],
+                "product_id": product_id,
+                "product_snapshot_id": snapshot_id,
+                "session_id": session_id,
+                "pages": pages,
+                "data": review_data['data'],
+                "created_at": _now(),
+            }
+            self._next_id[REVIEW_PAGES] += 1
+            stored_pages.add(pages)
+            await self._append(REVIEW_PAGES, source, row)
+            statuses.append({"product_id": product_id, "pages": pages, "review_id": row["id"], "status": "inserted"})
+        return statuses
+
+    async def get_latest_review_page(self, product_id: str) -> int:
+        return max((page for page in self._review_pages.get(str(product_id), ()) if page > 0), default=0)
+
+    async def get_next_review_delta_page(self, product_id: str) -> int:
+        return min((page for page in self._review_pages.get(str(product_id), ()) if page < 0), default=0) - 1
+
+    async def get_review_resume_points(self, product_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        points = {}
+        for product_id in dict.fromkeys(str(product_id) for product_id in product_ids):
+            watermark = self._watermarks.get(product_id)
+            points[product_id] = {
+                "snapshot_id": self._latest_snapshot.get(product_id),
+                "latest_page": max((page for page in self._review_pages.get(product_id, ()) if page > 0), default=0),
+                "delta_page": min((page for page in self._review_pages.get(product_id, ()) if page < 0), default=0),
+                "watermark": None if watermark is None else {
+                    "last_total": watermark["last_total"],
+                    "newest_review_id": watermark.get("newest_review_id"),
+                },
+            }
+        return points
+
+    async def get_review_watermark(self, product_id: str) -> Optional[Dict[str, Any]]:
+        watermark = self._watermarks.get(str(product_id))
+        if watermark is None:
+            return None
+        return {"last_total": watermark["last_total"], "newest_review_id": watermark.get("newest_review_id")}
+
+    async def upsert_review_watermarks(self, watermarks: List[Dict[str, Any]]) -> int:
+        for watermark in watermarks:
+            row = {
+                "product_id": str(watermark["product_id"]),
+                "last_total": watermark["last_total"],
+                "newest_review_id": watermark.get("newest_review_id"),
+                "updated_at": _now(),
+            }
+            self._watermarks[row["product_id"]] = row
+            await self._append(WATERMARKS, None, row)
+        return len(watermarks)
+
+    # ========================================
+    # HTTP validators (conditional GET)
+    # ========================================
+
+    async def get_http_validators(self, page_size: int = None) -> List[Dict[str, Any]]:
+        rows = [
+            {key: validator.get(key) for key in ("url", "etag", "last_modified", "body_hash", "meta")}
+            for validator in self._validators.values()
+        ]
+        logger.info(f"Nạp {len(rows)} http validators")
+        return rows
+
+    async def upsert_http_validators(self, validators: List[Dict[str, Any]]) -> int:
+        for validator in validators:
+            row = {**validator, "updated_at": _now()}
+            self._validators[row["url"]] = row
+            await self._append(VALIDATORS, None, row)
+        return len(validators)
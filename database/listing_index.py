@@ -0,0 +1,83 @@
+"""
+Run-scoped in-memory listing index
+
+Listings of every source are streamed once per run and grouped by
+normalized brand, so a brand lookup no longer scans listing_api.
+"""
+from typing import Dict, Any, List, Iterable, Optional
+
+from utils.logger import get_logger
+from utils.helpers import normalize_brand_name
+import config
+
+logger = get_logger()
+
+
+class ListingIndex:
+    """source_name -> normalized brand -> listings (product_id, product_url)"""
+
+    def __init__(self):
+        self._index: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+
+    @classmethod
+    async def load(cls, db, source_names: Iterable[str], brands: Optional[List[str]] = None) -> "ListingIndex":
+        """
+        Build the index from the database
+
+        A small brand list (ad hoc runs) is loaded with one indexed brand_id
+        query per brand; otherwise one keyset-paginated scan per source.
+
+        Args:
+            db: AsyncDatabaseHandler
+            source_names: Sources to load
+            brands: Brands of the run (optional)
+
+        Returns:
+            Loaded ListingIndex
+        """
+        index = cls()
+        if brands is not None and len(brands) <= config.LISTING_INDEX_BRAND_THRESHOLD:
+            for source_name in source_names:
+                for brand in brands:
+                    for listing in await db.get_listings_by_brand(source_name, brand):
+                        index.add(source_name, brand, listing)
+                logger.info(f"[LISTING INDEX] {source_name}: loaded {len(brands)} brands by brand_id")
+            return index
+
+        for source_name in source_names:
+            rows = await db.get_all_listings(source_name)
+            for row in rows:
+                index.add(source_name, row.get('brand_id') or '', {
+                    "product_id": row['product_id'],
+                    "product_url": row.get('product_url') or '',
+                })
+            logger.info(
+                f"[LISTING INDEX] {source_name}: {len(rows)} listings, "
+                f"{len(index._index.get(source_name, {}))} brands"
+            )
+        return index
+
+    def add(self, source_name: str, brand_name: str, listing: Dict[str, Any]):
+        """Add one listing under its normalized brand"""
+        key = normalize_brand_name(brand_name)
+        self._index.setdefault(source_name, {}).setdefault(key, []).append(listing)
+
+    def get(self, source_name: str, brand_name: str) -> List[Dict[str, Any]]:
+        """
+        Listings of a brand for one source
+
+        Exact normalized-brand lookup first; when the brand is not indexed
+        under that key, fall back to the loose containment match used by
+        DatabaseHandler.get_listings_by_brand (over brand keys, not rows).
+        """
+        brands = self._index.get(source_name, {})
+        key = normalize_brand_name(brand_name)
+
+        if key in brands:
+            return list(brands[key])
+
+        listings = []
+        for item_key, items in brands.items():
+            if item_key and (key in item_key or item_key in key):
+                listings.extend(items)
+        return listings
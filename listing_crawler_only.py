@@ -3,17 +3,18 @@ AGGRESSIVE Listing Crawler - Weekly URL Refresh
 Maximum speed with high concurrency (independent run)
 """
 import sys
+import argparse
 import asyncio
 from datetime import datetime
 
 from utils.logger import get_logger
 from utils.helpers import read_brands_from_file
-from utils.async_helpers import close_session
-from database.database_handler import DatabaseHandler
-from crawlers import (
-    crawl_listing_lamthaocosmetics,
-    crawl_listing_thegioiskinfood,
-)
+from utils.async_helpers import close_session, configure_response_cache, get_response_cache, start_scheduler
+from utils.response_cache import add_cache_arguments
+from utils.parse_pool import start_parse_pool, shutdown_parse_pool
+from database import create_backend
+from database.async_database_handler import AsyncDatabaseHandler
+from crawlers.async_listing_crawler import crawl_brand_listings_concurrent
 import config
 
 logger = get_logger()
@@ -22,29 +23,16 @@ if hasattr(sys.stdout, "reconfigure"):
     sys.stdout.reconfigure(encoding="utf-8")
 
 
-async def crawl_brand_listings(brand: str, db: DatabaseHandler, sessions: dict) -> dict:
-    """Crawl listings for one brand"""
-    stats = {"listings_1": 0, "listings_2": 0}
-    
+async def crawl_brand_listings(brand: str, db: AsyncDatabaseHandler, sessions: dict) -> dict:
+    """Crawl listings for one brand (W1 and W2 concurrently)"""
     logger.info(f"\n{'=' * 60}")
     logger.info(f"Brand: {brand}")
     logger.info(f"{'=' * 60}")
     
-    # W1
-    try:
-        listings_1 = crawl_listing_lamthaocosmetics(brand, sessions[config.WEBSITE_1_NAME], db)
-        stats["listings_1"] = len(listings_1)
-        logger.success(f"✓ W1: {len(listings_1)} NEW")
-    except Exception as exc:
-        logger.error(f"W1 error: {exc}")
+    stats = await crawl_brand_listings_concurrent(brand, sessions, db)
     
-    # W2
-    try:
-        listings_2 = crawl_listing_thegioiskinfood(brand, sessions[config.WEBSITE_2_NAME], db)
-        stats["listings_2"] = len(listings_2)
-        logger.success(f"✓ W2: {len(listings_2)} NEW")
-    except Exception as exc:
-        logger.error(f"W2 error: {exc}")
+    logger.success(f"✓ {brand} W1: {stats['listings_1']} NEW")
+    logger.success(f"✓ {brand} W2: {stats['listings_2']} NEW")
     
     return stats
 
@@ -54,7 +42,7 @@ async def run_listing_crawler_async():
     start_time = datetime.now()
     logger.info("=" * 80)
     logger.info("AGGRESSIVE LISTING CRAWLER - Weekly Run (Maximum Speed)")
-    logger.info(f"Concurrency: 8 | Delay: 0.4s")
+    logger.info(f"Brands: {config.MAX_CONCURRENT_BRANDS} | Requests: {config.MAX_CONCURRENT_REQUESTS}")
     logger.info("=" * 80)
     
     brands = read_brands_from_file()
@@ -64,21 +52,26 @@ async def run_listing_crawler_async():
     
     logger.info(f"Processing {len(brands)} brands\n")
     
-    db = DatabaseHandler()
+    start_parse_pool()
+    db = AsyncDatabaseHandler(create_backend())
+    await db.start()
     sessions = {}
     
     try:
-        sessions[config.WEBSITE_1_NAME] = db.create_session(config.WEBSITE_1_NAME)
-        sessions[config.WEBSITE_2_NAME] = db.create_session(config.WEBSITE_2_NAME)
+        sessions[config.WEBSITE_1_NAME] = await db.create_session(config.WEBSITE_1_NAME)
+        sessions[config.WEBSITE_2_NAME] = await db.create_session(config.WEBSITE_2_NAME)
     except Exception:
         logger.error("Cannot create sessions")
         raise
     
     total_stats = {"listings_1": 0, "listings_2": 0}
     
+    # Shared by every brand so the whole run respects one request budget
+    scheduler = start_scheduler()
+    
     try:
         # Process multiple brands in parallel (aggressive)
-        batch_size = 5  # 5 brands at once - khớp với MAX_CONCURRENT_BRANDS
+        batch_size = config.MAX_CONCURRENT_BRANDS
         
         for i in range(0, len(brands), batch_size):
             batch = brands[i:i + batch_size]
@@ -102,8 +95,14 @@ async def run_listing_crawler_async():
         raise
     finally:
         await close_session()
+        shutdown_parse_pool()
+        scheduler.log_stats()
+        if get_response_cache():
+            logger.info(f"[CACHE] {get_response_cache().stats()}")
+        await db.flush()
         for source_name, session_id in sessions.items():
-            db.complete_session(session_id, 'completed')
+            await db.complete_session(session_id, 'completed')
+        await db.close()
     
     duration = datetime.now() - start_time
     print("\n" + "=" * 80)
@@ -121,6 +120,11 @@ async def run_listing_crawler_async():
 
 def run_listing_crawler():
     """Entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+    configure_response_cache(args.cache_mode)
+    
     try:
         asyncio.run(run_listing_crawler_async())
     except KeyboardInterrupt:
@@ -3,21 +3,36 @@ Optimized Main Pipeline with Async/Concurrent Processing
 HYBRID: Quick wins + Async concurrent crawling
 """
 import sys
+import argparse
 import asyncio
 from datetime import datetime
-from typing import Dict
+from typing import Any, Dict, List, Optional, Set
+from urllib.parse import urljoin
 import uuid
 
 from utils.logger import get_logger
 from utils.helpers import read_brands_from_file
-from utils.async_helpers import close_session
-from database.database_handler import DatabaseHandler
-from crawlers import (
-    crawl_listing_lamthaocosmetics,
-    crawl_listing_thegioiskinfood,
-    crawl_reviews_thegioiskinfood,
+from utils.async_helpers import (
+    NOT_MODIFIED,
+    close_session,
+    configure_response_cache,
+    get_response_cache,
+    get_scheduler,
+    start_scheduler,
+)
+from utils.response_cache import add_cache_arguments
+from utils.parse_pool import start_parse_pool, shutdown_parse_pool
+from utils.validator_store import ValidatorStore
+from utils.stage_pipeline import Stage
+from database import create_backend
+from database.async_database_handler import AsyncDatabaseHandler
+from database.listing_index import ListingIndex
+from crawlers.async_product_crawler import (
+    fetch_product_page,
+    parse_product_page,
+    saved_product_info,
+    unchanged_product_info,
 )
-from crawlers.async_product_crawler import crawl_products_concurrent
 from crawlers.async_review_crawler import crawl_reviews_thegioiskinfood_async
 import config
 
@@ -27,122 +42,255 @@ if hasattr(sys.stdout, "reconfigure"):
     sys.stdout.reconfigure(encoding="utf-8")
 
 
-async def crawl_brand_all_steps_async(brand: str, db: DatabaseHandler, sessions: Dict[str, uuid.UUID]) -> Dict[str, int]:
+class _ProductJob:
+    """One listing flowing through fetch -> parse -> persist"""
+
+    __slots__ = ("brand_run", "source_name", "listing", "full_url", "html", "product_data")
+
+    def __init__(self, brand_run: "_BrandRun", source_name: str, listing: Dict[str, Any]):
+        self.brand_run = brand_run
+        self.source_name = source_name
+        self.listing = listing
+        self.full_url = urljoin(
+            config.WEBSITE_1_BASE if source_name == config.WEBSITE_1_NAME else config.WEBSITE_2_BASE,
+            listing['product_url']
+        )
+        self.html = None
+        self.product_data = None
+
+
+class _BrandRun:
+    """Progress and statistics of one brand inside the pipeline"""
+
+    def __init__(self, brand: str):
+        self.brand = brand
+        self.stats = {
+            "listings_1": 0,
+            "listings_2": 0,
+            "products_1": 0,
+            "products_2": 0,
+            "reviews": 0,
+        }
+        # Products not yet persisted + W2 products whose reviews are still running
+        self.pending = 0
+
+
+class BrandPipeline:
     """
-    Async version: Crawl all steps for one brand with concurrent product processing
+    Streaming pipeline: brands -> listing lookup -> product fetch -> parse -> persist -> reviews
     
-    Args:
-        brand: Brand name
-        db: Database handler
-        sessions: Session IDs dict
-        
-    Returns:
-        Statistics dict
+    Stages are connected by bounded queues, each drained by a fixed number
+    of workers (config.PIPELINE_WORKERS), so a large brand keeps flowing
+    through the stages while small brands finish next to it. The W2
+    product is handed to the review stage as soon as it is persisted, so
+    product and review traffic overlap; statistics are still per brand.
     """
-    stats = {
-        "listings_1": 0,
-        "listings_2": 0,
-        "products_1": 0,
-        "products_2": 0,
-        "reviews": 0,
-    }
     
-    logger.info(f"\n{'=' * 80}")
-    logger.info(f"Brand: {brand}")
-    logger.info(f"{'=' * 80}")
+    def __init__(
+        self,
+        db: AsyncDatabaseHandler,
+        sessions: Dict[str, uuid.UUID],
+        listing_index: ListingIndex,
+        validators: ValidatorStore = None
+    ):
+        self.db = db
+        self.sessions = sessions
+        self.listing_index = listing_index
+        self.validators = validators
+        
+        self.total_stats = {
+            "listings_1": 0,
+            "listings_2": 0,
+            "products_1": 0,
+            "products_2": 0,
+            "reviews": 0,
+        }
+        self.failed_brands: List[str] = []
+        
+        # One task per W2 product in the review stage, bounded by the scheduler's review budget
+        self._review_slots: Optional[asyncio.Semaphore] = None
+        self._review_tasks: Set[asyncio.Task] = set()
+        
+        workers = config.PIPELINE_WORKERS
+        queue_size = config.PIPELINE_QUEUE_SIZE
+        self.stages = [
+            Stage("listing", self._lookup_listings, workers["listing"], queue_size),
+            Stage("fetch", self._fetch, workers["fetch"], queue_size),
+            Stage("parse", self._parse, workers["parse"], queue_size),
+            Stage("persist", self._persist, workers["persist"], queue_size, batch_size=config.PRODUCT_BATCH_SIZE),
+            Stage("review", self._crawl_reviews, workers["review"], queue_size,
+                  batch_size=config.PIPELINE_REVIEW_BATCH_SIZE),
+        ]
+        self.listing, self.fetch, self.parse, self.persist, self.review = self.stages
+    
+    async def run(self, brands: List[str]):
+        """Feed every brand into the pipeline and wait until all stages drained"""
+        review_budget = get_scheduler().stage("review")
+        self._review_slots = asyncio.Semaphore(
+            review_budget.limit if review_budget is not None else config.MAX_REVIEW_CONCURRENT_PAGES
+        )
+        for stage in self.stages:
+            stage.start()
+        try:
+            for brand in brands:
+                await self.listing.put(brand)
+        finally:
+            # Upstream first: a closed stage receives no more items
+            for stage in self.stages:
+                await stage.close()
+            # The review stage only starts tasks; wait for the ones still running
+            if self._review_tasks:
+                await asyncio.gather(*self._review_tasks, return_exceptions=True)
+            for stage in self.stages:
+                logger.info(f"[PIPELINE] {stage.stats()}")
     
     # ========================================
-    # STEP 2: Get Listings from DB (Skip Crawl)
+    # Stages
     # ========================================
-    logger.info(f"\n[STEP 2] Get Listings from DB: {brand}")
     
-    # Website 1
-    try:
-        # listings_1 = crawl_listing_lamthaocosmetics(brand, sessions[config.WEBSITE_1_NAME], db)
-        listings_1 = db.get_listings_by_brand(config.WEBSITE_1_NAME, brand)
-        stats["listings_1"] = len(listings_1)
-        logger.info(f"Found {len(listings_1)} listings for W1 in DB")
-    except Exception as exc:
-        logger.error(f"Error getting listings W1: {exc}")
-        listings_1 = []
+    async def _lookup_listings(self, brand: str):
+        """STEP 2: Listings from the run's listing index (skip crawl)"""
+        try:
+            await self._start_brand(brand)
+        except Exception as exc:
+            self.failed_brands.append(brand)
+            logger.error(f"✗ {brand}: {exc}")
     
-    # Website 2
-    try:
-        # listings_2 = crawl_listing_thegioiskinfood(brand, sessions[config.WEBSITE_2_NAME], db)
-        listings_2 = db.get_listings_by_brand(config.WEBSITE_2_NAME, brand)
-        stats["listings_2"] = len(listings_2)
-        logger.info(f"Found {len(listings_2)} listings for W2 in DB")
-    except Exception as exc:
-        logger.error(f"Error getting listings W2: {exc}")
-        listings_2 = []
+    async def _start_brand(self, brand: str):
+        run = _BrandRun(brand)
+        logger.info(f"\n{'=' * 80}")
+        logger.info(f"Brand: {brand}")
+        logger.info(f"{'=' * 80}")
+        
+        jobs = []
+        for key, source_name in (("listings_1", config.WEBSITE_1_NAME), ("listings_2", config.WEBSITE_2_NAME)):
+            try:
+                listings = self.listing_index.get(source_name, brand)
+            except Exception as exc:
+                logger.error(f"Error getting listings {source_name}: {exc}")
+                listings = []
+            run.stats[key] = len(listings)
+            jobs.extend(_ProductJob(run, source_name, listing) for listing in listings)
+        
+        logger.success(f"[STEP 2] {brand}: {run.stats['listings_1']} (W1) + {run.stats['listings_2']} (W2) listings from DB")
+        
+        run.pending = len(jobs)
+        if not jobs:
+            self._brand_done(run)
+            return
+        for job in jobs:
+            await self.fetch.put(job)
     
-    logger.success(f"[STEP 2] Total listings from DB: {stats['listings_1']} (W1) + {stats['listings_2']} (W2)")
+    async def _fetch(self, job: _ProductJob):
+        """STEP 3a: Fetch the product page (conditional GET)"""
+        html_content = None
+        try:
+            html_content = await fetch_product_page(job.source_name, job.listing, self.validators)
+        finally:
+            if html_content is NOT_MODIFIED:
+                await self._product_done(job, unchanged_product_info(job.listing, job.full_url, self.validators))
+            elif html_content:
+                job.html = html_content
+                await self.parse.put(job)
+            else:
+                await self._product_done(job, None)
     
-    # ========================================
-    # STEP 3: Crawl Products CONCURRENTLY
-    # ========================================
-    logger.info(f"\n[STEP 3] Crawl Products (CONCURRENT)")
+    async def _parse(self, job: _ProductJob):
+        """STEP 3b: Parse in the parse pool"""
+        product_data = None
+        try:
+            product_data = await parse_product_page(job.source_name, job.listing, job.html)
+        finally:
+            job.html = None
+            if product_data:
+                job.product_data = product_data
+                await self.persist.put(job)
+            else:
+                await self._product_done(job, None)
+    
+    async def _persist(self, jobs: List[_ProductJob]):
+        """STEP 3c: One bulk insert per session for every queued product"""
+        by_session: Dict[uuid.UUID, List[_ProductJob]] = {}
+        for job in jobs:
+            by_session.setdefault(self.sessions[job.source_name], []).append(job)
+        
+        for session_id, session_jobs in by_session.items():
+            snapshots = {}
+            try:
+                snapshots = await self.db.insert_products_bulk(
+                    session_id, [job.product_data for job in session_jobs]
+                ) or {}
+            except Exception as exc:
+                logger.error(f"[PIPELINE] Persist error: {exc}")
+            for job in session_jobs:
+                snapshot = snapshots.get(str(job.product_data["product_id"]))
+                info = saved_product_info(job.product_data, snapshot, job.full_url, self.validators)
+                await self._product_done(job, info)
     
-    # Process both websites concurrently
-    tasks = []
+    async def _crawl_reviews(self, jobs: List[tuple]):
+        """STEP 4: Start one review task per persisted W2 product as soon as it is dequeued"""
+        try:
+            # Snapshot ids come from the product stage; resume pages in one lookup for the queued products
+            await self.db.prefetch_review_resume_points([info['product_id'] for _, info in jobs])
+        except Exception as exc:
+            logger.error(f"[PIPELINE] Resume point prefetch error: {exc}")
+        
+        for run, info in jobs:
+            # Waits while the review budget is full, so the review queue still applies backpressure
+            await self._review_slots.acquire()
+            task = asyncio.create_task(self._review_product(run, info))
+            self._review_tasks.add(task)
+            task.add_done_callback(self._review_tasks.discard)
     
-    if listings_1:
-        tasks.append(crawl_products_concurrent(
-            listings_1,
-            sessions[config.WEBSITE_1_NAME],
-            db,
-            config.WEBSITE_1_NAME
-        ))
+    async def _review_product(self, run: _BrandRun, info: Dict[str, Any]):
+        """Reviews of one product; never waits for other products"""
+        try:
+            result = await crawl_reviews_thegioiskinfood_async(
+                info['id'],
+                info['product_id'],
+                self.sessions[config.WEBSITE_2_NAME],
+                self.db,
+                product_snapshot_id=info.get('snapshot_id')
+            )
+            if isinstance(result, int):
+                run.stats["reviews"] += result
+        except Exception as exc:
+            logger.error(f"[REVIEW] {info['product_id']}: {exc}")
+        finally:
+            self._review_slots.release()
+            self._unit_done(run)
     
-    if listings_2:
-        tasks.append(crawl_products_concurrent(
-            listings_2,
-            sessions[config.WEBSITE_2_NAME],
-            db,
-            config.WEBSITE_2_NAME
-        ))
+    # ========================================
+    # Bookkeeping
+    # ========================================
     
-    if tasks:
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        for i, result in enumerate(results):
-            if isinstance(result, Exception):
-                logger.error(f"Product crawl error: {result}")
+    async def _product_done(self, job: _ProductJob, product_info: Optional[Dict[str, Any]]):
+        run = job.brand_run
+        if product_info:
+            if job.source_name == config.WEBSITE_1_NAME:
+                run.stats["products_1"] += 1
             else:
-                if i == 0 and listings_1:  # W1
-                    stats["products_1"] = result.get("products", 0)
-                elif i == (1 if listings_1 else 0) and listings_2:  # W2
-                    stats["products_2"] = result.get("products", 0)
-                    
-                    # STEP 4: Crawl Reviews for W2 products
-                    if "results" in result:
-                        semaphore = asyncio.Semaphore(config.MAX_CONCURRENT_REQUESTS)
-                        review_tasks = []
-                        
-                        for product_result in result["results"]:
-                            if product_result and product_result.get('id'):
-                                review_tasks.append(
-                                    crawl_reviews_thegioiskinfood_async(
-                                        product_result['id'],
-                                        product_result['product_id'],
-                                        sessions[config.WEBSITE_2_NAME],
-                                        db,
-                                        semaphore
-                                    )
-                                )
-                        
-                        if review_tasks:
-                            logger.info(f"\n[STEP 4] Crawl Reviews (CONCURRENT)")
-                            review_results = await asyncio.gather(*review_tasks, return_exceptions=True)
-                            stats["reviews"] = sum(r for r in review_results if isinstance(r, int))
+                run.stats["products_2"] += 1
+                if product_info.get('id'):
+                    # Still pending until its reviews are done
+                    await self.review.put((run, product_info))
+                    return
+        self._unit_done(run)
     
-    logger.success(
-        f"[COMPLETE] {brand}: "
-        f"Products={stats['products_1']+stats['products_2']}, "
-        f"Reviews={stats['reviews']}"
-    )
+    def _unit_done(self, run: _BrandRun):
+        run.pending -= 1
+        if run.pending == 0:
+            self._brand_done(run)
     
-    return stats
+    def _brand_done(self, run: _BrandRun):
+        for key in self.total_stats:
+            self.total_stats[key] += run.stats[key]
+        logger.success(
+            f"✓ {run.brand}: "
+            f"Listings={run.stats['listings_1']+run.stats['listings_2']}, "
+            f"Products={run.stats['products_1']+run.stats['products_2']}, "
+            f"Reviews={run.stats['reviews']}"
+        )
 
 
 async def run_pipeline_async():
@@ -161,64 +309,39 @@ async def run_pipeline_async():
     
     logger.info(f"Processing {len(brands)} brands with {config.MAX_CONCURRENT_REQUESTS} concurrent requests\n")
     
-    # Initialize database
-    db = DatabaseHandler()
+    # Parse workers (CPU-bound parsing off the event loop)
+    start_parse_pool()
+    
+    # One scheduler owns the global / per-host / per-stage request budgets of the run
+    scheduler = start_scheduler()
+    
+    # Initialize database (writes go through the async write-behind queue)
+    db = AsyncDatabaseHandler(create_backend())
+    await db.start()
     sessions = {}
     pipeline_failed = False
     
     # Create sessions
     try:
-        sessions[config.WEBSITE_1_NAME] = db.create_session(config.WEBSITE_1_NAME)
-        sessions[config.WEBSITE_2_NAME] = db.create_session(config.WEBSITE_2_NAME)
+        sessions[config.WEBSITE_1_NAME] = await db.create_session(config.WEBSITE_1_NAME)
+        sessions[config.WEBSITE_2_NAME] = await db.create_session(config.WEBSITE_2_NAME)
     except Exception:
         logger.error("Cannot create sessions")
         raise
     
-    # Statistics
-    total_stats = {
-        "listings_1": 0,
-        "listings_2": 0,
-        "products_1": 0,
-        "products_2": 0,
-        "reviews": 0,
-    }
-    failed_brands = []
+    # Load listings once for the whole run (by brand_id for small ad hoc runs)
+    listing_index = await ListingIndex.load(db, [config.WEBSITE_1_NAME, config.WEBSITE_2_NAME], brands)
+    
+    # Validators of the previous runs for conditional product fetches
+    validators = await ValidatorStore.load(db) if config.CONDITIONAL_FETCH else None
+    
+    # Stages connected by bounded queues, fixed workers per stage
+    pipeline = BrandPipeline(db, sessions, listing_index, validators)
+    total_stats = pipeline.total_stats
+    failed_brands = pipeline.failed_brands
     
-    # Crawl brands (with brand-level concurrency)
     try:
-        # Process brands in batches
-        brand_batch_size = config.MAX_CONCURRENT_BRANDS
-        
-        for batch_start in range(0, len(brands), brand_batch_size):
-            batch_brands = brands[batch_start:batch_start + brand_batch_size]
-            
-            logger.info(f"\n{'#' * 80}")
-            logger.info(f"Processing batch: {', '.join(batch_brands)}")
-            logger.info(f"{'#' * 80}")
-            
-            # Process brands in this batch concurrently
-            batch_tasks = [
-                crawl_brand_all_steps_async(brand, db, sessions)
-                for brand in batch_brands
-            ]
-            
-            batch_results = await asyncio.gather(*batch_tasks, return_exceptions=True)
-            
-            # Collect stats
-            for brand, result in zip(batch_brands, batch_results):
-                if isinstance(result, Exception):
-                    failed_brands.append(brand)
-                    logger.error(f"✗ {brand}: {result}")
-                else:
-                    for key in total_stats:
-                        total_stats[key] += result[key]
-                    
-                    logger.success(
-                        f"✓ {brand}: "
-                        f"Listings={result['listings_1']+result['listings_2']}, "
-                        f"Products={result['products_1']+result['products_2']}, "
-                        f"Reviews={result['reviews']}"
-                    )
+        await pipeline.run(brands)
     
     except KeyboardInterrupt:
         pipeline_failed = True
@@ -229,13 +352,26 @@ async def run_pipeline_async():
         logger.error(f"Critical error: {exc}")
         raise
     finally:
-        # Close async session
+        # Close async session and parse workers
         await close_session()
+        shutdown_parse_pool()
+        scheduler.log_stats()
+        if get_response_cache():
+            logger.info(f"[CACHE] {get_response_cache().stats()}")
+        
+        # Flush pending writes before closing the sessions
+        await db.flush()
+        
+        # Validators are committed only for products whose write went through
+        if validators is not None:
+            await validators.save(db)
         
         # Complete sessions
         status = "failed" if pipeline_failed else "completed"
         for source_name, session_id in sessions.items():
-            db.complete_session(session_id, status)
+            await db.complete_session(session_id, status)
+        
+        await db.close()
     
     # Report
     duration = datetime.now() - start_time
@@ -265,6 +401,11 @@ async def run_pipeline_async():
 
 def run_pipeline():
     """Entry point - runs async pipeline"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+    configure_response_cache(args.cache_mode)
+    
     try:
         asyncio.run(run_pipeline_async())
     except KeyboardInterrupt:
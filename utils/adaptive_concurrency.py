@@ -0,0 +1,190 @@
+"""
+Adaptive (AIMD) concurrency limit per host
+
+Every request to a host runs inside one of the host's slots. The scheduler
+reports each completed request with record(), timed on the wire only (after
+every slot and the rate token), so queueing elsewhere never looks like
+server latency. Requests are evaluated in windows of config.AIMD_WINDOW:
+
+    additive increase        limit += 1 when the window was saturated, its
+                             p95 latency stayed within AIMD_LATENCY_TOLERANCE
+                             of the best p95 seen and its error rate stayed
+                             under AIMD_MAX_ERROR_RATE
+    multiplicative decrease  limit *= AIMD_DECREASE_FACTOR on 429 / 503 /
+                             timeouts, once per congestion event (requests
+                             started before the cut do not cut it again)
+
+The per-host token bucket stays the hard ceiling on requests/s.
+"""
+import asyncio
+import contextlib
+from collections import deque
+from typing import Deque, List, Optional
+
+from aiohttp import ClientResponseError
+
+from utils.logger import get_logger
+import config
+
+logger = get_logger()
+
+
+def is_congestion(exc: BaseException) -> bool:
+    """429 / 503 / timeout: the host asks us to slow down"""
+    if isinstance(exc, asyncio.TimeoutError):
+        return True
+    return isinstance(exc, ClientResponseError) and exc.status in config.AIMD_BACKOFF_STATUSES
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit of one host"""
+
+    def __init__(self, name: str, initial: int = None, minimum: int = None, maximum: int = None):
+        self.name = name
+        self.min_limit = minimum or config.AIMD_MIN_LIMIT
+        self.max_limit = maximum or config.AIMD_MAX_LIMIT
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial or config.AIMD_INITIAL_LIMIT)))
+        self.in_flight = 0
+        self.peak = 0
+
+        self.increases = 0
+        self.decreases = 0
+        self.best_p95: Optional[float] = None
+        self.last_p95: Optional[float] = None
+
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._epoch = 0
+        self._latencies: List[float] = []
+        self._errors = 0
+        self._saturated = False
+
+    @property
+    def current(self) -> int:
+        return int(self.limit)
+
+    @property
+    def epoch(self) -> int:
+        """Congestion epoch; pass the value seen when a request starts to record()"""
+        return self._epoch
+
+    async def _acquire(self):
+        loop = asyncio.get_running_loop()
+        while self.in_flight >= self.current:
+            self._saturated = True
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if not waiter.cancelled():
+                    # Woken by _wake() but cancelled before resuming: hand the slot to the next waiter
+                    self._waiters.remove(waiter)
+                    self._wake()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        if self.in_flight >= self.current:
+            self._saturated = True
+
+    def _release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        free = self.current - self.in_flight
+        for waiter in list(self._waiters):
+            if free <= 0:
+                break
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Hold one slot of the host (the outcome is reported with record())"""
+        await self._acquire()
+        try:
+            yield
+        finally:
+            self._release()
+
+    def record(self, epoch: int, latency: Optional[float], exc: Optional[BaseException] = None):
+        """
+        Outcome of one request
+        
+        Args:
+            epoch: self.epoch when the request went on the wire
+            latency: Seconds on the wire (None when it failed)
+            exc: Exception of a failed request
+        """
+        if epoch != self._epoch:
+            # Started before the last decrease, says nothing about the new limit
+            return
+
+        if exc is not None and is_congestion(exc):
+            self._decrease(exc)
+            return
+
+        if exc is not None:
+            self._errors += 1
+        else:
+            self._latencies.append(latency)
+
+        if len(self._latencies) + self._errors >= config.AIMD_WINDOW:
+            self._evaluate()
+
+    def _reset_window(self):
+        self._latencies = []
+        self._errors = 0
+        self._saturated = self.in_flight >= self.current
+
+    def _evaluate(self):
+        total = len(self._latencies) + self._errors
+        error_rate = self._errors / total
+        p95 = None
+        if self._latencies:
+            ordered = sorted(self._latencies)
+            p95 = ordered[int(0.95 * (len(ordered) - 1))]
+            self.last_p95 = p95
+            self.best_p95 = p95 if self.best_p95 is None else min(self.best_p95, p95)
+
+        healthy = (
+            p95 is not None
+            and error_rate <= config.AIMD_MAX_ERROR_RATE
+            and p95 <= self.best_p95 * config.AIMD_LATENCY_TOLERANCE
+        )
+        if healthy and self._saturated and self.current < self.max_limit:
+            previous = self.current
+            self.limit = min(self.max_limit, self.limit + 1)
+            self.increases += 1
+            logger.info(
+                f"[AIMD] {self.name}: limit {previous} -> {self.current} "
+                f"(p95 {p95:.2f}s, errors {error_rate:.0%})"
+            )
+            self._wake()
+        elif not healthy:
+            p95_text = f"{p95:.2f}s" if p95 is not None else "n/a"
+            logger.debug(
+                f"[AIMD] {self.name}: holding limit {self.current} "
+                f"(p95 {p95_text}, best {self.best_p95 or 0:.2f}s, errors {error_rate:.0%})"
+            )
+        self._reset_window()
+
+    def _decrease(self, exc: BaseException):
+        previous = self.current
+        self.limit = max(float(self.min_limit), self.limit * config.AIMD_DECREASE_FACTOR)
+        self.decreases += 1
+        self._epoch += 1
+        self._reset_window()
+        reason = f"HTTP {exc.status}" if isinstance(exc, ClientResponseError) else "timeout"
+        logger.warning(f"[AIMD] {self.name}: {reason}, limit {previous} -> {self.current}")
+
+    def stats(self) -> str:
+        p95 = f"{self.last_p95:.2f}s" if self.last_p95 is not None else "n/a"
+        return (
+            f"{self.name}: limit {self.current} (min {self.min_limit}, max {self.max_limit}), "
+            f"peak {self.peak}, {self.increases} increases, {self.decreases} decreases, last p95 {p95}"
+        )
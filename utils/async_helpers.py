@@ -2,19 +2,55 @@
 Async helpers for concurrent crawling with rate limiting
 """
 import asyncio
-import random
-from typing import Optional, Dict, Any
+import inspect
+from typing import Optional, Dict, Any, Callable, List, Tuple
 from aiohttp import ClientSession, TCPConnector, ClientTimeout
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 from utils.logger import get_logger
+from utils.validator_store import ValidatorStore, body_hash
+from utils.response_cache import ResponseCache
+from utils.scheduler import RequestScheduler, STAGE_LISTING
 import config
 
 logger = get_logger()
 
+# Returned instead of the body when a conditional fetch found no change
+NOT_MODIFIED = object()
+
 # Global session for connection reuse
 _session: Optional[ClientSession] = None
 _session_lock = asyncio.Lock()
 
+# Optional on-disk response cache (see configure_response_cache)
+_response_cache: Optional[ResponseCache] = None
+
+
+# Request scheduler of the current run (see start_scheduler)
+_scheduler: Optional[RequestScheduler] = None
+
+
+def start_scheduler() -> RequestScheduler:
+    """
+    Create the run's request scheduler (global / per-host / per-stage budgets)
+    
+    Returns:
+        The new scheduler, used by every async request of the run
+    """
+    global _scheduler
+    _scheduler = RequestScheduler()
+    logger.info(
+        f"[SCHEDULER] global limit {_scheduler.global_budget.limit}, "
+        f"stages {_scheduler.stage_limits}"
+    )
+    return _scheduler
+
+
+def get_scheduler() -> RequestScheduler:
+    """Scheduler of the current run (created on first use)"""
+    if _scheduler is None:
+        return start_scheduler()
+    return _scheduler
+
 
 async def get_session() -> ClientSession:
     """
@@ -28,8 +64,8 @@ async def get_session() -> ClientSession:
     async with _session_lock:
         if _session is None or _session.closed:
             connector = TCPConnector(
-                limit=300,  # Total connections (optimized for 25 workers)
-                limit_per_host=100,  # Per host limit (review API needs high concurrency)
+                limit=config.CONNECTOR_LIMIT,  # Total connections (scheduler global budget stays below)
+                limit_per_host=config.CONNECTOR_LIMIT_PER_HOST,  # Per host limit (review API needs high concurrency)
                 ttl_dns_cache=600,  # DNS cache (longer for performance)
                 enable_cleanup_closed=True,
                 force_close=False  # Reuse connections for better performance
@@ -53,55 +89,219 @@ async def close_session():
         logger.info("Closed aiohttp session")
 
 
+def configure_response_cache(mode: str = None) -> Optional[ResponseCache]:
+    """
+    Enable the on-disk response cache for every async request
+    
+    Args:
+        mode: off | cache | record | replay (default config.RESPONSE_CACHE_MODE)
+        
+    Returns:
+        The active cache, or None when disabled
+    """
+    global _response_cache
+    mode = mode or config.RESPONSE_CACHE_MODE
+    _response_cache = None if mode == "off" else ResponseCache(mode=mode)
+    return _response_cache
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Active response cache or None"""
+    return _response_cache
+
+
+async def _fetch(url: str, validators: Optional[ValidatorStore], cache: Optional[ResponseCache]):
+    """One GET on the pooled session (caller holds the concurrency slot)"""
+    session = await get_session()
+    logger.info(f"[ASYNC] Requesting: {url}")
+    
+    if validators is None:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            text = await response.text()
+            logger.success(f"[ASYNC] Success: {url}")
+            if cache is not None:
+                await cache.put(url, text)
+            return text
+    
+    # A URL that reaches the network with the cache on (record mode, or a miss
+    # in cache mode) must come back with its body so it can be stored: no
+    # conditional headers, no hash short cut; its validators are still refreshed
+    conditional = cache is None
+    headers = validators.request_headers(url) if conditional else {}
+    async with session.get(url, headers=headers) as response:
+        if response.status == 304:
+            validators.not_modified += 1
+            logger.info(f"[ASYNC] Not modified (304): {url}")
+            return NOT_MODIFIED
+        
+        response.raise_for_status()
+        body = await response.read()
+        digest = body_hash(body)
+        if conditional and validators.is_unchanged(url, digest):
+            validators.not_modified += 1
+            logger.info(f"[ASYNC] Unchanged body: {url}")
+            return NOT_MODIFIED
+        
+        validators.stage(
+            url,
+            response.headers.get('ETag'),
+            response.headers.get('Last-Modified'),
+            digest
+        )
+        logger.success(f"[ASYNC] Success: {url}")
+        text = body.decode(response.get_encoding(), errors='replace')
+        if cache is not None:
+            await cache.put(url, text)
+        return text
+
+
 @retry(
     stop=stop_after_attempt(config.MAX_RETRIES),
     wait=wait_exponential(multiplier=1, min=2, max=10),
     reraise=True
 )
-async def make_request_async(url: str, delay: float = None) -> Optional[str]:
+async def make_request_async(
+    url: str,
+    validators: ValidatorStore = None,
+    stage: str = None
+):
     """
-    Make async HTTP request with retry logic and anti-block measures
+    Make async HTTP request with retry logic, scheduled by the run's scheduler
+    
+    Each attempt waits until the host's bucket has a token due, takes the
+    stage, host and global slots, then the token; the slots are held only
+    for the time it is on the wire (see utils.scheduler).
     
     Args:
         url: URL to fetch
-        delay: Delay before request (with jitter)
+        validators: Optional validator store enabling conditional GET
+            (unconditional while a response cache is active, so every
+            fetched body is cached for replay)
+        stage: Stage budget the request borrows from (utils.scheduler.STAGE_*)
         
     Returns:
-        Response text or None
+        Response text, NOT_MODIFIED (304 or unchanged body hash) or None
     """
+    cache = _response_cache
+    if cache is not None:
+        cached = await cache.get(url)
+        if cached is not None:
+            logger.debug(f"[CACHE] Hit: {url}")
+            return cached
+        if cache.replay:
+            logger.warning(f"[CACHE] Replay miss (no network): {url}")
+            return None
+    
     try:
-        # Add random jitter to delay (±20%)
-        if delay is None:
-            delay = config.REQUEST_DELAY
-        
-        jitter = delay * random.uniform(-0.2, 0.2)
-        await asyncio.sleep(delay + jitter)
-        
-        session = await get_session()
-        logger.info(f"[ASYNC] Requesting: {url}")
-        
-        async with session.get(url) as response:
-            response.raise_for_status()
-            text = await response.text()
-            logger.success(f"[ASYNC] Success: {url}")
-            return text
+        async with get_scheduler().request(url, stage):
+            return await _fetch(url, validators, cache)
             
     except Exception as e:
         logger.error(f"[ASYNC] Error {url}: {str(e)}")
         raise
 
 
-async def make_request_with_semaphore(url: str, semaphore: asyncio.Semaphore, delay: float = None) -> Optional[str]:
+async def fetch_pages_async(
+    page_url: Callable[[int], str],
+    parse_page: Callable[[str], Any],
+    stage: str = STAGE_LISTING,
+    max_pages: int = None,
+    lookahead: int = None,
+    key: Callable[[Any], Any] = None
+) -> List[Any]:
     """
-    Make async request with semaphore for concurrency control
+    Fetch every page of a paginated collection concurrently
+    
+    Page 1 is fetched first. If its pagination block gives the last page
+    number, pages 2..last are fetched concurrently. Otherwise pages are
+    fetched speculatively `lookahead` at a time ahead of the page being
+    parsed, stopping at the first empty page.
     
     Args:
-        url: URL to fetch
-        semaphore: Semaphore to limit concurrency
-        delay: Delay before request
+        page_url: Builds the URL of a page number
+        parse_page: Parses HTML into (items, last_page or None), may be async
+        stage: Scheduler stage the page requests borrow from
+        max_pages: Safety limit on pages
+        lookahead: Pages kept in flight when the page count is unknown
+        key: Optional item key used to drop items repeated across pages
         
     Returns:
-        Response text or None
+        Items of all pages in page order
     """
-    async with semaphore:
-        return await make_request_async(url, delay)
+    max_pages = max_pages or config.LISTING_MAX_PAGES
+    lookahead = lookahead or config.LISTING_LOOKAHEAD_PAGES
+    
+    async def fetch(page: int) -> Optional[Tuple[List[Any], Optional[int]]]:
+        url = page_url(page)
+        try:
+            html = await make_request_async(url, stage=stage)
+        except Exception as exc:
+            logger.error(f"[PAGINATION] Error page {page} {url}: {exc}")
+            return None
+        if not html:
+            return None
+        parsed = parse_page(html)
+        if inspect.isawaitable(parsed):
+            parsed = await parsed
+        return parsed
+    
+    items: List[Any] = []
+    seen = set()
+    
+    def collect(page_items: List[Any]) -> int:
+        """Append unseen items and return how many were new"""
+        added = 0
+        for item in page_items:
+            if key is not None:
+                item_key = key(item)
+                if item_key in seen:
+                    continue
+                seen.add(item_key)
+            items.append(item)
+            added += 1
+        return added
+    
+    first = await fetch(1)
+    if not first or not first[0]:
+        return items
+    
+    first_items, last_page = first
+    collect(first_items)
+    
+    if last_page:
+        # Known page count: fan out every remaining page at once
+        last_page = min(last_page, max_pages)
+        pages = list(range(2, last_page + 1))
+        logger.info(f"[PAGINATION] {last_page} pages, fetching {len(pages)} concurrently")
+        results = await asyncio.gather(*(fetch(page) for page in pages))
+        for page, result in zip(pages, results):
+            if result is None:
+                logger.warning(f"[PAGINATION] Page {page} failed, skipping")
+                continue
+            collect(result[0])
+        return items
+    
+    # Unknown page count: speculative look-ahead while parsing in order
+    in_flight: Dict[int, asyncio.Task] = {}
+    next_page = 2
+    current = 2
+    try:
+        while current <= max_pages:
+            while next_page <= max_pages and next_page < current + lookahead:
+                in_flight[next_page] = asyncio.ensure_future(fetch(next_page))
+                next_page += 1
+            
+            result = await in_flight.pop(current)
+            if not result or not result[0]:
+                break
+            if collect(result[0]) == 0 and key is not None:
+                # Some storefronts repeat the last page past the end
+                break
+            current += 1
+    finally:
+        for task in in_flight.values():
+            task.cancel()
+    
+    logger.info(f"[PAGINATION] Stopped after page {current - 1}")
+    return items
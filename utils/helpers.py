@@ -8,6 +8,7 @@ from typing import Optional, Dict, Any
 from bs4 import BeautifulSoup
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 from utils.logger import get_logger
+from utils.html_parser import as_document
 import config
 
 logger = get_logger()
@@ -85,6 +86,37 @@ def parse_html(html_content: str) -> Optional[BeautifulSoup]:
         return None
 
 
+def extract_last_page(soup) -> Optional[int]:
+    """
+    Đọc số trang cuối từ khối pagination của trang collection
+    
+    Args:
+        soup: BeautifulSoup object hoặc document (utils.html_parser) của trang đầu tiên
+        
+    Returns:
+        Số trang cuối hoặc None nếu không có khối pagination
+    """
+    doc = as_document(soup)
+    containers = doc.select("pagination")
+    if not containers:
+        return None
+    
+    last_page = None
+    for container in containers:
+        for link in doc.select("pagination_links", container):
+            match = re.search(r"[?&]page=(\d+)", doc.attr(link, "href", ""))
+            if match:
+                page = int(match.group(1))
+                last_page = page if last_page is None else max(last_page, page)
+        for elem in doc.select("pagination_items", container):
+            text = doc.text(elem)
+            if text.isdigit():
+                page = int(text)
+                last_page = page if last_page is None else max(last_page, page)
+    
+    return last_page
+
+
 def read_brands_from_file(file_path: str = config.BRANDS_FILE) -> list:
     """
     Đọc danh sách brands từ file brands.txt
@@ -134,6 +166,22 @@ def normalize_brand_name(brand: str) -> str:
     return normalized
 
 
+def brand_key(brand: Optional[str]) -> Optional[str]:
+    """
+    Khóa brand lưu vào listing_api.brand_id
+    Khớp với raw.normalize_brand_key trong database.sql
+    
+    Args:
+        brand: Tên brand (có thể None)
+        
+    Returns:
+        Tên brand đã chuẩn hóa (tối đa 100 ký tự), None nếu rỗng
+    """
+    if not brand:
+        return None
+    return normalize_brand_name(brand)[:100] or None
+
+
 def format_price(price_str: str) -> float:
     """
     Giữ tương thích cũ - trả về số từ chuỗi giá.
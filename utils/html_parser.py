@@ -0,0 +1,201 @@
+"""
+Pluggable HTML parser backends
+
+Parsers are written once against a small document API (select / select_one
+/ text / attr) using named selectors. Each backend implements the names:
+
+    lxml - raw lxml tree + precompiled XPath (default, fastest)
+    bs4  - BeautifulSoup(lxml) + the original CSS selectors, optionally
+           restricted to the page regions that matter (SoupStrainer)
+
+Every XPath mirrors the soupsieve semantics of its CSS selector (document
+order, descendant-only scope, ancestors may lie outside the scope) and
+text() mirrors get_text(strip=True), so both backends return the same data.
+"""
+from typing import Any, Dict, List, Optional
+
+from bs4 import BeautifulSoup, SoupStrainer
+from lxml import etree
+
+from utils.logger import get_logger
+import config
+
+logger = get_logger()
+
+BACKENDS = ("lxml", "bs4")
+
+
+def _cls(name: str) -> str:
+    """XPath predicate equivalent to the CSS class selector .name"""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# name -> (CSS selector used by bs4, equivalent XPath used by lxml)
+SELECTORS: Dict[str, tuple] = {
+    # thegioiskinfood product page
+    "product_name": ("h1.page-product-info-title", f"//h1[{_cls('page-product-info-title')}]"),
+    "product_brand": ("a.fill-vendor span", f"//span[ancestor::a[{_cls('fill-vendor')}]]"),
+    "product_old_price": (".page-product-info-oldprice span", f"//span[ancestor::*[{_cls('page-product-info-oldprice')}]]"),
+    "product_new_price": (".page-product-info-newprice span", f"//span[ancestor::*[{_cls('page-product-info-newprice')}]]"),
+    "product_bought": (".sold-qtt strong", f"//strong[ancestor::*[{_cls('sold-qtt')}]]"),
+    "product_variants": ("#product-select option", "//option[ancestor::*[@id='product-select']]"),
+
+    # lamthaocosmetics collection page
+    "lamthao_card": ("div.product-inner", f"//div[{_cls('product-inner')}]"),
+    "lamthao_card_title": ("h3.titleproduct a", f".//a[ancestor::h3[{_cls('titleproduct')}]]"),
+
+    # thegioiskinfood collection page
+    "skin_card": ("div.proLoop", f"//div[{_cls('proLoop')}]"),
+    "skin_card_title": ("p.productName a", f".//a[ancestor::p[{_cls('productName')}]]"),
+    "skin_card_vendor": (".loopvendor .fill-vendor", f".//*[{_cls('fill-vendor')}][ancestor::*[{_cls('loopvendor')}]]"),
+    "skin_card_review": ("[data-product-id]", ".//*[@data-product-id]"),
+    "skin_card_favorite": ("button.js-favorites[data-id]", f".//button[{_cls('js-favorites')}][@data-id]"),
+
+    # Pagination block (both sites)
+    "pagination": (
+        ".pagination, #pagination, .paginate, .pagination-custom",
+        f"//*[{_cls('pagination')} or @id='pagination' or {_cls('paginate')} or {_cls('pagination-custom')}]",
+    ),
+    "pagination_links": ("a[href]", ".//a[@href]"),
+    "pagination_items": ("a, span", ".//*[self::a or self::span]"),
+}
+
+_XPATHS = {name: etree.XPath(xpath) for name, (_, xpath) in SELECTORS.items()}
+
+# Strings bs4 does not return from get_text() (Script / Stylesheet / TemplateString / Comment)
+_TEXT_XPATH = etree.XPath(".//text()[not(ancestor::script or ancestor::style or ancestor::template)]")
+
+# Regions kept by the bs4 SoupStrainer, per page type: (tag or None, class, id)
+PAGE_REGIONS: Dict[str, List[tuple]] = {
+    "product": [
+        ("h1", "page-product-info-title", None),
+        ("a", "fill-vendor", None),
+        (None, "page-product-info-oldprice", None),
+        (None, "page-product-info-newprice", None),
+        (None, "sold-qtt", None),
+        (None, None, "product-select"),
+    ],
+    "listing": [
+        ("div", "product-inner", None),
+        ("div", "proLoop", None),
+        (None, "pagination", None),
+        (None, None, "pagination"),
+        (None, "paginate", None),
+        (None, "pagination-custom", None),
+    ],
+}
+
+
+def _region_strainer(page_type: str) -> Optional[SoupStrainer]:
+    regions = PAGE_REGIONS.get(page_type)
+    if not regions:
+        return None
+
+    def keep(name, attrs) -> bool:
+        classes = (attrs.get("class") or "")
+        if isinstance(classes, str):
+            classes = classes.split()
+        for tag, css_class, element_id in regions:
+            if tag and name != tag:
+                continue
+            if css_class and css_class not in classes:
+                continue
+            if element_id and attrs.get("id") != element_id:
+                continue
+            return True
+        return False
+
+    return SoupStrainer(keep)
+
+
+class SoupDocument:
+    """BeautifulSoup backend"""
+
+    backend = "bs4"
+
+    def __init__(self, soup: BeautifulSoup):
+        self.root = soup
+
+    def select(self, name: str, node=None) -> List[Any]:
+        return (node if node is not None else self.root).select(SELECTORS[name][0])
+
+    def select_one(self, name: str, node=None):
+        return (node if node is not None else self.root).select_one(SELECTORS[name][0])
+
+    @staticmethod
+    def text(node) -> str:
+        return node.get_text(strip=True)
+
+    @staticmethod
+    def attr(node, name: str, default=None):
+        return node.get(name, default)
+
+
+class LxmlDocument:
+    """Raw lxml backend with precompiled XPath"""
+
+    backend = "lxml"
+
+    def __init__(self, root):
+        self.root = root
+
+    def select(self, name: str, node=None) -> List[Any]:
+        return _XPATHS[name](node if node is not None else self.root)
+
+    def select_one(self, name: str, node=None):
+        found = _XPATHS[name](node if node is not None else self.root)
+        return found[0] if found else None
+
+    @staticmethod
+    def text(node) -> str:
+        return "".join(part.strip() for part in _TEXT_XPATH(node))
+
+    @staticmethod
+    def attr(node, name: str, default=None):
+        return node.get(name, default)
+
+
+_LXML_PARSER = etree.HTMLParser()
+
+
+def parse_document(html_content: str, page_type: str = None, backend: str = None):
+    """
+    Parse HTML with the configured backend
+
+    Args:
+        html_content: HTML content string
+        page_type: "product" | "listing" - lets the bs4 backend keep only those regions
+        backend: "lxml" | "bs4" (default config.HTML_PARSER_BACKEND)
+
+    Returns:
+        SoupDocument / LxmlDocument, or None if parsing failed
+    """
+    backend = backend or config.HTML_PARSER_BACKEND
+    try:
+        if backend == "lxml":
+            try:
+                root = etree.fromstring(html_content, _LXML_PARSER)
+            except ValueError:
+                # str with an encoding declaration
+                root = etree.fromstring(html_content.encode("utf-8"), _LXML_PARSER)
+            if root is None:
+                return None
+            return LxmlDocument(root)
+
+        if backend == "bs4":
+            parse_only = _region_strainer(page_type) if config.HTML_PARSE_ONLY_REGIONS else None
+            return SoupDocument(BeautifulSoup(html_content, "lxml", parse_only=parse_only))
+
+        raise ValueError(f"Unknown HTML parser backend: {backend}")
+    except ValueError:
+        raise
+    except Exception as e:
+        logger.error(f"Error parsing HTML: {str(e)}")
+        return None
+
+
+def as_document(soup_or_document):
+    """Accept a BeautifulSoup object (legacy callers) or a parsed document"""
+    if isinstance(soup_or_document, BeautifulSoup):
+        return SoupDocument(soup_or_document)
+    return soup_or_document
@@ -0,0 +1,83 @@
+"""
+Process pool for the CPU-bound parse stage
+
+Parse functions are plain module-level callables taking the response body
+and returning plain dicts, so they can run in a worker process while the
+event loop keeps downloading. Small bodies are parsed inline because the
+pickling round trip would cost more than the parse itself.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from utils.logger import get_logger
+import config
+
+logger = get_logger()
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def start_parse_pool(workers: int = None) -> Optional[ProcessPoolExecutor]:
+    """
+    Start the parse worker pool (idempotent)
+
+    Args:
+        workers: Worker processes (default config.PARSE_WORKERS, None = all cores, 0 = inline)
+
+    Returns:
+        The executor, or None when parsing stays inline
+    """
+    global _executor
+    if _executor is not None:
+        return _executor
+
+    workers = config.PARSE_WORKERS if workers is None else workers
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 0:
+        logger.info("[PARSE POOL] Disabled, parsing inline")
+        return None
+
+    # spawn: the parent already runs DB threads, forking them is unsafe
+    _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    logger.info(f"[PARSE POOL] Started {workers} parse workers")
+    return _executor
+
+
+def shutdown_parse_pool():
+    """Stop the parse worker pool"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+        logger.info("[PARSE POOL] Stopped parse workers")
+
+
+async def run_parse(fn, body, *args):
+    """
+    Run fn(body, *args) in the parse pool, or inline for small bodies / no pool
+
+    Args:
+        fn: Module-level parse function (must be picklable)
+        body: Response body (str or bytes)
+        *args: Extra picklable arguments
+
+    Returns:
+        Whatever fn returns (plain dicts / lists)
+    """
+    global _executor
+    executor = _executor
+    if executor is None or len(body) < config.PARSE_POOL_MIN_BYTES:
+        return fn(body, *args)
+
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor, fn, body, *args)
+    except BrokenProcessPool:
+        logger.error("[PARSE POOL] Worker pool broken, falling back to inline parsing")
+        _executor = None
+        return fn(body, *args)
@@ -0,0 +1,216 @@
+"""
+On-disk compressed HTTP response cache
+
+Bodies are stored compressed (zstd when the optional `zstandard` package
+is installed, gzip otherwise) under a file named after the SHA-256 of the
+URL. Entries expire after a TTL and the cache is kept under a size budget
+by evicting least recently used entries. Compression and file I/O run
+in worker threads (asyncio.to_thread) so they never block the event loop.
+
+Modes:
+    cache  - serve fresh entries, fetch and store misses
+    record - always fetch, store every response
+    replay - serve from the cache only (ignores TTL), never hit the network
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from utils.logger import get_logger
+import config
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency
+    zstandard = None
+
+logger = get_logger()
+
+MODES = ("off", "cache", "record", "replay")
+
+
+class ResponseCache:
+    """Content-addressed, compressed, TTL + LRU bounded response cache"""
+
+    def __init__(self, directory: str = None, mode: str = None, ttl: float = None, max_bytes: int = None):
+        """
+        Args:
+            directory: Cache directory
+            mode: cache | record | replay
+            ttl: Seconds before an entry is stale (not applied in replay)
+            max_bytes: Size budget of the compressed entries
+        """
+        self.directory = directory or config.RESPONSE_CACHE_DIR
+        self.mode = mode or config.RESPONSE_CACHE_MODE
+        self.ttl = ttl if ttl is not None else config.RESPONSE_CACHE_TTL
+        self.max_bytes = max_bytes or config.RESPONSE_CACHE_MAX_BYTES
+
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown response cache mode: {self.mode}")
+
+        self.suffix = ".zst" if zstandard else ".gz"
+        self.hits = 0
+        self.misses = 0
+
+        # key -> (path, size); order = least recently used first
+        self._entries: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._total_bytes = 0
+        self._scan()
+
+    @property
+    def replay(self) -> bool:
+        return self.mode == "replay"
+
+    def _scan(self):
+        """Index existing entries, oldest first"""
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith((".zst", ".gz")):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    found.append((stat.st_mtime, name.split(".")[0], path, stat.st_size))
+        for _, key, path, size in sorted(found):
+            self._entries[key] = (path, size)
+            self._total_bytes += size
+        logger.info(
+            f"[CACHE] {self.mode} mode, {len(self._entries)} entries "
+            f"({self._total_bytes / 1_048_576:.1f} MB) in {self.directory}"
+        )
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    def _compress(self, body: bytes) -> bytes:
+        if zstandard:
+            return zstandard.ZstdCompressor(level=3).compress(body)
+        return gzip.compress(body, compresslevel=5)
+
+    @staticmethod
+    def _decompress(path: str, data: bytes) -> bytes:
+        if path.endswith(".zst"):
+            if zstandard is None:
+                raise RuntimeError("zstandard is required to read .zst cache entries")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+    def _read(self, path: str) -> Optional[bytes]:
+        """Decompressed body of an entry file, None when stale (worker thread)"""
+        if not self.replay and time.time() - os.path.getmtime(path) > self.ttl:
+            return None
+        with open(path, "rb") as handle:
+            return self._decompress(path, handle.read())
+
+    def _write(self, path: str, body: str) -> int:
+        """Compress a body into an entry file, returns its size (worker thread)"""
+        data = self._compress(body.encode("utf-8"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as handle:
+            handle.write(data)
+        os.replace(tmp_path, path)
+        return len(data)
+
+    @staticmethod
+    def _remove(paths: List[str]):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    async def get(self, url: str) -> Optional[str]:
+        """
+        Cached body of a URL, None on miss or stale entry
+
+        File I/O and decompression run in a worker thread; the LRU index is
+        only touched on the event loop.
+        """
+        if self.mode == "record":
+            return None
+
+        key = self.key(url)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        path, _ = entry
+        try:
+            body = await asyncio.to_thread(self._read, path)
+        except (OSError, RuntimeError, EOFError) as exc:
+            logger.warning(f"[CACHE] Unreadable entry for {url}: {exc}")
+            if self._entries.get(key) == entry:
+                await asyncio.to_thread(self._remove, self._drop(key))
+            self.misses += 1
+            return None
+        if body is None:
+            self.misses += 1
+            return None
+
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        self.hits += 1
+        return body.decode("utf-8", errors="replace")
+
+    async def put(self, url: str, body: str):
+        """Store a response body and evict LRU entries over the size budget"""
+        if self.replay:
+            return
+
+        key = self.key(url)
+        path = self._path(key, self.suffix)
+        size = await asyncio.to_thread(self._write, path, body)
+
+        stale = self._drop(key, keep=path)
+        self._entries[key] = (path, size)
+        self._total_bytes += size
+        stale += self._evict()
+        if stale:
+            await asyncio.to_thread(self._remove, stale)
+
+    def _drop(self, key: str, keep: str = None) -> List[str]:
+        """Unindex an entry, returns the file to remove"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return []
+        path, size = entry
+        self._total_bytes -= size
+        return [] if path == keep else [path]
+
+    def _evict(self) -> List[str]:
+        """Unindex LRU entries over the size budget, returns their files"""
+        stale = []
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            stale += self._drop(next(iter(self._entries)))
+        return stale
+
+    def stats(self) -> str:
+        return (
+            f"{self.hits} hits, {self.misses} misses, {len(self._entries)} entries "
+            f"({self._total_bytes / 1_048_576:.1f} MB)"
+        )
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser):
+    """--cache / --record / --replay flags shared by the entry points"""
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--cache", dest="cache_mode", action="store_const", const="cache",
+                       help="Serve fresh responses from the on-disk cache, store misses")
+    group.add_argument("--record", dest="cache_mode", action="store_const", const="record",
+                       help="Fetch everything and record responses to the cache")
+    group.add_argument("--replay", dest="cache_mode", action="store_const", const="replay",
+                       help="Serve responses from the cache only, no network")
+    parser.set_defaults(cache_mode=config.RESPONSE_CACHE_MODE)
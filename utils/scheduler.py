@@ -0,0 +1,237 @@
+"""
+Run-wide request scheduler
+
+One scheduler per run owns every request budget; crawl stages borrow from
+it instead of creating their own semaphores:
+
+    rate    per-host token bucket (config.HOST_RATE_LIMITS)
+    stage   in-flight requests of a stage across all brands (config.STAGE_CONCURRENCY)
+    host    in-flight requests per host (AIMD, or a fixed limit)
+    global  in-flight requests of the whole run, never above the connector pool
+
+A request first waits (without holding anything) until its host has a token
+due, then takes its slots in the fixed order stage -> host -> global and only
+then takes the token. If another request took the token during the slot
+wait, the slots are released while it sleeps until its reserved token is
+due: slots are held only while a request is on the wire, and time spent
+queueing for a slot never burns rate budget. The time on the wire is
+recorded per stage (count, errors, and p50 / p95 over the last
+config.LATENCY_SAMPLES requests).
+"""
+import asyncio
+import contextlib
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Union
+from urllib.parse import urlparse
+
+from utils.adaptive_concurrency import AdaptiveLimiter
+from utils.logger import get_logger
+import config
+
+logger = get_logger()
+
+# Stage names used by the crawlers
+STAGE_LISTING = "listing"
+STAGE_PRODUCT = "product"
+STAGE_REVIEW = "review"
+
+
+def percentile(values: Iterable[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile, None without values"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[int(fraction * (len(ordered) - 1))]
+
+
+# Loop timers may fire up to a clock tick early; a token due within this is due now
+_CLOCK_SLACK = 0.001
+
+
+class TokenBucket:
+    """
+    Token bucket: `rate` requests per second on average, bursts up to `burst`
+
+    Waiting and taking are separate: wait() sleeps until a token is due
+    without taking it, reserve() takes one (the balance may go negative) and
+    says how long until it is due. Every request reserves exactly one token,
+    so the target rate holds no matter how many callers share the bucket.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = None
+
+    def _refill(self):
+        now = asyncio.get_running_loop().time()
+        if self.updated is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def wait(self):
+        """Sleep until a token is available (does not take it)"""
+        self._refill()
+        if self.tokens < 1:
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def reserve(self) -> float:
+        """Take a token; seconds until it is due (0 = send now)"""
+        self._refill()
+        self.tokens -= 1
+        delay = -self.tokens / self.rate
+        return delay if delay > _CLOCK_SLACK else 0.0
+
+
+class Budget:
+    """Fixed in-flight budget that remembers its peak usage"""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.in_flight = 0
+        self.peak = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        async with self._semaphore:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+    def stats(self) -> str:
+        return f"{self.name}: limit {self.limit}, peak {self.peak}"
+
+
+class RequestScheduler:
+    """Global, per-host and per-stage request budgets of one run"""
+
+    def __init__(self, global_limit: int = None, stage_limits: Dict[str, int] = None):
+        global_limit = global_limit or config.MAX_GLOBAL_REQUESTS
+        self.global_budget = Budget("global", min(global_limit, config.CONNECTOR_LIMIT))
+        self.stage_limits = stage_limits or config.STAGE_CONCURRENCY
+        self.stages: Dict[str, Budget] = {}
+        self.hosts: Dict[str, Union[AdaptiveLimiter, Budget]] = {}
+        self.rates: Dict[str, TokenBucket] = {}
+        self.latencies: Dict[str, Deque[float]] = {}
+        self.requests: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.spans: Dict[str, List[float]] = {}
+
+    def rate(self, host: str) -> TokenBucket:
+        """Token bucket of a host"""
+        bucket = self.rates.get(host)
+        if bucket is None:
+            rate, burst = config.HOST_RATE_LIMITS.get(host, config.DEFAULT_HOST_RATE_LIMIT)
+            bucket = self.rates[host] = TokenBucket(rate, burst)
+        return bucket
+
+    def host(self, host: str) -> Union[AdaptiveLimiter, Budget]:
+        """In-flight limit of a host, capped by the connector per-host pool"""
+        limiter = self.hosts.get(host)
+        if limiter is None:
+            maximum = min(config.AIMD_MAX_LIMIT, config.CONNECTOR_LIMIT_PER_HOST)
+            if config.ADAPTIVE_CONCURRENCY:
+                limiter = AdaptiveLimiter(host, maximum=maximum)
+            else:
+                limiter = Budget(host, maximum)
+            self.hosts[host] = limiter
+        return limiter
+
+    def stage(self, name: str) -> Optional[Budget]:
+        """Run-wide budget of a stage, None for stages without a limit"""
+        budget = self.stages.get(name)
+        if budget is None and name in self.stage_limits:
+            budget = self.stages[name] = Budget(name, self.stage_limits[name])
+        return budget
+
+    async def _hold_slots(self, host: str, stage: Optional[str]) -> contextlib.AsyncExitStack:
+        """Take stage -> host -> global slots; closing the returned stack releases them"""
+        slots = contextlib.AsyncExitStack()
+        try:
+            stage_budget = self.stage(stage) if stage else None
+            if stage_budget is not None:
+                await slots.enter_async_context(stage_budget.slot())
+            await slots.enter_async_context(self.host(host).slot())
+            await slots.enter_async_context(self.global_budget.slot())
+        except BaseException:
+            await slots.aclose()
+            raise
+        return slots
+
+    @contextlib.asynccontextmanager
+    async def request(self, url: str, stage: str = None):
+        """Wait for the host's token, then hold stage / host / global slots while on the wire"""
+        host = urlparse(url).hostname or ""
+        bucket = self.rate(host)
+        await bucket.wait()
+        slots = await self._hold_slots(host, stage)
+        delay = bucket.reserve()
+        if delay:
+            # Token went to another request during the slot wait: sleep without holding slots
+            await slots.aclose()
+            await asyncio.sleep(delay)
+            slots = await self._hold_slots(host, stage)
+
+        limiter = self.host(host)
+        adaptive = limiter if isinstance(limiter, AdaptiveLimiter) else None
+        async with slots:
+            # On the wire from here: this is the latency the AIMD limiter and the stats see
+            loop = asyncio.get_running_loop()
+            key = stage or ""
+            epoch = adaptive.epoch if adaptive is not None else 0
+            start = loop.time()
+            span = self.spans.setdefault(key, [start, start])
+            try:
+                yield
+            except Exception as exc:
+                self.errors[key] = self.errors.get(key, 0) + 1
+                if adaptive is not None:
+                    adaptive.record(epoch, None, exc)
+                raise
+            finally:
+                span[1] = max(span[1], loop.time())
+            latency = loop.time() - start
+            if adaptive is not None:
+                adaptive.record(epoch, latency)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            latencies = self.latencies.get(key)
+            if latencies is None:
+                latencies = self.latencies[key] = deque(maxlen=config.LATENCY_SAMPLES)
+            latencies.append(latency)
+
+    def latency_stats(self, stage: str) -> Dict[str, Optional[float]]:
+        """
+        Successful requests, errors, p50 / p95 seconds on the wire and active
+        seconds (first request start to last request end) of a stage
+        """
+        latencies = self.latencies.get(stage or "", ())
+        first, last = self.spans.get(stage or "", (0.0, 0.0))
+        return {
+            "requests": self.requests.get(stage or "", 0),
+            "errors": self.errors.get(stage or "", 0),
+            "seconds": last - first,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+        }
+
+    def log_stats(self):
+        """Log the limits and peak usage of every budget"""
+        logger.info(f"[SCHEDULER] {self.global_budget.stats()}")
+        for budget in self.stages.values():
+            logger.info(f"[SCHEDULER] stage {budget.stats()}")
+        for limiter in self.hosts.values():
+            logger.info(f"[SCHEDULER] host {limiter.stats()}")
+        for stage in sorted(set(self.requests) | set(self.errors)):
+            stats = self.latency_stats(stage)
+            p50 = f"{stats['p50']:.3f}s" if stats["p50"] is not None else "n/a"
+            p95 = f"{stats['p95']:.3f}s" if stats["p95"] is not None else "n/a"
+            logger.info(
+                f"[SCHEDULER] latency {stage or 'other'}: {stats['requests']} requests, "
+                f"{stats['errors']} errors, p50 {p50}, p95 {p95}"
+            )
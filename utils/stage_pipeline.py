@@ -0,0 +1,116 @@
+"""
+Streaming stage pipeline
+
+A Stage is a bounded asyncio queue drained by a fixed number of workers.
+Handlers push their output into the next stage with `await stage.put(...)`,
+so a full downstream queue slows the upstream workers down (backpressure)
+instead of piling up work in memory.
+
+Stages are closed upstream first: close() waits until every queued item
+has been handled, then stops the workers.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+_STOP = object()
+
+
+class Stage:
+    """Bounded queue + fixed worker pool"""
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[Any], Awaitable[None]],
+        workers: int,
+        queue_size: int,
+        batch_size: int = 1
+    ):
+        """
+        Args:
+            name: Stage name (logs)
+            handler: async handler(item), or async handler(items) when batch_size > 1
+            workers: Number of concurrent workers
+            queue_size: Max queued items before put() waits
+            batch_size: Items already queued are handed over together, up to this many
+        """
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+        self.handled = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.max_queued = 0
+        self._tasks: List[asyncio.Task] = []
+        self._started: Optional[float] = None
+
+    def start(self) -> "Stage":
+        if not self._tasks:
+            self._started = asyncio.get_running_loop().time()
+            self._tasks = [
+                asyncio.create_task(self._worker(), name=f"{self.name}-{i}")
+                for i in range(self.workers)
+            ]
+        return self
+
+    async def put(self, item: Any):
+        """Enqueue an item, waiting while the queue is full"""
+        await self.queue.put(item)
+        self.max_queued = max(self.max_queued, self.queue.qsize())
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            if item is _STOP:
+                self.queue.task_done()
+                return
+
+            items = [item]
+            stop = False
+            while len(items) < self.batch_size and not self.queue.empty():
+                extra = self.queue.get_nowait()
+                if extra is _STOP:
+                    stop = True
+                    break
+                items.append(extra)
+
+            start = loop.time()
+            try:
+                await self.handler(items if self.batch_size > 1 else item)
+                self.handled += len(items)
+            except Exception as exc:
+                self.errors += len(items)
+                logger.error(f"[PIPELINE] {self.name} error: {exc}")
+            finally:
+                self.busy_seconds += loop.time() - start
+                for _ in items:
+                    self.queue.task_done()
+                if stop:
+                    self.queue.task_done()
+
+            if stop:
+                return
+
+    async def close(self):
+        """Wait for queued items, then stop the workers"""
+        await self.queue.join()
+        for _ in self._tasks:
+            await self.queue.put(_STOP)
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> str:
+        elapsed = asyncio.get_running_loop().time() - self._started if self._started else 0
+        utilization = self.busy_seconds / (elapsed * self.workers) if elapsed else 0
+        return (
+            f"{self.name}: {self.handled} items, {self.errors} errors, "
+            f"{self.workers} workers {utilization:.0%} busy, max queued {self.max_queued}"
+        )
@@ -0,0 +1,105 @@
+"""
+Validator store for conditional HTTP fetches
+
+Keeps URL -> (ETag, Last-Modified, body hash, meta) for the run. Fresh
+validators are only staged by the HTTP layer and become effective once
+the crawler commits them after a successful DB write, so a failed write
+is never hidden behind a 304 on the next run.
+"""
+import hashlib
+from typing import Dict, Any, Optional, List
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+
+def body_hash(body: bytes) -> str:
+    """Short stable hash of a response body"""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class ValidatorStore:
+    """Persistent URL -> validator map (raw.http_validator)"""
+
+    def __init__(self, rows: Optional[List[Dict[str, Any]]] = None):
+        self._validators: Dict[str, Dict[str, Any]] = {
+            row['url']: row for row in rows or []
+        }
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._changed: Dict[str, Dict[str, Any]] = {}
+        self.not_modified = 0
+
+    @classmethod
+    async def load(cls, db) -> "ValidatorStore":
+        """
+        Load every stored validator once for the run
+
+        Args:
+            db: AsyncDatabaseHandler
+        """
+        store = cls(await db.get_http_validators())
+        logger.info(f"[VALIDATORS] Loaded {len(store._validators)} validators")
+        return store
+
+    def request_headers(self, url: str) -> Dict[str, str]:
+        """If-None-Match / If-Modified-Since headers for a URL"""
+        validator = self._validators.get(url)
+        if not validator:
+            return {}
+        headers = {}
+        if validator.get('etag'):
+            headers['If-None-Match'] = validator['etag']
+        if validator.get('last_modified'):
+            headers['If-Modified-Since'] = validator['last_modified']
+        return headers
+
+    def is_unchanged(self, url: str, digest: str) -> bool:
+        """True if the body hash matches the committed one"""
+        validator = self._validators.get(url)
+        return bool(validator) and validator.get('body_hash') == digest
+
+    def stage(self, url: str, etag: Optional[str], last_modified: Optional[str], digest: str):
+        """Remember validators of a fresh response until the crawler commits them"""
+        self._pending[url] = {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "body_hash": digest,
+        }
+
+    def commit(self, url: str, meta: Optional[Dict[str, Any]] = None):
+        """
+        Make the staged validators of a URL effective
+
+        Args:
+            url: Fetched URL
+            meta: Small dict returned again on later 304s (e.g. snapshot id)
+        """
+        validator = self._pending.pop(url, None)
+        if validator is None:
+            return
+        validator["meta"] = meta
+        self._validators[url] = validator
+        self._changed[url] = validator
+
+    def meta(self, url: str) -> Optional[Dict[str, Any]]:
+        """Meta committed with the current validators of a URL"""
+        validator = self._validators.get(url)
+        return validator.get('meta') if validator else None
+
+    def changed(self) -> List[Dict[str, Any]]:
+        """Validators committed during this run (to be upserted)"""
+        return list(self._changed.values())
+
+    async def save(self, db) -> int:
+        """Persist validators committed during this run"""
+        changed = self.changed()
+        if not changed:
+            return 0
+        saved = await db.upsert_http_validators(changed)
+        logger.info(
+            f"[VALIDATORS] Saved {saved} validators "
+            f"({self.not_modified} responses not modified this run)"
+        )
+        return saved